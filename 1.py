@@ -9,6 +9,8 @@ import sys
 import os
 import zipfile
 
+from instrumentation import span, traced, export_trace, export_folded, print_trace_summary
+
 def load_data_from_zip(zip_filepath, csv_inside_zip):
     try:
         with zipfile.ZipFile(zip_filepath) as z:
@@ -41,6 +43,7 @@ def clean_data(df):
 
     return df
 
+@traced("groupby_valence")
 def analyze_valence_by_genre(df):
     """Анализ средней valence по жанрам"""
     print("\n=== Анализ средней valence по жанрам ===")
@@ -87,21 +90,33 @@ def main():
     print("=== Анализ Spotify Tracks DB ===")
     print(f"Чтение файла из архива: {csv_name}")
     
-    df = load_data_from_zip(zip_file, csv_name)
+    with span("load", file=csv_name) as load_span:
+        df = load_data_from_zip(zip_file, csv_name)
+        load_span.rows = len(df)
     
     print("\n=== Информация о данных ===")
     print(df.info())
     print("\nПервые 5 строк:")
     print(df.head())
     
-    df_clean = clean_data(df)
-    result = find_max_mean_genre(df_clean)
+    with span("clean", rows=len(df)):
+        df_clean = clean_data(df)
+    with span("analyze", rows=len(df_clean)):
+        result = find_max_mean_genre(df_clean)
     
     output_dir = 'results'
     output_file = f'{output_dir}/valence_by_genre.csv'
     os.makedirs(output_dir, exist_ok=True)
-    result.to_csv(output_file, index=False)
+    with span("save", rows=len(result)):
+        result.to_csv(output_file, index=False)
     print(f"\nРезультаты сохранены в: {output_file}")
 
+    # Трасса этапов: JSON для chrome://tracing / Perfetto и стеки для flamegraph
+    print("\n=== Время этапов ===")
+    print_trace_summary()
+    export_trace(f'{output_dir}/trace.json')
+    export_folded(f'{output_dir}/trace.folded')
+    print(f"Трасса сохранена в: {output_dir}/trace.json")
+
 if __name__ == '__main__':
     main()
@@ -6,6 +6,7 @@ import subprocess
 import os
 import io
 from hdfs import InsecureClient
+from instrumentation import span, open_span, export_trace, export_folded, print_trace_summary
 
 # Настройка отображения
 plt.style.use('seaborn-v0_8')
@@ -27,6 +28,7 @@ local_path = "/opt/database.csv"
 
 print(os.listdir("/opt"))
 
+download_span = open_span("hdfs_download", path=hdfs_path)
 try:
     # Удаляем локальный файл, если он существует (чтобы избежать ошибки "File exists")
     if os.path.exists(local_path):
@@ -53,13 +55,16 @@ except Exception as e:
     print(f"Ошибка при выполнении subprocess: {e}")
     print("Попытка использовать локальный файл ...")
     local_path = "/opt/data/database.csv"
+download_span.close()
 
 if not os.path.exists(local_path):
     print("Файл не найден. Пробуем последний вариант ...")
     local_path = "database.csv"
 
 if os.path.exists(local_path):
-    df = pd.read_csv(local_path, encoding='utf-8-sig', sep=',', quotechar='"', engine='python', on_bad_lines='skip')
+    with span("read_csv", path=local_path) as read_span:
+        df = pd.read_csv(local_path, encoding='utf-8-sig', sep=',', quotechar='"', engine='python', on_bad_lines='skip')
+        read_span.rows = len(df)
     print(f"Размер датасета: {df.shape}")
     print(f"Данные успешно загружены из {local_path}")
     print(df.head())
@@ -74,6 +79,7 @@ else:
 
 # Начинаем очистку данных под Spotify датасет
 
+clean_span = open_span("clean", rows=len(df))
 df_clean = df.copy()
 
 # Вместо 'Magnitude' теперь проверяем 'valence' (показатель позитивности трека)
@@ -100,11 +106,13 @@ df_clean['genre'] = df_clean['genre'].fillna('Unknown')
 
 print(f"Количество строк после очистки: {len(df_clean)}")
 print(f"Уникальные жанры: {df_clean['genre'].unique()}")
+clean_span.close()
 
 # Анализ valence по genre
-magnitude_by_type = df_clean.groupby('genre')['valence'].agg(['mean', 'count']).reset_index()
-magnitude_by_type.columns = ['Genre', 'Mean_Valence', 'Count']
-magnitude_by_type = magnitude_by_type.sort_values('Mean_Valence', ascending=False)
+with span("groupby_valence", rows=len(df_clean)):
+    magnitude_by_type = df_clean.groupby('genre')['valence'].agg(['mean', 'count']).reset_index()
+    magnitude_by_type.columns = ['Genre', 'Mean_Valence', 'Count']
+    magnitude_by_type = magnitude_by_type.sort_values('Mean_Valence', ascending=False)
 
 print("Средняя valence по жанрам:")
 print(magnitude_by_type)
@@ -115,6 +123,7 @@ print(f"Средняя valence: {max_type['Mean_Valence']:.3f}")
 print(f"Количество треков: {int(max_type['Count'])}")
 
 # Визуализация средней valence по жанрам (топ-10)
+plot_span = open_span("plot", figure="barh_top10")
 plt.figure(figsize=(12, 8))
 top_10 = magnitude_by_type.head(10)
 plt.barh(top_10['Genre'], top_10['Mean_Valence'])
@@ -129,14 +138,16 @@ buffer = io.BytesIO()
 plt.savefig(buffer, format='png', dpi=300)
 plt.show()  # Чтобы график отобразился в ячейке
 buffer.seek(0)
+plot_span.close()
 
 # Подключаемся к HDFS и записываем файл
 hdfs_path = '/user/hadoop/results/valence_by_genre.png'
 hdfs_dir = os.path.dirname(hdfs_path)
 client = InsecureClient('http://hadoop:9870', user='root')
-client.makedirs(hdfs_dir)
-with client.write(hdfs_path, overwrite=True) as writer:
-    writer.write(buffer.getvalue())
+with span("hdfs_upload", path=hdfs_path, bytes=buffer.getbuffer().nbytes):
+    client.makedirs(hdfs_dir)
+    with client.write(hdfs_path, overwrite=True) as writer:
+        writer.write(buffer.getvalue())
 
 print(f"График успешно сохранен и/или перезаписан в HDFS по пути: {hdfs_path}")
 
@@ -147,6 +158,7 @@ subprocess.run("hdfs dfs -ls /user/hadoop/results", shell=True)
 
 import seaborn as sns
 
+plot_span = open_span("plot", figure="seaborn_barplot")
 df_sorted = magnitude_by_type.sort_values('Mean_Valence', ascending=False)
 
 plt.style.use('seaborn-v0_8-whitegrid')
@@ -181,11 +193,20 @@ buffer = io.BytesIO()
 plt.savefig(buffer, format='png', dpi=300)
 plt.show()
 buffer.seek(0)
+plot_span.close()
 
 # Сохраняем обновленный график
-with client.write(hdfs_path, overwrite=True) as writer:
-    writer.write(buffer.getvalue())
+with span("hdfs_upload", path=hdfs_path, bytes=buffer.getbuffer().nbytes):
+    with client.write(hdfs_path, overwrite=True) as writer:
+        writer.write(buffer.getvalue())
 
 print(f"График успешно перезаписан в HDFS по пути: {hdfs_path}")
 
 subprocess.run("hdfs dfs -ls /user/hadoop/results", shell=True)
+
+# Трасса этапов запуска: JSON для chrome://tracing / Perfetto и стеки для flamegraph
+print("Время этапов:")
+print_trace_summary()
+export_trace("valence_trace.json")
+export_folded("valence_trace.folded")
+print("Трасса сохранена в valence_trace.json")
@@ -1,3 +1,195 @@
+# Инструментирование этапов: вложенные интервалы с временем, CPU, памятью и числом строк,
+# measure_time записывает каждый замер в трассу запуска
+from instrumentation import (span, traced, open_span, measure_time, span_peak_memory,
+                             export_trace, export_folded, print_trace_summary)
+import instrumentation
+
+# Пиковая память Python (tracemalloc) в интервалах главного потока. Замедляет загрузку
+# и запросы, поэтому включается только в отдельном запуске для замера памяти, а не времени
+instrumentation.TRACE_MEMORY = False
+
+print("="*60)
+print("🔧 ГЕНЕРАЦИЯ IOT ДАННЫХ")
+print("="*60)
+
+# Генерация блоками с собственными SeedSequence и процессы генерации - в модуле
+# iot_generator (функции воркера должны импортироваться в процессах forkserver/spawn)
+from iot_generator import (IOT_START_DATE, IOT_BLOCK_SIZE, iot_seed_sequence, iot_sensor_table,
+                           block_generators, generate_iot_block, generate_iot_range, iter_iot_shards)
+import os
+from collections import deque
+
+def get_device_ids(n_devices=100):
+    """Список сенсоров: n_devices устройств + 3 специальных сенсора"""
+    device_ids = [f"device_{i:03d}" for i in range(n_devices)]
+    special_devices = ["sensor_alpha", "sensor_beta", "sensor_gamma"]
+    device_ids.extend(special_devices)
+    return device_ids
+
+# Компактная схема: sensor_id - Categorical (коды int16 вместо строк Python),
+# float32 для измерений, int8 для уровня батареи, int32 для record_id
+# (как INTEGER в PostgreSQL), timestamp - datetime64[s]
+IOT_COMPACT_DTYPES = {
+    "sensor_id": np.int16,
+    "temperature": np.float32,
+    "timestamp": "datetime64[s]",
+    "humidity": np.float32,
+    "pressure": np.float32,
+    "battery_level": np.int8,
+    "record_id": np.int32
+}
+
+# Исходная (широкая) схема iot_df
+IOT_WIDE_DTYPES = {
+    "sensor_id": object,
+    "temperature": np.float64,
+    "timestamp": "datetime64[ns]",
+    "humidity": np.float64,
+    "pressure": np.float64,
+    "battery_level": np.int64,
+    "record_id": np.int64
+}
+
+def _compact_columns(columns):
+    """Приведение колонок блока к компактным типам (sensor_id остается кодами)"""
+    return {name: values.astype(IOT_COMPACT_DTYPES[name], copy=False) for name, values in columns.items()}
+
+def _sensor_column(codes, device_ids, compact=False):
+    """Колонка sensor_id из кодов: Categorical в компактной схеме, строки - в исходной"""
+    if compact:
+        return pd.Categorical.from_codes(codes, categories=device_ids)
+    return np.asarray(device_ids, dtype=object)[codes]
+
+def _iot_frame(columns, device_ids, compact=False):
+    """DataFrame из колонок блока: коды сенсоров заменяются на их идентификаторы"""
+    columns = _compact_columns(columns) if compact else dict(columns)
+    columns["sensor_id"] = _sensor_column(columns["sensor_id"], device_ids, compact)
+    return pd.DataFrame(columns)
+
+def generate_iot_data(n_records, n_devices=100, seed=None, n_workers=1, compact=False):
+    """Генерация IoT данных для сенсоров в колоночном виде (словарь массивов NumPy)"""
+    root_seq = iot_seed_sequence(seed)
+    device_ids = get_device_ids(n_devices)
+    shard_size = 16 * IOT_BLOCK_SIZE
+    
+    if n_records <= 0:
+        # Пустой набор: колонки нулевой длины с теми же типами, что и у сгенерированных
+        shards = [generate_iot_block(block_generators(root_seq, 0), np.zeros(0, dtype=np.int16), 0, 0)]
+    elif n_workers > 1:
+        shards = iter_iot_shards(root_seq, len(device_ids), n_records, shard_size, n_workers)
+    else:
+        sensor_table = iot_sensor_table(root_seq, len(device_ids))
+        shards = (generate_iot_range(root_seq, sensor_table, start, min(start + shard_size, n_records))
+                  for start in range(0, n_records, shard_size))
+    
+    # В компактном режиме шарды сужаются до склейки, чтобы не держать float64-копию всех данных
+    if compact:
+        shards = (_compact_columns(shard) for shard in shards)
+    shards = list(shards)
+    
+    iot_data = {name: np.concatenate([shard[name] for shard in shards]) for name in shards[0]}
+    iot_data["sensor_id"] = _sensor_column(iot_data["sensor_id"], device_ids, compact)
+    return iot_data
+
+def iter_iot_chunks(n_records, chunk_size=16 * IOT_BLOCK_SIZE, n_devices=100, seed=None, n_workers=1,
+                    compact=False):
+    """Потоковая генерация: DataFrame-чанки по chunk_size записей при постоянной памяти"""
+    root_seq = iot_seed_sequence(seed)
+    device_ids = get_device_ids(n_devices)
+    
+    if n_workers > 1:
+        for columns in iter_iot_shards(root_seq, len(device_ids), n_records, chunk_size, n_workers):
+            yield _iot_frame(columns, device_ids, compact)
+        return
+    
+    sensor_table = iot_sensor_table(root_seq, len(device_ids))
+    
+    for start in range(0, n_records, chunk_size):
+        stop = min(start + chunk_size, n_records)
+        yield _iot_frame(generate_iot_range(root_seq, sensor_table, start, stop), device_ids, compact)
+
+def iter_df_chunks(df, chunk_size):
+    """Чанки уже построенного DataFrame (срезы без копирования данных)"""
+    for i in range(0, len(df), chunk_size):
+        yield df.iloc[i:i+chunk_size]
+
+def to_compact_schema(df):
+    """Перевод DataFrame с IoT данными в компактную схему"""
+    df = df.astype({name: dtype for name, dtype in IOT_COMPACT_DTYPES.items() if name != "sensor_id"})
+    df["sensor_id"] = df["sensor_id"].astype("category")
+    return df
+
+def to_wide_schema(df):
+    """Перевод DataFrame с IoT данными в исходную схему (строки, float64, int64)"""
+    return df.astype(IOT_WIDE_DTYPES)
+
+def print_memory_report(df, sample_size=100000):
+    """Отчет о памяти iot_df в исходной и компактной схеме (по выборке, пересчет на все записи)"""
+    sample = df.iloc[:sample_size]
+    scale = len(df) / max(len(sample), 1)
+    wide = to_wide_schema(sample).memory_usage(index=False, deep=True) * scale / 1024**2
+    compact = to_compact_schema(sample).memory_usage(index=False, deep=True) * scale / 1024**2
+    
+    report = pd.DataFrame({'Исходная (MB)': wide, 'Компактная (MB)': compact})
+    report.loc['ИТОГО'] = report.sum()
+    report['Сжатие (раз)'] = report['Исходная (MB)'] / report['Компактная (MB)']
+    
+    print("\n💾 ПАМЯТЬ IOT_DF: ИСХОДНАЯ И КОМПАКТНАЯ СХЕМА")
+    print(report.round(2).to_string())
+    return report
+
+# Параметры данных
+n_records = 100000
+n_devices = 100  # + 3 специальных сенсора = 103 сенсора
+data_seed = 42
+
+# Потоковый режим: iot_df не строится, все потребители читают чанки генератора
+use_streaming = False
+chunk_size = 16 * IOT_BLOCK_SIZE
+
+# Число процессов генерации (1 - без пула; os.cpu_count() - все ядра)
+n_workers = 1
+
+# Компактная схема iot_df (Categorical sensor_id, float32, int8, datetime64[s])
+compact_schema = False
+
+def iot_chunk_source():
+    """Новый итератор по данным чанками - из iot_df или из потокового генератора"""
+    if use_streaming:
+        return iter_iot_chunks(n_records, chunk_size, n_devices, seed=data_seed,
+                               n_workers=n_workers, compact=compact_schema)
+    return iter_df_chunks(iot_df, chunk_size)
+
+print("🔧 Генерация IoT данных...")
+print(f"- Записей: {n_records:,}")
+print(f"- Сенсоров: {n_devices + 3}")
+print(f"- Процессов: {n_workers} (ядер: {os.cpu_count()})")
+
+if use_streaming:
+    # Данные будут сгенерированы заново при каждом проходе по iot_chunk_source()
+    iot_df = None
+    print(f"\n✅ Потоковый режим: чанки по {chunk_size:,} записей, seed={data_seed}")
+else:
+    # Генерация данных
+    with span("generation", rows=n_records, workers=n_workers, compact=compact_schema) as generation_span:
+        iot_data = generate_iot_data(n_records, n_devices, seed=data_seed, n_workers=n_workers,
+                                     compact=compact_schema)
+    generation_time = generation_span.seconds
+    iot_df = pd.DataFrame(iot_data)
+    del iot_data
+    
+    print(f"\n✅ Сгенерирован DataFrame с IoT данными:")
+    print(f"- Записей: {len(iot_df):,}")
+    print(f"- Уникальных сенсоров: {iot_df['sensor_id'].nunique()}")
+    print(f"- Время генерации: {generation_time:.4f} секунд ({n_records / generation_time:,.0f} записей/сек)")
+    print(f"- Схема: {'компактная' if compact_schema else 'исходная'}")
+    
+    print_memory_report(iot_df)
+
+
+
+
+
 print("="*60)
 print("📊 POSTGRESQL: РАБОТА С РЕЛЯЦИОННОЙ БАЗОЙ ДАННЫХ")
 print("="*60)
@@ -11,79 +203,838 @@ pg_conn_params = {
     "port": "5432"
 }
 
-def setup_postgresql():
+import threading
+from contextlib import contextmanager
+from psycopg2.pool import ThreadedConnectionPool
+from psycopg2.extensions import DECIMAL, new_type, register_type
+
+# Размер общего пула соединений PostgreSQL (не меньше pg_load_connections + 1)
+pg_pool_size = 8
+
+_pg_pool = None
+_pg_pool_slots = None
+_pg_pool_lock = threading.Lock()
+_pg_checked_out = {}
+_pg_acquire_local = threading.local()
+
+# DECIMAL/NUMERIC из PostgreSQL читаются сразу как float, а не как Decimal
+# (значения с двумя знаками после запятой, точности float достаточно)
+pg_numeric_as_float = True
+
+PG_DECIMAL_AS_FLOAT = new_type(DECIMAL.values, 'DECIMAL_AS_FLOAT',
+                               lambda value, cur: float(value) if value is not None else None)
+
+def get_pg_pool():
+    """Общий потокобезопасный пул соединений (создается при первом обращении)"""
+    global _pg_pool, _pg_pool_slots
+    with _pg_pool_lock:
+        if _pg_pool is None:
+            _pg_pool = ThreadedConnectionPool(1, pg_pool_size, **pg_conn_params)
+            _pg_pool_slots = threading.BoundedSemaphore(pg_pool_size)
+    return _pg_pool
+
+def close_pg_pool():
+    """Закрытие всех соединений пула (следующее обращение создаст пул заново)"""
+    global _pg_pool, _pg_pool_slots
+    with _pg_pool_lock:
+        if _pg_pool is not None:
+            _pg_pool.closeall()
+        _pg_pool = None
+        _pg_pool_slots = None
+
+def acquire_pg_connection():
+    """Соединение из пула; если свободных нет, поток ждет, а не получает ошибку пула"""
+    start = time.perf_counter()
+    pool = get_pg_pool()
+    slots = _pg_pool_slots
+    slots.acquire()
+    try:
+        conn = pool.getconn()
+    except Exception:
+        slots.release()
+        raise
+    with _pg_pool_lock:
+        _pg_checked_out[id(conn)] = (pool, slots)
+    if pg_numeric_as_float:
+        register_type(PG_DECIMAL_AS_FLOAT, conn)
+    # Время получения соединения копится отдельно от времени запросов (на поток)
+    _pg_acquire_local.total = getattr(_pg_acquire_local, 'total', 0.0) + time.perf_counter() - start
+    return conn
+
+def release_pg_connection(conn):
+    """Возврат соединения в пул (незавершенная транзакция откатывается пулом)"""
+    with _pg_pool_lock:
+        pool, slots = _pg_checked_out.pop(id(conn))
+    try:
+        pool.putconn(conn, close=bool(conn.closed))
+    finally:
+        slots.release()
+
+@contextmanager
+def pg_connection():
+    """Контекстный менеджер для соединения из пула"""
+    conn = acquire_pg_connection()
+    try:
+        yield conn
+    finally:
+        release_pg_connection(conn)
+
+def measure_pg_time(func, *args, **kwargs):
+    """Замер запроса к PostgreSQL: (результат, время выполнения, время получения соединения)"""
+    _pg_acquire_local.total = 0.0
+    result, elapsed = measure_time(func, *args, **kwargs)
+    acquire_time = _pg_acquire_local.total
+    return result, elapsed - acquire_time, acquire_time
+
+def run_pg_query(sql, params=None):
+    """Выполнение запроса в соединении из пула с выборкой всех строк"""
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(sql, params)
+            return cur.fetchall()
+
+import json
+
+# Вместе со временем запроса сохраняется его план выполнения (EXPLAIN ANALYZE в PostgreSQL,
+# explain executionStats в MongoDB): видно, был ли полный проход, какой индекс
+# использован и был ли сброс на диск
+capture_query_plans = True
+
+# Планы замеренных запросов: метка -> {'engine', 'time', 'metrics', 'plan'}
+query_plans = {}
+
+def record_query_plan(label, engine, elapsed, plan, metrics):
+    """Сохранение плана рядом со временем запроса"""
+    query_plans[label] = {'engine': engine, 'time': elapsed, 'metrics': metrics, 'plan': plan}
+    indexes = ", ".join(metrics['indexes']) or "нет"
+    print(f"🧭 План [{label}]: прочитано {metrics['rows_scanned']:,} строк, "
+          f"узлы {', '.join(metrics['scan_types'])}, индексы: {indexes}"
+          f"{', сброс на диск' if metrics['spill_to_disk'] else ''}")
+
+def query_plan_table():
+    """Метрики всех сохраненных планов в виде таблицы"""
+    rows = [{'query': label, 'engine': entry['engine'], 'time': entry['time'], **entry['metrics']}
+            for label, entry in query_plans.items()]
+    return pd.DataFrame(rows).set_index('query') if rows else pd.DataFrame()
+
+def explain_pg_query(sql, params=None, analyze=True):
+    """План запроса PostgreSQL в JSON (с ANALYZE запрос действительно выполняется)"""
+    options = "ANALYZE, BUFFERS, FORMAT JSON" if analyze else "FORMAT JSON"
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"EXPLAIN ({options}) {sql}", params)
+            plan = cur.fetchone()[0]
+        conn.rollback()
+    return json.loads(plan) if isinstance(plan, str) else plan
+
+def iter_pg_plan_nodes(plan):
+    """Все узлы плана PostgreSQL (обход в глубину)"""
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        yield node
+        nodes.extend(node.get('Plans', []))
+
+def summarize_pg_plan(plan):
+    """Ключевые метрики плана PostgreSQL: прочитано строк, узлы чтения, индексы, буферы, сброс на диск"""
+    root = plan[0]['Plan']
+    rows_scanned = 0
+    scan_types, indexes = set(), set()
+    spill = root.get('Temp Written Blocks', 0) > 0
+    for node in iter_pg_plan_nodes(plan):
+        if 'Relation Name' in node:
+            # Actual Rows и Rows Removed - средние на один цикл узла
+            per_loop = node.get('Actual Rows', 0) + node.get('Rows Removed by Filter', 0) \
+                + node.get('Rows Removed by Index Recheck', 0)
+            rows_scanned += int(per_loop * node.get('Actual Loops', 1))
+            scan_types.add(node['Node Type'])
+        if 'Index Name' in node:
+            indexes.add(node['Index Name'])
+        if node.get('Sort Space Type') == 'Disk' or node.get('Disk Usage', 0) > 0:
+            spill = True
+    return {
+        'rows_scanned': rows_scanned,
+        'scan_types': sorted(scan_types),
+        'indexes': sorted(indexes),
+        'buffers_hit': root.get('Shared Hit Blocks', 0),
+        'buffers_read': root.get('Shared Read Blocks', 0),
+        'spill_to_disk': spill,
+        'execution_ms': plan[0].get('Execution Time')
+    }
+
+def capture_pg_plan(label, sql, elapsed, params=None):
+    """EXPLAIN (ANALYZE, BUFFERS) для замеренного запроса PostgreSQL; ошибка плана не прерывает замеры"""
+    if not capture_query_plans:
+        return None
+    try:
+        plan = explain_pg_query(sql, params)
+        metrics = summarize_pg_plan(plan)
+    except Exception as e:
+        print(f"⚠️ Не удалось получить план {label}: {e}")
+        return None
+    record_query_plan(label, 'PostgreSQL', elapsed, plan, metrics)
+    return metrics
+
+# Размер пачки строк при потоковой выборке через серверный курсор
+pg_fetch_batch_size = 50000
+
+def _rows_to_frame(rows, columns):
+    """Пачка строк в DataFrame: строки раскладываются по столбцам NumPy в коде pandas,
+    без транспонирования в Python; числовые столбцы с NULL получают float64 (NULL -> NaN)"""
+    if not rows:
+        return pd.DataFrame(columns=columns)
+    return pd.DataFrame.from_records(rows, columns=columns, coerce_float=True)
+
+@traced("postgresql.decode")
+def cursor_to_frame(cur, batch_size=None):
+    """Результат выполненного запроса в DataFrame, чтение пачками fetchmany"""
+    batch_size = batch_size or pg_fetch_batch_size
+    columns = [desc[0] for desc in cur.description]
+    frames = []
+    while True:
+        rows = cur.fetchmany(batch_size)
+        if not rows:
+            break
+        frames.append(_rows_to_frame(rows, columns))
+    if not frames:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+def iter_pg_frames(sql, params=None, batch_size=None):
+    """Потоковая выборка через серверный (именованный) курсор: DataFrame на каждую пачку,
+    весь результат в памяти клиента не держится"""
+    batch_size = batch_size or pg_fetch_batch_size
+    with pg_connection() as conn:
+        try:
+            with conn.cursor(name=f"lab3_stream_{threading.get_ident()}") as cur:
+                cur.itersize = batch_size
+                cur.execute(sql, params)
+                while True:
+                    rows = cur.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    yield _rows_to_frame(rows, [desc[0] for desc in cur.description])
+        finally:
+            conn.rollback()
+
+def fetch_pg_frame(sql, params=None, batch_size=None):
+    """Весь результат запроса в DataFrame через серверный курсор"""
+    frames = list(iter_pg_frames(sql, params, batch_size))
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def iter_pg_sensor_chunks(batch_size=None):
+    """Строки sensor_data из PostgreSQL пачками в той же схеме, что и сгенерированные чанки"""
+    return iter_pg_frames("""
+        SELECT sensor_id, temperature, timestamp, humidity, pressure, battery_level, record_id
+        FROM sensor_data
+    """, batch_size=batch_size)
+
+# Способ загрузки в PostgreSQL: "insert" - построчный INSERT (исходный вариант),
+# "copy_text" - COPY в формате CSV, "copy_binary" - COPY в бинарном формате
+pg_load_mode = "copy_binary"
+
+# Показатели загрузки данных в обе СУБД (время, записей/сек)
+ingest_stats = {}
+
+import io
+import struct
+
+PG_COPY_COLUMNS = ['record_id', 'sensor_id', 'temperature', 'timestamp', 'humidity', 'pressure', 'battery_level']
+
+# Заголовок и признак конца потока бинарного формата COPY
+PG_BINARY_HEADER = b'PGCOPY\n\xff\r\n\x00' + struct.pack('!ii', 0, 0)
+PG_BINARY_TRAILER = struct.pack('!h', -1)
+PG_EPOCH = np.datetime64('2000-01-01T00:00:00', 'us')
+
+def _pg_binary_row_dtype(sensor_len):
+    """Структура строки бинарного COPY (big-endian) при длине sensor_id sensor_len байт"""
+    return np.dtype([
+        ('n_fields', '>i2'),
+        ('record_id_len', '>i4'), ('record_id', '>i4'),
+        ('sensor_id_len', '>i4'), ('sensor_id', f'S{sensor_len}'),
+        ('temperature_len', '>i4'), ('temperature', '>i2', (6,)),
+        ('timestamp_len', '>i4'), ('timestamp', '>i8'),
+        ('humidity_len', '>i4'), ('humidity', '>i2', (6,)),
+        ('pressure_len', '>i4'), ('pressure', '>i2', (6,)),
+        ('battery_level_len', '>i4'), ('battery_level', '>i4')
+    ])
+
+def _pg_numeric_binary(values):
+    """Бинарное представление NUMERIC со scale 2 для |x| < 10000: (ndigits, weight, sign, dscale, 2 цифры по основанию 10000)"""
+    hundredths = np.rint(np.asarray(values, dtype=np.float64) * 100).astype(np.int64)
+    magnitude = np.abs(hundredths)
+    digits = np.empty((len(hundredths), 6), dtype='>i2')
+    digits[:, 0] = 2
+    digits[:, 1] = 0
+    digits[:, 2] = np.where(hundredths < 0, 0x4000, 0)
+    digits[:, 3] = 2
+    digits[:, 4] = magnitude // 100
+    digits[:, 5] = (magnitude % 100) * 100
+    return digits
+
+def pg_binary_copy_payload(chunk):
+    """Данные чанка в бинарном формате COPY, собранные массивами NumPy без построчных кортежей.
+    
+    Строки группируются по длине sensor_id, чтобы каждая группа имела фиксированный размер
+    записи (порядок строк в таблице не важен). NULL-значения не поддерживаются.
+    """
+    sensor_codes, sensor_values = pd.factorize(chunk['sensor_id'])
+    encoded = [str(value).encode('utf-8') for value in sensor_values]
+    code_lengths = np.array([len(value) for value in encoded])
+    row_lengths = code_lengths[sensor_codes]
+    
+    timestamps = (chunk['timestamp'].to_numpy().astype('datetime64[us]') - PG_EPOCH).astype(np.int64)
+    
+    parts = [PG_BINARY_HEADER]
+    for sensor_len in np.unique(code_lengths):
+        mask = row_lengths == sensor_len
+        rows = np.empty(int(mask.sum()), dtype=_pg_binary_row_dtype(sensor_len))
+        rows['n_fields'] = len(PG_COPY_COLUMNS)
+        rows['record_id_len'] = 4
+        rows['record_id'] = chunk['record_id'].to_numpy()[mask]
+        rows['sensor_id_len'] = sensor_len
+        rows['sensor_id'] = np.array(encoded, dtype=f'S{sensor_len}')[sensor_codes[mask]]
+        for name in ('temperature', 'humidity', 'pressure'):
+            rows[f'{name}_len'] = 12
+            rows[name] = _pg_numeric_binary(chunk[name].to_numpy()[mask])
+        rows['timestamp_len'] = 8
+        rows['timestamp'] = timestamps[mask]
+        rows['battery_level_len'] = 4
+        rows['battery_level'] = chunk['battery_level'].to_numpy()[mask]
+        parts.append(rows.tobytes())
+    parts.append(PG_BINARY_TRAILER)
+    return b''.join(parts)
+
+def copy_chunk_to_postgres(cur, chunk, copy_format="binary"):
+    """Загрузка чанка в sensor_data одной командой COPY ... FROM STDIN"""
+    columns = ", ".join(PG_COPY_COLUMNS)
+    if copy_format == "binary":
+        buffer = io.BytesIO(pg_binary_copy_payload(chunk))
+        cur.copy_expert(f"COPY sensor_data ({columns}) FROM STDIN WITH (FORMAT binary)", buffer)
+    else:
+        buffer = io.StringIO()
+        chunk[PG_COPY_COLUMNS].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cur.copy_expert(f"COPY sensor_data ({columns}) FROM STDIN WITH (FORMAT csv)", buffer)
+
+def load_chunk_to_postgres(cur, chunk, load_mode):
+    """Загрузка одного чанка выбранным способом (insert / copy_text / copy_binary)"""
+    if load_mode == "insert":
+        for _, row in chunk.iterrows():
+            cur.execute("""
+                INSERT INTO sensor_data (record_id, sensor_id, temperature, timestamp, humidity, pressure, battery_level)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+            """, (
+                row['record_id'], row['sensor_id'], row['temperature'], 
+                row['timestamp'], row['humidity'], row['pressure'], row['battery_level']
+            ))
+    else:
+        copy_chunk_to_postgres(cur, chunk, "binary" if load_mode == "copy_binary" else "text")
+
+# Параллельная загрузка: число соединений, каждое загружает свои чанки (диапазоны record_id)
+pg_load_connections = 4
+
+# Первичный ключ и индексы строятся после загрузки (быстрее, чем поддерживать их при вставке)
+pg_defer_indexes = True
+
+# Параметры параллельного построения индексов
+pg_parallel_index_workers = 4
+pg_maintenance_work_mem = '512MB'
+
+from concurrent.futures import ThreadPoolExecutor
+
+# Для секционированной таблицы ключ обязан включать ключ секционирования (timestamp)
+PG_PRIMARY_KEY = "ALTER TABLE sensor_data ADD CONSTRAINT sensor_data_pkey PRIMARY KEY ({columns})"
+
+PG_SENSOR_INDEXES = {
+    "idx_sensor_data_sensor_id": "CREATE INDEX idx_sensor_data_sensor_id ON sensor_data(sensor_id)",
+    "idx_sensor_data_timestamp": "CREATE INDEX idx_sensor_data_timestamp ON sensor_data(timestamp)",
+    "idx_sensor_data_temperature": "CREATE INDEX idx_sensor_data_temperature ON sensor_data(temperature)"
+}
+
+# Составной индекс для поиска максимума по сенсору пробами индекса (skip scan):
+# строится, если он включен явно или выбран источник "skip_scan"
+pg_sensor_temperature_index = False
+
+PG_SENSOR_TEMPERATURE_INDEX = {
+    "idx_sensor_data_sensor_temperature":
+        "CREATE INDEX idx_sensor_data_sensor_temperature ON sensor_data(sensor_id, temperature DESC)"
+}
+
+# Профиль индексов sensor_data: "btree" - исходные B-tree индексы,
+# "brin" - BRIN по timestamp (крошечный, дешев при вставке, эффективен при
+# корреляции timestamp с физическим порядком строк) и B-tree по sensor_id,
+# "covering" - индексы с INCLUDE для index-only scan агрегатов по сенсору и по времени
+pg_index_profile = "btree"
+
+PG_INDEX_PROFILES = {
+    "btree": PG_SENSOR_INDEXES,
+    "brin": {
+        "idx_sensor_data_sensor_id": "CREATE INDEX idx_sensor_data_sensor_id ON sensor_data(sensor_id)",
+        "idx_sensor_data_timestamp_brin":
+            "CREATE INDEX idx_sensor_data_timestamp_brin ON sensor_data USING BRIN (timestamp) WITH (pages_per_range = 32)"
+    },
+    "covering": {
+        "idx_sensor_data_sensor_covering":
+            "CREATE INDEX idx_sensor_data_sensor_covering ON sensor_data(sensor_id) "
+            "INCLUDE (temperature, humidity, pressure, battery_level)",
+        "idx_sensor_data_timestamp_covering":
+            "CREATE INDEX idx_sensor_data_timestamp_covering ON sensor_data(timestamp) INCLUDE (sensor_id, temperature)"
+    }
+}
+
+def pg_sensor_indexes():
+    """Индексы sensor_data для текущей конфигурации: имя -> DDL"""
+    indexes = dict(PG_INDEX_PROFILES[pg_index_profile])
+    if pg_sensor_temperature_index or pg_max_temperature_source == "skip_scan":
+        indexes.update(PG_SENSOR_TEMPERATURE_INDEX)
+    return indexes
+
+def _pg_load_worker(chunk_iter, chunk_lock, load_mode):
+    """Поток загрузки: собственное соединение, забирает следующий чанк из общего итератора"""
+    loaded = 0
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            while True:
+                with chunk_lock:
+                    chunk = next(chunk_iter, None)
+                if chunk is None:
+                    break
+                load_chunk_to_postgres(cur, chunk, load_mode)
+                # Фиксация после каждого чанка: строки сводных таблиц, обновленные
+                # триггером, не остаются заблокированными до конца всей загрузки
+                conn.commit()
+                loaded += len(chunk)
+    return loaded
+
+def parallel_load_postgres(chunks, n_connections, load_mode):
+    """Загрузка чанков по n_connections параллельным соединениям"""
+    chunk_iter = iter(chunks)
+    chunk_lock = threading.Lock()
+    with ThreadPoolExecutor(max_workers=n_connections) as pool:
+        futures = [pool.submit(_pg_load_worker, chunk_iter, chunk_lock, load_mode) for _ in range(n_connections)]
+        return sum(future.result() for future in futures)
+
+def _run_maintenance_statement(statement):
+    """DDL построения индекса в отдельном соединении с параллельными воркерами PostgreSQL"""
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            # SET LOCAL не переносит настройки на следующих пользователей соединения из пула
+            cur.execute(f"SET LOCAL max_parallel_maintenance_workers = {int(pg_parallel_index_workers)}")
+            cur.execute("SELECT set_config('maintenance_work_mem', %s, true)", (pg_maintenance_work_mem,))
+            cur.execute(statement)
+        conn.commit()
+
+def build_sensor_indexes(n_connections=1):
+    """Первичный ключ, затем индексы sensor_data параллельно в нескольких соединениях"""
+    # ALTER TABLE берет эксклюзивную блокировку, поэтому ключ строится первым;
+    # CREATE INDEX берут совместимые блокировки и могут идти одновременно
+    _run_maintenance_statement(PG_PRIMARY_KEY.format(columns=pg_primary_key_columns()))
+    with ThreadPoolExecutor(max_workers=max(n_connections, 1)) as pool:
+        list(pool.map(_run_maintenance_statement, pg_sensor_indexes().values()))
+
+def vacuum_sensor_data():
+    """VACUUM (ANALYZE) sensor_data: статистика планировщика и карта видимости.
+    Без карты видимости index-only scan все равно читает строки из таблицы"""
+    with pg_connection() as conn:
+        # VACUUM нельзя выполнить внутри транзакции
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cur:
+                cur.execute("VACUUM (ANALYZE) sensor_data")
+        finally:
+            conn.autocommit = False
+
+# Сводные таблицы (rollup), которые обновляются триггером при каждой загрузке:
+# sensor_rollup - по сенсорам, sensor_rollup_hourly/daily/monthly - по календарю.
+# Триггер выполняет upsert сводок при каждом INSERT и COPY, поэтому со сводками скорость
+# загрузки PostgreSQL не сравнима с MongoDB; по умолчанию выключено, режим записывается
+# в ingest_stats и в настройки результатов
+pg_use_rollups = False
+
+# Сверка сводных таблиц с sensor_data после загрузки: несколько полных проходов GROUP BY,
+# поэтому только по запросу (при отладке триггера)
+pg_check_rollups = False
+
+# Источник для запроса максимальной температуры: "raw" - GROUP BY по sensor_data,
+# "rollup" - чтение 103 строк из sensor_rollup, "skip_scan" - рекурсивный CTE
+# по индексу (sensor_id, temperature DESC): около 103 проб индекса вместо прохода по таблице.
+# По умолчанию "raw": основное сравнение с MongoDB идет на одинаковой работе (полный проход)
+pg_max_temperature_source = "raw"
+
+# Подписи источников в сравнении с MongoDB
+PG_MAX_TEMPERATURE_LABELS = {
+    "raw": "SQL GROUP BY",
+    "rollup": "SQL: сводная таблица (rollup)",
+    "skip_scan": "SQL: skip scan по индексу"
+}
+
+PG_MAX_TEMPERATURE_QUERIES = {
+    "raw": """
+        SELECT 
+            sensor_id,
+            MAX(temperature) as max_temperature,
+            COUNT(*) as total_records
+        FROM sensor_data
+        GROUP BY sensor_id
+        ORDER BY max_temperature DESC
+    """,
+    "rollup": """
+        SELECT sensor_id, temp_max AS max_temperature, record_count AS total_records
+        FROM sensor_rollup
+        ORDER BY max_temperature DESC
+    """,
+    # Следующий сенсор - первый ключ индекса больше текущего, максимум - первая
+    # запись сенсора в порядке temperature DESC; число записей без прохода по
+    # индексу не получить, поэтому total_records = NULL
+    "skip_scan": """
+        WITH RECURSIVE sensors AS (
+            (SELECT sensor_id FROM sensor_data ORDER BY sensor_id LIMIT 1)
+            UNION ALL
+            SELECT (
+                SELECT d.sensor_id FROM sensor_data d
+                WHERE d.sensor_id > s.sensor_id
+                ORDER BY d.sensor_id LIMIT 1
+            )
+            FROM sensors s
+            WHERE s.sensor_id IS NOT NULL
+        )
+        SELECT s.sensor_id, m.max_temperature, NULL::bigint AS total_records
+        FROM sensors s
+        CROSS JOIN LATERAL (
+            SELECT d.temperature AS max_temperature FROM sensor_data d
+            WHERE d.sensor_id = s.sensor_id
+            ORDER BY d.temperature DESC LIMIT 1
+        ) m
+        WHERE s.sensor_id IS NOT NULL
+        ORDER BY max_temperature DESC
+    """
+}
+
+# Гранулярность календарных сводок: суффикс таблицы -> аргумент date_trunc
+PG_CALENDAR_ROLLUPS = {"hourly": "hour", "daily": "day", "monthly": "month"}
+
+# Агрегаты температуры, общие для всех сводных таблиц
+PG_ROLLUP_MEASURES = """
+    record_count BIGINT NOT NULL,
+    temp_sum NUMERIC NOT NULL,
+    temp_sumsq NUMERIC NOT NULL,
+    temp_min DECIMAL(5,2) NOT NULL,
+    temp_max DECIMAL(5,2) NOT NULL,
+    first_timestamp TIMESTAMP NOT NULL,
+    last_timestamp TIMESTAMP NOT NULL
+"""
+
+PG_ROLLUP_AGGREGATES = """
+    COUNT(*) AS record_count, SUM(temperature) AS temp_sum, SUM(temperature * temperature) AS temp_sumsq,
+    MIN(temperature) AS temp_min, MAX(temperature) AS temp_max,
+    MIN(timestamp) AS first_timestamp, MAX(timestamp) AS last_timestamp
+"""
+
+PG_ROLLUP_MERGE = """
+    record_count = r.record_count + EXCLUDED.record_count,
+    temp_sum = r.temp_sum + EXCLUDED.temp_sum,
+    temp_sumsq = r.temp_sumsq + EXCLUDED.temp_sumsq,
+    temp_min = LEAST(r.temp_min, EXCLUDED.temp_min),
+    temp_max = GREATEST(r.temp_max, EXCLUDED.temp_max),
+    first_timestamp = LEAST(r.first_timestamp, EXCLUDED.first_timestamp),
+    last_timestamp = GREATEST(r.last_timestamp, EXCLUDED.last_timestamp)
+"""
+
+PG_ROLLUP_COLUMNS = "record_count, temp_sum, temp_sumsq, temp_min, temp_max, first_timestamp, last_timestamp"
+
+def _rollup_row(alias):
+    """Кортеж агрегатов сводки с префиксом таблицы - для сравнения строк"""
+    return "(" + ", ".join(f"{alias}.{column}" for column in PG_ROLLUP_COLUMNS.split(", ")) + ")"
+
+def _rollup_upsert_statements(source):
+    """INSERT ... ON CONFLICT для всех сводных таблиц по строкам из source"""
+    # Строки вставляются в порядке ключа, чтобы параллельные загрузки
+    # блокировали строки сводок в одном порядке и не создавали взаимоблокировок
+    statements = [f"""
+        INSERT INTO sensor_rollup AS r (sensor_id, {PG_ROLLUP_COLUMNS})
+        SELECT sensor_id, {PG_ROLLUP_AGGREGATES}
+        FROM {source}
+        GROUP BY sensor_id
+        ORDER BY sensor_id
+        ON CONFLICT (sensor_id) DO UPDATE SET {PG_ROLLUP_MERGE}
+    """]
+    for suffix, unit in PG_CALENDAR_ROLLUPS.items():
+        statements.append(f"""
+            INSERT INTO sensor_rollup_{suffix} AS r (bucket, {PG_ROLLUP_COLUMNS})
+            SELECT date_trunc('{unit}', timestamp), {PG_ROLLUP_AGGREGATES}
+            FROM {source}
+            GROUP BY 1
+            ORDER BY 1
+            ON CONFLICT (bucket) DO UPDATE SET {PG_ROLLUP_MERGE}
+        """)
+    return statements
+
+def create_sensor_rollups(cur):
+    """Создание сводных таблиц и statement-триггера с таблицей переходов (работает и для COPY)"""
+    cur.execute("DROP TABLE IF EXISTS sensor_rollup")
+    cur.execute(f"CREATE TABLE sensor_rollup (sensor_id VARCHAR(50) PRIMARY KEY, {PG_ROLLUP_MEASURES})")
+    for suffix in PG_CALENDAR_ROLLUPS:
+        cur.execute(f"DROP TABLE IF EXISTS sensor_rollup_{suffix}")
+        cur.execute(f"CREATE TABLE sensor_rollup_{suffix} (bucket TIMESTAMP PRIMARY KEY, {PG_ROLLUP_MEASURES})")
+    
+    body = ";\n".join(_rollup_upsert_statements("new_rows"))
+    cur.execute(f"""
+        CREATE OR REPLACE FUNCTION sensor_data_rollup_trigger() RETURNS trigger AS $$
+        BEGIN
+            {body};
+            RETURN NULL;
+        END
+        $$ LANGUAGE plpgsql
+    """)
+    cur.execute("""
+        CREATE TRIGGER sensor_data_rollup
+        AFTER INSERT ON sensor_data
+        REFERENCING NEW TABLE AS new_rows
+        FOR EACH STATEMENT EXECUTE FUNCTION sensor_data_rollup_trigger()
+    """)
+
+def set_rollup_trigger(enabled):
+    """Включение и отключение триггера сводных таблиц (сводки затем пересчитываются rebuild_sensor_rollups)"""
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE sensor_data {'ENABLE' if enabled else 'DISABLE'} TRIGGER sensor_data_rollup")
+        conn.commit()
+
+def rebuild_sensor_rollups():
+    """Полный пересчет сводных таблиц по sensor_data (например, после загрузки без триггера)"""
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("TRUNCATE sensor_rollup, " + ", ".join(f"sensor_rollup_{s}" for s in PG_CALENDAR_ROLLUPS))
+            for statement in _rollup_upsert_statements("sensor_data"):
+                cur.execute(statement)
+        conn.commit()
+
+def check_rollup_consistency():
+    """Сверка сводных таблиц с sensor_data; возвращает список расхождений"""
+    mismatches = []
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"""
+                WITH raw AS (
+                    SELECT sensor_id, {PG_ROLLUP_AGGREGATES}
+                    FROM sensor_data GROUP BY sensor_id
+                )
+                SELECT COALESCE(raw.sensor_id, r.sensor_id)
+                FROM raw FULL JOIN sensor_rollup r ON r.sensor_id = raw.sensor_id
+                WHERE {_rollup_row('raw')} IS DISTINCT FROM {_rollup_row('r')}
+            """)
+            mismatches += [("sensor_rollup", row[0]) for row in cur.fetchall()]
+            
+            for suffix, unit in PG_CALENDAR_ROLLUPS.items():
+                cur.execute(f"""
+                    WITH raw AS (
+                        SELECT date_trunc('{unit}', timestamp) AS bucket, {PG_ROLLUP_AGGREGATES}
+                        FROM sensor_data GROUP BY 1
+                    )
+                    SELECT COALESCE(raw.bucket, r.bucket)
+                    FROM raw FULL JOIN sensor_rollup_{suffix} r ON r.bucket = raw.bucket
+                    WHERE {_rollup_row('raw')} IS DISTINCT FROM {_rollup_row('r')}
+                """)
+                mismatches += [(f"sensor_rollup_{suffix}", row[0]) for row in cur.fetchall()]
+    return mismatches
+
+def postgres_monthly_from_rollup(cur):
+    """Помесячная средняя температура и число записей из sensor_rollup_monthly (12 строк)"""
+    cur.execute("""
+        SELECT TO_CHAR(bucket, 'YYYY-MM') AS month,
+               temp_sum / record_count AS avg_temp,
+               record_count
+        FROM sensor_rollup_monthly
+        ORDER BY bucket
+    """)
+    return cursor_to_frame(cur)
+
+# Секционирование sensor_data по месяцам (PARTITION BY RANGE (timestamp)):
+# индексы создаются на родительской таблице и строятся локально в каждой секции,
+# запросы с диапазоном по timestamp читают только нужные секции
+pg_partition_by_month = False
+
+# Первый месяц и число месячных секций (данные генерируются за 365 дней от IOT_START_DATE)
+PG_PARTITION_FIRST_MONTH = IOT_START_DATE.astype('datetime64[M]')
+PG_PARTITION_MONTHS = 12
+
+def pg_primary_key_columns():
+    """Столбцы первичного ключа sensor_data с учетом секционирования"""
+    return "record_id, timestamp" if pg_partition_by_month else "record_id"
+
+def pg_partition_name(month):
+    """Имя секции за месяц: sensor_data_2024_01"""
+    return "sensor_data_" + str(np.datetime64(month, 'M')).replace('-', '_')
+
+def create_monthly_partitions(cur, first_month=None, n_months=None):
+    """Месячные секции sensor_data и секция по умолчанию для записей вне диапазона"""
+    first_month = np.datetime64(PG_PARTITION_FIRST_MONTH if first_month is None else first_month, 'M')
+    n_months = PG_PARTITION_MONTHS if n_months is None else n_months
+    for i in range(n_months):
+        month = first_month + i
+        cur.execute(f"""
+            CREATE TABLE {pg_partition_name(month)} PARTITION OF sensor_data
+            FOR VALUES FROM ('{month}-01') TO ('{month + 1}-01')
+        """)
+    cur.execute("CREATE TABLE sensor_data_default PARTITION OF sensor_data DEFAULT")
+
+def detach_month_partition(month, drop=False):
+    """Отсоединение секции за месяц (старые данные убираются без DELETE по всей таблице)"""
+    name = pg_partition_name(month)
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"ALTER TABLE sensor_data DETACH PARTITION {name}")
+            if drop:
+                cur.execute(f"DROP TABLE {name}")
+        conn.commit()
+    return name
+
+def pg_scanned_relations(sql, params=None):
+    """Таблицы (секции), которые читает план запроса - проверка отсечения секций"""
+    plan = explain_pg_query(sql, params, analyze=False)
+    return sorted({node['Relation Name'] for node in iter_pg_plan_nodes(plan) if 'Relation Name' in node})
+
+def pg_index_sizes():
+    """Размер каждого индекса sensor_data в байтах (для секционированной таблицы - сумма по секциям)"""
+    return dict(run_pg_query("""
+        SELECT i.indexrelid::regclass::text,
+               (SELECT SUM(pg_relation_size(relid)) FROM pg_partition_tree(i.indexrelid))::bigint
+        FROM pg_index i
+        WHERE i.indrelid = 'sensor_data'::regclass
+        ORDER BY 1
+    """))
+
+def pg_timestamp_correlation():
+    """Корреляция timestamp с физическим порядком строк (pg_stats) - от нее зависит польза BRIN"""
+    rows = run_pg_query("""
+        SELECT correlation FROM pg_stats
+        WHERE tablename = 'sensor_data' AND attname = 'timestamp'
+        ORDER BY inherited DESC LIMIT 1
+    """)
+    return rows[0][0] if rows else None
+
+def setup_postgresql(chunks=None):
     """Настройка PostgreSQL и создание таблицы sensor_data"""
+    if chunks is None:
+        chunks = iot_chunk_source()
+    conn = None
     try:
-        conn = psycopg2.connect(**pg_conn_params)
+        conn = acquire_pg_connection()
         cur = conn.cursor()
         
         # Создание таблицы sensor_data
         cur.execute("DROP TABLE IF EXISTS sensor_data CASCADE")
-        cur.execute("""
+        primary_key = "" if pg_defer_indexes else f",\n                PRIMARY KEY ({pg_primary_key_columns()})"
+        partitioning = "PARTITION BY RANGE (timestamp)" if pg_partition_by_month else ""
+        cur.execute(f"""
             CREATE TABLE sensor_data (
-                record_id INTEGER PRIMARY KEY,
+                record_id INTEGER NOT NULL,
                 sensor_id VARCHAR(50) NOT NULL,
                 temperature DECIMAL(5,2) NOT NULL,
                 timestamp TIMESTAMP NOT NULL,
                 humidity DECIMAL(5,2),
                 pressure DECIMAL(6,2),
-                battery_level INTEGER
-            )
+                battery_level INTEGER{primary_key}
+            ) {partitioning}
         """)
+        if pg_partition_by_month:
+            create_monthly_partitions(cur)
+            print(f"✅ Созданы {PG_PARTITION_MONTHS} месячных секций sensor_data (с {PG_PARTITION_FIRST_MONTH}) и секция по умолчанию")
         
-        # Создание индексов для оптимизации
-        cur.execute("CREATE INDEX idx_sensor_data_sensor_id ON sensor_data(sensor_id)")
-        cur.execute("CREATE INDEX idx_sensor_data_timestamp ON sensor_data(timestamp)")
-        cur.execute("CREATE INDEX idx_sensor_data_temperature ON sensor_data(temperature)")
+        if pg_use_rollups:
+            create_sensor_rollups(cur)
+            print("✅ Созданы сводные таблицы sensor_rollup (по сенсорам, часам, дням, месяцам) и триггер")
         
-        print("✅ Таблица sensor_data создана с индексами")
+        if pg_defer_indexes:
+            print("✅ Таблица sensor_data создана (индексы будут построены после загрузки)")
+        else:
+            # Создание индексов для оптимизации
+            for statement in pg_sensor_indexes().values():
+                cur.execute(statement)
+            print("✅ Таблица sensor_data создана с индексами")
+        conn.commit()
         
         # Загрузка данных
-        print("📥 Загрузка данных в PostgreSQL...")
-        batch_size = 10000
-        for i in range(0, len(iot_df), batch_size):
-            batch = iot_df.iloc[i:i+batch_size]
-            for _, row in batch.iterrows():
-                cur.execute("""
-                    INSERT INTO sensor_data (record_id, sensor_id, temperature, timestamp, humidity, pressure, battery_level)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s)
-                """, (
-                    row['record_id'], row['sensor_id'], row['temperature'], 
-                    row['timestamp'], row['humidity'], row['pressure'], row['battery_level']
-                ))
-        
-        conn.commit()
+        print(f"📥 Загрузка данных в PostgreSQL (режим: {pg_load_mode}, соединений: {pg_load_connections})...")
+        with span("postgresql.load", mode=pg_load_mode, connections=pg_load_connections) as load_span:
+            if pg_load_connections > 1:
+                loaded = parallel_load_postgres(chunks, pg_load_connections, pg_load_mode)
+            else:
+                loaded = 0
+                for chunk in chunks:
+                    load_chunk_to_postgres(cur, chunk, pg_load_mode)
+                    loaded += len(chunk)
+                conn.commit()
+            load_span.rows = loaded
+        load_time = load_span.seconds
         cur.close()
-        conn.close()
-        print(f"✅ Загружено {len(iot_df):,} записей в PostgreSQL")
+        release_pg_connection(conn)
+        conn = None
+        
+        print(f"✅ Загружено {loaded:,} записей в PostgreSQL за {load_time:.2f} секунд "
+              f"({loaded / max(load_time, 1e-9):,.0f} записей/сек)")
+        
+        index_time = 0.0
+        if pg_defer_indexes:
+            print(f"🔧 Построение первичного ключа и индексов (воркеров PostgreSQL: {pg_parallel_index_workers})...")
+            with span("postgresql.index_build", profile=pg_index_profile) as index_span:
+                build_sensor_indexes(pg_load_connections)
+            index_time = index_span.seconds
+            print(f"✅ Индексы построены за {index_time:.2f} секунд")
+        
+        with span("postgresql.vacuum"):
+            vacuum_sensor_data()
+        
+        if pg_use_rollups and pg_check_rollups:
+            mismatches = check_rollup_consistency()
+            if mismatches:
+                print(f"❌ Сводные таблицы расходятся с sensor_data: {len(mismatches)} строк, например {mismatches[:3]}")
+            else:
+                print("✅ Сводные таблицы согласованы с sensor_data")
+        
+        ingest_stats['postgresql'] = {
+            'mode': pg_load_mode,
+            'connections': pg_load_connections,
+            'rollups': pg_use_rollups,
+            'records': loaded,
+            'load_time': load_time,
+            'index_time': index_time,
+            'rows_per_sec': loaded / load_time if load_time > 0 else None
+        }
         return True
         
     except Exception as e:
         print(f"❌ Ошибка при работе с PostgreSQL: {e}")
         return False
+    
+    finally:
+        if conn is not None:
+            release_pg_connection(conn)
 
 # Настройка PostgreSQL
 postgres_ready = setup_postgresql()
 
+def pg_max_temperature_effective_source():
+    """Фактический источник запроса максимальной температуры (без сводок - исходная таблица)"""
+    if pg_max_temperature_source == "rollup" and not pg_use_rollups:
+        return "raw"
+    return pg_max_temperature_source
+
+def pg_max_temperature_sql():
+    """SQL поиска максимальной температуры для выбранного источника"""
+    return PG_MAX_TEMPERATURE_QUERIES[pg_max_temperature_effective_source()]
+
 def postgres_max_temperature_query():
     """SQL запрос для поиска максимальной температуры по сенсорам"""
     try:
-        conn = psycopg2.connect(**pg_conn_params)
-        cur = conn.cursor()
-        
-        cur.execute("""
-            SELECT 
-                sensor_id,
-                MAX(temperature) as max_temperature,
-                COUNT(*) as total_records
-            FROM sensor_data
-            GROUP BY sensor_id
-            ORDER BY max_temperature DESC
-        """)
-        results = cur.fetchall()
-        
-        cur.close()
-        conn.close()
+        with pg_connection() as conn:
+            cur = conn.cursor()
+            
+            cur.execute(pg_max_temperature_sql())
+            results = cur.fetchall()
+            
+            cur.close()
         return results
         
     except Exception as e:
@@ -94,75 +1045,486 @@ if postgres_ready:
     print("\n🔍 ВЫПОЛНЕНИЕ ЗАДАНИЯ: Поиск максимальной температуры для каждого сенсора")
     
     # Измеряем время выполнения
-    pg_result, pg_time = measure_time(postgres_max_temperature_query)
+    pg_result, pg_time, pg_acquire_time = measure_pg_time(postgres_max_temperature_query)
     
     print(f"⏱️ Время выполнения PostgreSQL запроса: {pg_time:.4f} секунд")
+    print(f"🔌 Время получения соединения из пула: {pg_acquire_time:.4f} секунд")
+    capture_pg_plan("PostgreSQL: максимальная температура", pg_max_temperature_sql(), pg_time)
     print(f"📊 Найдено {len(pg_result)} уникальных сенсоров")
     
     # Показываем топ-5 сенсоров с самой высокой температурой
     print("\n🔥 Топ-5 сенсоров с максимальной температурой (PostgreSQL):")
     for i, (sensor_id, max_temp, count) in enumerate(pg_result[:5]):
-        print(f"  {i+1}. {sensor_id}: {max_temp}°C (записей: {count})")
+        records = f" (записей: {count})" if count is not None else ""
+        print(f"  {i+1}. {sensor_id}: {max_temp}°C{records}")
 else:
     print("❌ Пропуск выполнения запроса PostgreSQL из-за ошибки настройки")
     pg_time = None
 
+# Набор запросов лабораторной для сравнения вариантов хранения sensor_data
+PG_LAB3_QUERIES = {
+    "MAX температура": """
+        SELECT sensor_id, MAX(temperature) FROM sensor_data GROUP BY sensor_id
+    """,
+    "AVG температура": """
+        SELECT sensor_id, AVG(temperature) FROM sensor_data GROUP BY sensor_id
+    """,
+    "COUNT записей": "SELECT COUNT(*) FROM sensor_data",
+    "DISTINCT сенсоры": "SELECT COUNT(DISTINCT sensor_id) FROM sensor_data",
+    "По месяцам": """
+        SELECT TO_CHAR(timestamp, 'YYYY-MM') AS month, AVG(temperature), COUNT(*)
+        FROM sensor_data GROUP BY month ORDER BY month
+    """,
+    "Статистика по сенсорам": """
+        SELECT sensor_id, COUNT(*), AVG(temperature), MAX(temperature), MIN(temperature),
+               STDDEV(temperature), AVG(humidity), AVG(pressure), AVG(battery_level)
+        FROM sensor_data GROUP BY sensor_id
+    """,
+    # Диапазон по timestamp: на секционированной таблице читается одна секция
+    "Окно: 1 месяц": """
+        SELECT sensor_id, AVG(temperature), MAX(temperature)
+        FROM sensor_data
+        WHERE timestamp >= '2024-06-01' AND timestamp < '2024-07-01'
+        GROUP BY sensor_id
+    """
+}
+
+def benchmark_pg_queries(queries, repeats=3):
+    """Время каждого запроса: лучшее и медиана из repeats запусков"""
+    rows = []
+    for name, sql in queries.items():
+        with span(f"PostgreSQL: {name}"):
+            times = [measure_pg_time(run_pg_query, sql)[1] for _ in range(repeats)]
+        rows.append({'query': name, 'best': min(times), 'median': float(np.median(times))})
+        capture_pg_plan(f"PostgreSQL: {name}", sql, rows[-1]['median'])
+    return pd.DataFrame(rows).set_index('query')
+
+# Сравнение обычной и секционированной по месяцам таблицы (каждый вариант
+# загружается заново, поэтому по умолчанию выключено)
+run_partitioning_benchmark = False
+
+if postgres_ready and run_partitioning_benchmark:
+    print("\n🗂️ СРАВНЕНИЕ: ОБЫЧНАЯ И СЕКЦИОНИРОВАННАЯ ПО МЕСЯЦАМ ТАБЛИЦА")
+    partition_results = {}
+    window_sql = PG_LAB3_QUERIES["Окно: 1 месяц"]
+    # Выбранный вариант загружается последним и остается в базе для остальных разделов
+    for partitioned in (not pg_partition_by_month, pg_partition_by_month):
+        pg_partition_by_month = partitioned
+        layout = "секционированная" if partitioned else "обычная"
+        if not setup_postgresql():
+            break
+        partition_results[layout] = benchmark_pg_queries(PG_LAB3_QUERIES)
+        ingest = ingest_stats['postgresql']
+        print(f"  {layout}: загрузка {ingest['load_time']:.2f} с, индексы {ingest['index_time']:.2f} с, "
+              f"окно читает {pg_scanned_relations(window_sql)}")
+
+    if len(partition_results) == 2:
+        partition_comparison = pd.concat({layout: result['median'] for layout, result in partition_results.items()}, axis=1)
+        print(partition_comparison.round(4).to_string())
+        partition_comparison.plot(kind='bar', figsize=(12, 6), title='Медианное время запросов: обычная и секционированная таблица')
+        plt.ylabel('Время (секунды)')
+        plt.xticks(rotation=30, ha='right')
+        plt.tight_layout()
+        plt.show()
+
+# Сравнение профилей индексов: стоимость загрузки, размер индексов, стоимость вставки
+# при уже построенных индексах и время запросов лабораторной (каждый профиль загружается
+# заново, по умолчанию выключено). Данные загружаются в порядке timestamp, как при
+# поступлении показаний, в одно соединение (параллельные соединения перемешивают
+# страницы): BRIN рассчитан именно на такие данные
+run_index_profile_benchmark = False
+
+# Пачка новых записей, вставляемая после загрузки: обслуживание индексов при вставке
+index_profile_insert_records = 100000
+
+def time_ordered_chunk_source():
+    """Чанки набора данных в порядке timestamp (в потоковом режиме набор строится в памяти)"""
+    df = iot_df if iot_df is not None else pd.DataFrame(
+        generate_iot_data(n_records, n_devices, seed=data_seed, n_workers=n_workers, compact=compact_schema))
+    return iter_df_chunks(df.sort_values('timestamp', kind='stable', ignore_index=True), chunk_size)
+
+def appended_iot_records(count):
+    """count новых записей после набора данных: record_id от n_records, показания за следующий
+    год в порядке timestamp - дописываются в конец таблицы, как новые данные"""
+    root_seq = iot_seed_sequence(data_seed)
+    device_ids = get_device_ids(n_devices)
+    columns = generate_iot_range(root_seq, iot_sensor_table(root_seq, len(device_ids)),
+                                  n_records, n_records + count)
+    columns['timestamp'] = columns['timestamp'] + np.timedelta64(365, 'D')
+    frame = _iot_frame(columns, device_ids, compact_schema)
+    return frame.sort_values('timestamp', kind='stable', ignore_index=True)
+
+def time_index_maintenance(batch):
+    """Время вставки пачки в таблицу с построенными индексами (одна транзакция)"""
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            with span("postgresql.index_maintenance", rows=len(batch), profile=pg_index_profile) as insert_span:
+                load_chunk_to_postgres(cur, batch, pg_load_mode)
+                conn.commit()
+    return insert_span.seconds
+
+if postgres_ready and run_index_profile_benchmark:
+    print("\n🗃️ СРАВНЕНИЕ ПРОФИЛЕЙ ИНДЕКСОВ")
+    index_profile_rows = []
+    index_profile_latency = {}
+    saved_index_profile, saved_load_connections = pg_index_profile, pg_load_connections
+    pg_load_connections = 1
+    index_profile_batch = appended_iot_records(index_profile_insert_records)
+    for profile in PG_INDEX_PROFILES:
+        pg_index_profile = profile
+        if not setup_postgresql(time_ordered_chunk_source()):
+            break
+        ingest = ingest_stats['postgresql']
+        index_sizes = pg_index_sizes()
+        correlation = pg_timestamp_correlation()
+        index_profile_latency[profile] = benchmark_pg_queries(PG_LAB3_QUERIES)['median']
+        insert_time = time_index_maintenance(index_profile_batch)
+        index_profile_rows.append({
+            'profile': profile,
+            'load_time': ingest['load_time'],
+            'index_time': ingest['index_time'],
+            'insert_time': insert_time,
+            'insert_rows_per_sec': len(index_profile_batch) / insert_time if insert_time > 0 else None,
+            'index_mb': sum(index_sizes.values()) / 1024**2,
+            'query_time': index_profile_latency[profile].sum(),
+            'timestamp_correlation': correlation
+        })
+        print(f"  {profile}: загрузка {ingest['load_time']:.2f} с, индексы {ingest['index_time']:.2f} с, "
+              f"вставка {len(index_profile_batch):,} записей {insert_time:.2f} с, "
+              f"размер индексов {index_profile_rows[-1]['index_mb']:.1f} МБ")
+    del index_profile_batch
+
+    # Возврат исходных данных и профиля для остальных разделов
+    pg_index_profile, pg_load_connections = saved_index_profile, saved_load_connections
+    postgres_ready = setup_postgresql()
+
+    if index_profile_rows:
+        index_profile_summary = pd.DataFrame(index_profile_rows).set_index('profile')
+        print(index_profile_summary.round(4).to_string())
+        print(pd.DataFrame(index_profile_latency).round(4).to_string())
+
+        fig, axes = plt.subplots(1, 3, figsize=(18, 5))
+        index_profile_summary[['load_time', 'index_time', 'insert_time']].plot(kind='bar', stacked=True, ax=axes[0])
+        axes[0].set_title('Стоимость загрузки (секунды)')
+        index_profile_summary['index_mb'].plot(kind='bar', ax=axes[1], color='orange')
+        axes[1].set_title('Размер индексов (МБ)')
+        pd.DataFrame(index_profile_latency).T.plot(kind='bar', stacked=True, ax=axes[2], legend=False)
+        axes[2].set_title('Суммарное время запросов (секунды)')
+        for ax in axes:
+            ax.tick_params(axis='x', rotation=0)
+        plt.tight_layout()
+        plt.show()
+
+# Максимум по сенсору: GROUP BY по всей таблице и skip scan по составному индексу
+# на таблицах разного размера (каждый размер загружается заново, по умолчанию выключено)
+run_skip_scan_benchmark = False
+PG_SKIP_SCAN_SIZES = [1_000_000, 10_000_000, 100_000_000]
+
+if postgres_ready and run_skip_scan_benchmark:
+    print("\n⏭️ СРАВНЕНИЕ: GROUP BY И SKIP SCAN ДЛЯ МАКСИМУМА ПО СЕНСОРУ")
+    skip_scan_queries = {source: PG_MAX_TEMPERATURE_QUERIES[source] for source in ("raw", "skip_scan")}
+    saved_temperature_index = pg_sensor_temperature_index
+    pg_sensor_temperature_index = True
+    skip_scan_results = {}
+    for size in PG_SKIP_SCAN_SIZES:
+        size_chunks = iter_iot_chunks(size, chunk_size=chunk_size, n_devices=n_devices, seed=data_seed,
+                                      n_workers=n_workers, compact=compact_schema)
+        if not setup_postgresql(size_chunks):
+            break
+        skip_scan_results[size] = benchmark_pg_queries(skip_scan_queries)['median']
+        print(f"  {size:,} записей: GROUP BY {skip_scan_results[size]['raw']:.4f} с, "
+              f"skip scan {skip_scan_results[size]['skip_scan']:.4f} с")
+
+    # Возврат исходных данных и индексов для остальных разделов
+    pg_sensor_temperature_index = saved_temperature_index
+    postgres_ready = setup_postgresql()
+
+    if skip_scan_results:
+        skip_scan_comparison = pd.DataFrame(skip_scan_results).T
+        skip_scan_comparison.index.name = 'records'
+        print(skip_scan_comparison.round(4).to_string())
+        skip_scan_comparison.plot(logx=True, logy=True, marker='o', figsize=(10, 6),
+                                  title='Максимум по сенсору: GROUP BY и skip scan')
+        plt.xlabel('Записей в sensor_data')
+        plt.ylabel('Медианное время (секунды)')
+        plt.grid(True, alpha=0.3)
+        plt.tight_layout()
+        plt.show()
+
 
 
 # ГРАФИКИ ДЛЯ POSTGRESQL - ПОЛНЫЙ АНАЛИЗ С ВРЕМЕННЫМИ ХАРАКТЕРИСТИКАМИ
 print("\n📊 POSTGRESQL: ПОЛНЫЙ АНАЛИЗ ДАННЫХ")
 print("="*50)
 
+# Режим полного анализа: "single_pass" - все метрики одним запросом (GROUPING SETS) и медиана,
+# "separate" - исходный вариант с отдельным запросом на каждую метрику
+pg_analysis_mode = "single_pass"
+
+# Показатели последнего полного анализа (режим, число запросов к таблице, время)
+pg_analysis_stats = {}
+
+# Запросы полного анализа: метрика -> SQL (каждый запрос - отдельный проход по sensor_data).
+# Запросы независимы, поэтому их можно выполнять как последовательно, так и одновременно
+PG_ANALYSIS_QUERIES = {
+    # Распределение средней температуры по сенсорам
+    "temp_data": """
+        SELECT sensor_id, AVG(temperature) as avg_temp
+        FROM sensor_data
+        GROUP BY sensor_id
+        ORDER BY avg_temp DESC
+    """,
+    # Распределение максимальной температуры
+    "max_temp_data": """
+        SELECT sensor_id, MAX(temperature) as max_temp
+        FROM sensor_data
+        GROUP BY sensor_id
+        ORDER BY max_temp DESC
+    """,
+    # Количество записей по сенсорам
+    "count_data": """
+        SELECT sensor_id, COUNT(*) as record_count
+        FROM sensor_data
+        GROUP BY sensor_id
+        ORDER BY record_count DESC
+    """,
+    # Стандартное отклонение температуры
+    "std_data": """
+        SELECT sensor_id, STDDEV(temperature) as std_temp
+        FROM sensor_data
+        GROUP BY sensor_id
+        ORDER BY std_temp DESC
+    """,
+    # Общая статистика температуры
+    "temp_stats": """
+        SELECT
+            AVG(temperature),
+            MIN(temperature),
+            MAX(temperature),
+            STDDEV(temperature),
+            COUNT(*)
+        FROM sensor_data
+    """,
+    # Статистика влажности
+    "humidity_stats": """
+        SELECT AVG(humidity), MIN(humidity), MAX(humidity)
+        FROM sensor_data
+    """,
+    # Статистика давления
+    "pressure_stats": """
+        SELECT AVG(pressure), MIN(pressure), MAX(pressure)
+        FROM sensor_data
+    """,
+    # Статистика уровня батареи
+    "battery_stats": """
+        SELECT AVG(battery_level), MIN(battery_level), MAX(battery_level)
+        FROM sensor_data
+    """,
+    # Временные характеристики
+    "time_stats": """
+        SELECT
+            MIN(timestamp),
+            MAX(timestamp),
+            EXTRACT(EPOCH FROM (MAX(timestamp) - MIN(timestamp))) / 86400 as days_covered
+        FROM sensor_data
+    """,
+    # Дополнительная аналитика
+    "analytics": """
+        SELECT
+            COUNT(DISTINCT sensor_id) as unique_sensors,
+            AVG(temperature) as global_avg_temp,
+            PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY temperature) as median_temp,
+            MODE() WITHIN GROUP (ORDER BY sensor_id) as most_active_sensor
+        FROM sensor_data
+    """,
+    # Распределение по месяцам
+    "monthly_data": """
+        SELECT
+            TO_CHAR(timestamp, 'YYYY-MM') as month,
+            AVG(temperature) as avg_temp,
+            COUNT(*) as record_count
+        FROM sensor_data
+        GROUP BY TO_CHAR(timestamp, 'YYYY-MM')
+        ORDER BY month
+    """,
+    # Распределение влажности
+    "humidity_data": """
+        SELECT sensor_id, AVG(humidity) as avg_humidity
+        FROM sensor_data
+        GROUP BY sensor_id
+        ORDER BY avg_humidity DESC
+    """,
+    # Распределение давления
+    "pressure_data": """
+        SELECT sensor_id, AVG(pressure) as avg_pressure
+        FROM sensor_data
+        GROUP BY sensor_id
+        ORDER BY avg_pressure DESC
+    """,
+    # Статистика по сенсорам
+    "sensor_stats": """
+        SELECT
+            sensor_id,
+            COUNT(*) as records,
+            AVG(temperature) as avg_temp,
+            MAX(temperature) as max_temp,
+            MIN(temperature) as min_temp,
+            STDDEV(temperature) as std_temp,
+            AVG(humidity) as avg_humidity,
+            AVG(pressure) as avg_pressure,
+            AVG(battery_level) as avg_battery
+        FROM sensor_data
+        GROUP BY sensor_id
+        ORDER BY records DESC
+    """
+}
+
+# Метрики из одной строки (общие итоги), остальные - по строке на сенсор или месяц
+PG_ANALYSIS_SCALARS = {'temp_stats', 'humidity_stats', 'pressure_stats', 'battery_stats', 'time_stats', 'analytics'}
+
+def fetch_postgres_analysis_separate(cur):
+    """Метрики полного анализа отдельными запросами (каждый - полный проход по sensor_data);
+    результаты с несколькими строками - DataFrame"""
+    analysis = {}
+    for name, sql in PG_ANALYSIS_QUERIES.items():
+        cur.execute(sql)
+        analysis[name] = cur.fetchone() if name in PG_ANALYSIS_SCALARS else cursor_to_frame(cur)
+
+    analysis['table_scans'] = len(PG_ANALYSIS_QUERIES)
+    return analysis
+
+# Метрики полного анализа (кроме медианы) за один проход по таблице: группировки
+# по сенсору, по месяцу и общий итог считаются одним запросом с GROUPING SETS.
+# Если помесячные данные берутся из sensor_rollup_monthly, группировка по месяцу не нужна
+PG_SINGLE_PASS_ANALYSIS_QUERY = """
+    SELECT
+        GROUPING(sensor_id) AS by_sensor,
+        {month_columns},
+        sensor_id,
+        COUNT(*) AS records,
+        AVG(temperature) AS avg_temp,
+        MAX(temperature) AS max_temp,
+        MIN(temperature) AS min_temp,
+        STDDEV(temperature) AS std_temp,
+        AVG(humidity) AS avg_humidity,
+        MIN(humidity) AS min_humidity,
+        MAX(humidity) AS max_humidity,
+        AVG(pressure) AS avg_pressure,
+        MIN(pressure) AS min_pressure,
+        MAX(pressure) AS max_pressure,
+        AVG(battery_level) AS avg_battery,
+        MIN(battery_level) AS min_battery,
+        MAX(battery_level) AS max_battery,
+        MIN(timestamp) AS first_record,
+        MAX(timestamp) AS last_record
+    FROM sensor_data
+    GROUP BY GROUPING SETS ((sensor_id), {monthly_set}())
+"""
+
+# Медиана - отдельным скалярным запросом: упорядоченный агрегат в GROUPING SETS
+# исключает HashAggregate (сортировка на каждый набор группировки) и считал бы
+# ненужные медианы по сенсорам и месяцам
+PG_MEDIAN_TEMPERATURE_QUERY = """
+    SELECT PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY temperature) FROM sensor_data
+"""
+
+def split_single_pass_analysis(result, median_temp):
+    """Разбор результата GROUPING SETS (DataFrame) и медианы в те же структуры, что дают отдельные запросы"""
+    per_sensor = result[(result['by_sensor'] == 0)].set_index('sensor_id')
+    monthly = result[(result['by_month'] == 0)].sort_values('month')
+    total = result[(result['by_sensor'] == 1) & (result['by_month'] == 1)].iloc[0]
+    
+    def ranked(column, name=None):
+        # Как в отдельных запросах: (sensor_id, значение) по убыванию значения
+        ordered = per_sensor[column].sort_values(ascending=False)
+        return ordered.rename(name or column).reset_index()
+    
+    # Как и MODE() WITHIN GROUP, при равенстве выбирается первый по алфавиту сенсор
+    most_active_sensor = per_sensor['records'].sort_index().idxmax()
+    days_covered = (total['last_record'] - total['first_record']).total_seconds() / 86400
+    
+    stats_columns = ['records', 'avg_temp', 'max_temp', 'min_temp', 'std_temp', 'avg_humidity', 'avg_pressure', 'avg_battery']
+    sensor_stats = per_sensor.sort_values('records', ascending=False)[stats_columns]
+    
+    return {
+        'temp_data': ranked('avg_temp'),
+        'max_temp_data': ranked('max_temp'),
+        'count_data': ranked('records', 'record_count'),
+        'std_data': ranked('std_temp'),
+        'temp_stats': (total['avg_temp'], total['min_temp'], total['max_temp'], total['std_temp'], total['records']),
+        'humidity_stats': (total['avg_humidity'], total['min_humidity'], total['max_humidity']),
+        'pressure_stats': (total['avg_pressure'], total['min_pressure'], total['max_pressure']),
+        'battery_stats': (total['avg_battery'], total['min_battery'], total['max_battery']),
+        'time_stats': (total['first_record'], total['last_record'], days_covered),
+        'analytics': (len(per_sensor), total['avg_temp'], median_temp, most_active_sensor),
+        'monthly_data': monthly[['month', 'avg_temp', 'records']].rename(columns={'records': 'record_count'})
+                                                                 .reset_index(drop=True),
+        'humidity_data': ranked('avg_humidity'),
+        'pressure_data': ranked('avg_pressure'),
+        'sensor_stats': sensor_stats.reset_index(),
+        'table_scans': 2
+    }
+
+def fetch_postgres_analysis_single_pass(cur):
+    """Метрики полного анализа запросом с GROUPING SETS и скалярным запросом медианы"""
+    if pg_use_rollups:
+        query = PG_SINGLE_PASS_ANALYSIS_QUERY.format(month_columns="1 AS by_month, NULL AS month", monthly_set="")
+    else:
+        month = "TO_CHAR(timestamp, 'YYYY-MM')"
+        query = PG_SINGLE_PASS_ANALYSIS_QUERY.format(month_columns=f"GROUPING({month}) AS by_month, {month} AS month",
+                                                     monthly_set=f"({month}), ")
+    cur.execute(PG_MEDIAN_TEMPERATURE_QUERY)
+    median_temp = cur.fetchone()[0]
+    cur.execute(query)
+    analysis = split_single_pass_analysis(cursor_to_frame(cur), median_temp)
+    if pg_use_rollups:
+        analysis['monthly_data'] = postgres_monthly_from_rollup(cur)
+    return analysis
+
+def fetch_postgres_analysis(conn, mode=None):
+    """Все данные для графиков и статистики полного анализа в выбранном режиме"""
+    mode = mode or pg_analysis_mode
+    with conn.cursor() as cur:
+        if mode == "single_pass":
+            return fetch_postgres_analysis_single_pass(cur)
+        return fetch_postgres_analysis_separate(cur)
+
+def result_column(result, index, dtype=np.float64):
+    """Столбец результата запроса (DataFrame) по номеру как массив, по умолчанию float64 (NULL -> NaN)"""
+    return result.iloc[:, index].to_numpy(dtype=dtype)
+
+@traced("postgresql.complete_analysis")
 def get_postgres_complete_analysis():
     """Полный анализ данных в PostgreSQL с временными характеристиками"""
+    conn = None
     try:
-        conn = psycopg2.connect(**pg_conn_params)
+        conn = acquire_pg_connection()
+        
+        # Все запросы выполняются до построения графиков, чтобы время анализа
+        # не включало отрисовку
+        analysis, fetch_time = measure_time(fetch_postgres_analysis, conn)
+        pg_analysis_stats.update({
+            'mode': pg_analysis_mode,
+            'table_scans': analysis['table_scans'],
+            'fetch_time': fetch_time
+        })
+        print(f"⏱️ Запросы полного анализа ({pg_analysis_mode}): {fetch_time:.4f} секунд, "
+              f"проходов по таблице: {analysis['table_scans']}")
         
         # 1. Основная статистика по температуре
-        with conn.cursor() as cur:
-            # Распределение средней температуры по сенсорам
-            cur.execute("""
-                SELECT sensor_id, AVG(temperature) as avg_temp
-                FROM sensor_data 
-                GROUP BY sensor_id 
-                ORDER BY avg_temp DESC
-            """)
-            temp_data = cur.fetchall()
-            
-            # Распределение максимальной температуры
-            cur.execute("""
-                SELECT sensor_id, MAX(temperature) as max_temp
-                FROM sensor_data 
-                GROUP BY sensor_id 
-                ORDER BY max_temp DESC
-            """)
-            max_temp_data = cur.fetchall()
-            
-            # Количество записей по сенсорам
-            cur.execute("""
-                SELECT sensor_id, COUNT(*) as record_count
-                FROM sensor_data 
-                GROUP BY sensor_id 
-                ORDER BY record_count DESC
-            """)
-            count_data = cur.fetchall()
-            
-            # Стандартное отклонение температуры
-            cur.execute("""
-                SELECT sensor_id, STDDEV(temperature) as std_temp
-                FROM sensor_data 
-                GROUP BY sensor_id 
-                ORDER BY std_temp DESC
-            """)
-            std_data = cur.fetchall()
-            
+        temp_data = analysis['temp_data']
+        max_temp_data = analysis['max_temp_data']
+        count_data = analysis['count_data']
+        std_data = analysis['std_data']
+        
         # Построение графиков
+        plot_span = open_span("postgresql.plot", figure="sensor_distributions")
         plt.figure(figsize=(15, 12))
         
         # График 1: Средняя температура по всем сенсорам
         plt.subplot(2, 2, 1)
-        sensor_ids = [item[0] for item in temp_data]
-        avg_temps = [float(item[1]) for item in temp_data]
+        sensor_ids = result_column(temp_data, 0, dtype=object)
+        avg_temps = result_column(temp_data, 1)
         
         plt.bar(range(len(sensor_ids)), avg_temps, color='lightcoral', alpha=0.7)
         plt.title('Средняя температура по всем сенсорам (PostgreSQL)')
@@ -173,7 +1535,7 @@ def get_postgres_complete_analysis():
         
         # График 2: Максимальная температура по всем сенсорам
         plt.subplot(2, 2, 2)
-        max_temps = [float(item[1]) for item in max_temp_data]
+        max_temps = result_column(max_temp_data, 1)
         
         plt.bar(range(len(sensor_ids)), max_temps, color='orange', alpha=0.7)
         plt.title('Максимальная температура по всем сенсорам (PostgreSQL)')
@@ -184,7 +1546,7 @@ def get_postgres_complete_analysis():
         
         # График 3: Количество записей по сенсорам
         plt.subplot(2, 2, 3)
-        counts = [item[1] for item in count_data]
+        counts = result_column(count_data, 1)
         
         plt.bar(range(len(sensor_ids)), counts, color='lightgreen', alpha=0.7)
         plt.title('Количество записей по всем сенсорам (PostgreSQL)')
@@ -195,7 +1557,7 @@ def get_postgres_complete_analysis():
         
         # График 4: Стандартное отклонение температуры
         plt.subplot(2, 2, 4)
-        std_temps = [float(item[1]) if item[1] is not None else 0 for item in std_data]
+        std_temps = np.nan_to_num(result_column(std_data, 1))
         
         plt.bar(range(len(sensor_ids)), std_temps, color='lightblue', alpha=0.7)
         plt.title('Стандартное отклонение температуры по сенсорам (PostgreSQL)')
@@ -206,219 +1568,152 @@ def get_postgres_complete_analysis():
         
         plt.tight_layout()
         plt.show()
+        plot_span.close()
         
         # 2. Детальная статистика по всем параметрам
         print("\n📈 POSTGRESQL: СТАТИСТИКА ПО ВСЕМ ПАРАМЕТРАМ")
         
-        with conn.cursor() as cur:
-            # Общая статистика температуры
-            cur.execute("""
-                SELECT 
-                    AVG(temperature), 
-                    MIN(temperature), 
-                    MAX(temperature), 
-                    STDDEV(temperature),
-                    COUNT(*)
-                FROM sensor_data
-            """)
-            temp_stats = cur.fetchone()
-            
-            print(f"🌡️  ТЕМПЕРАТУРА:")
-            print(f"   • Средняя: {temp_stats[0]:.2f}°C")
-            print(f"   • Минимальная: {temp_stats[1]:.2f}°C")
-            print(f"   • Максимальная: {temp_stats[2]:.2f}°C")
-            print(f"   • Стандартное отклонение: {temp_stats[3]:.2f}°C")
-            print(f"   • Всего записей: {temp_stats[4]:,}")
-            
-            # Статистика влажности
-            cur.execute("""
-                SELECT AVG(humidity), MIN(humidity), MAX(humidity) 
-                FROM sensor_data
-            """)
-            humidity_stats = cur.fetchone()
-            
-            print(f"💧 ВЛАЖНОСТЬ:")
-            print(f"   • Средняя: {humidity_stats[0]:.2f}%")
-            print(f"   • Минимальная: {humidity_stats[1]:.2f}%")
-            print(f"   • Максимальная: {humidity_stats[2]:.2f}%")
-            
-            # Статистика давления
-            cur.execute("""
-                SELECT AVG(pressure), MIN(pressure), MAX(pressure) 
-                FROM sensor_data
-            """)
-            pressure_stats = cur.fetchone()
-            
-            print(f"📊 ДАВЛЕНИЕ:")
-            print(f"   • Среднее: {pressure_stats[0]:.2f} hPa")
-            print(f"   • Минимальное: {pressure_stats[1]:.2f} hPa")
-            print(f"   • Максимальное: {pressure_stats[2]:.2f} hPa")
-            
-            # Статистика уровня батареи
-            cur.execute("""
-                SELECT AVG(battery_level), MIN(battery_level), MAX(battery_level) 
-                FROM sensor_data
-            """)
-            battery_stats = cur.fetchone()
-            
-            print(f"🔋 БАТАРЕЯ:")
-            print(f"   • Средний уровень: {battery_stats[0]:.2f}%")
-            print(f"   • Минимальный уровень: {battery_stats[1]:.2f}%")
-            print(f"   • Максимальный уровень: {battery_stats[2]:.2f}%")
-            
-            # Временные характеристики
-            cur.execute("""
-                SELECT 
-                    MIN(timestamp), 
-                    MAX(timestamp),
-                    EXTRACT(EPOCH FROM (MAX(timestamp) - MIN(timestamp))) / 86400 as days_covered
-                FROM sensor_data
-            """)
-            time_stats = cur.fetchone()
-            
-            print(f"\n🕒 ВРЕМЕННЫЕ ХАРАКТЕРИСТИКИ:")
-            print(f"   • Первая запись: {time_stats[0]}")
-            print(f"   • Последняя запись: {time_stats[1]}")
-            print(f"   • Период покрытия: {time_stats[2]:.1f} дней")
-            
-            # Дополнительная аналитика
-            cur.execute("""
-                SELECT 
-                    COUNT(DISTINCT sensor_id) as unique_sensors,
-                    AVG(temperature) as global_avg_temp,
-                    PERCENTILE_CONT(0.5) WITHIN GROUP (ORDER BY temperature) as median_temp,
-                    MODE() WITHIN GROUP (ORDER BY sensor_id) as most_active_sensor
-                FROM sensor_data
-            """)
-            analytics = cur.fetchone()
-            
-            print(f"\n📈 АНАЛИТИКА:")
-            print(f"   • Уникальных сенсоров: {analytics[0]}")
-            print(f"   • Глобальная средняя температура: {analytics[1]:.2f}°C")
-            print(f"   • Медианная температура: {analytics[2]:.2f}°C")
-            print(f"   • Самый активный сенсор: {analytics[3]}")
-            
-            # 3. ДОПОЛНИТЕЛЬНЫЕ ГРАФИКИ - РАСПРЕДЕЛЕНИЕ ПО МЕСЯЦАМ
-            print(f"\n📅 РАСПРЕДЕЛЕНИЕ ДАННЫХ ПО МЕСЯЦАМ (PostgreSQL)")
-            
-            cur.execute("""
-                SELECT 
-                    TO_CHAR(timestamp, 'YYYY-MM') as month,
-                    AVG(temperature) as avg_temp,
-                    COUNT(*) as record_count
-                FROM sensor_data
-                GROUP BY TO_CHAR(timestamp, 'YYYY-MM')
-                ORDER BY month
-            """)
-            monthly_data = cur.fetchall()
-            
-            # Подготовка данных для графиков
-            months = [item[0] for item in monthly_data]
-            monthly_temps = [float(item[1]) for item in monthly_data]
-            monthly_counts = [item[2] for item in monthly_data]
-            
-            # Графики временного распределения
-            plt.figure(figsize=(15, 10))
-            
-            # График 1: Средняя температура по месяцам
-            plt.subplot(2, 2, 1)
-            plt.plot(months, monthly_temps, 'o-', linewidth=2, markersize=4, color='red', alpha=0.7)
-            plt.title('Средняя температура по месяцам (PostgreSQL)')
-            plt.xlabel('Месяц')
-            plt.ylabel('Средняя температура (°C)')
-            plt.xticks(rotation=45)
-            plt.grid(True, alpha=0.3)
-            
-            # График 2: Количество записей по месяцам
-            plt.subplot(2, 2, 2)
-            plt.bar(months, monthly_counts, color='green', alpha=0.7)
-            plt.title('Количество записей по месяцам (PostgreSQL)')
-            plt.xlabel('Месяц')
-            plt.ylabel('Количество записей')
-            plt.xticks(rotation=45)
-            plt.grid(True, alpha=0.3)
-            
-            # График 3: Распределение влажности
-            plt.subplot(2, 2, 3)
-            cur.execute("""
-                SELECT sensor_id, AVG(humidity) as avg_humidity
-                FROM sensor_data
-                GROUP BY sensor_id
-                ORDER BY avg_humidity DESC
-            """)
-            humidity_data = cur.fetchall()
-            
-            humidity_sensors = [item[0] for item in humidity_data]
-            humidity_values = [float(item[1]) for item in humidity_data]
-            
-            plt.bar(range(len(humidity_sensors)), humidity_values, color='blue', alpha=0.7)
-            plt.title('Средняя влажность по сенсорам (PostgreSQL)')
-            plt.xlabel('Сенсоры')
-            plt.ylabel('Средняя влажность (%)')
-            plt.xticks(range(len(humidity_sensors)), humidity_sensors, rotation=90, fontsize=6)
-            plt.grid(True, alpha=0.3)
-            
-            # График 4: Распределение давления
-            plt.subplot(2, 2, 4)
-            cur.execute("""
-                SELECT sensor_id, AVG(pressure) as avg_pressure
-                FROM sensor_data
-                GROUP BY sensor_id
-                ORDER BY avg_pressure DESC
-            """)
-            pressure_data = cur.fetchall()
-            
-            pressure_sensors = [item[0] for item in pressure_data]
-            pressure_values = [float(item[1]) for item in pressure_data]
-            
-            plt.bar(range(len(pressure_sensors)), pressure_values, color='purple', alpha=0.7)
-            plt.title('Среднее давление по сенсорам (PostgreSQL)')
-            plt.xlabel('Сенсоры')
-            plt.ylabel('Среднее давление (hPa)')
-            plt.xticks(range(len(pressure_sensors)), pressure_sensors, rotation=90, fontsize=6)
-            plt.grid(True, alpha=0.3)
-            
-            plt.tight_layout()
-            plt.show()
-            
-            # 4. СТАТИСТИКА ПО СЕНСОРАМ
-            print(f"\n📋 СТАТИСТИКА ПО ВСЕМ СЕНСОРАМ (PostgreSQL):")
-            
-            cur.execute("""
-                SELECT 
-                    sensor_id,
-                    COUNT(*) as records,
-                    AVG(temperature) as avg_temp,
-                    MAX(temperature) as max_temp,
-                    MIN(temperature) as min_temp,
-                    STDDEV(temperature) as std_temp,
-                    AVG(humidity) as avg_humidity,
-                    AVG(pressure) as avg_pressure,
-                    AVG(battery_level) as avg_battery
-                FROM sensor_data
-                GROUP BY sensor_id
-                ORDER BY records DESC
-            """)
-            sensor_stats = cur.fetchall()
-            
-            # Создаем DataFrame для удобного отображения
-            stats_columns = ['sensor_id', 'records', 'avg_temp', 'max_temp', 'min_temp', 'std_temp', 'avg_humidity', 'avg_pressure', 'avg_battery']
-            stats_df = pd.DataFrame(sensor_stats, columns=stats_columns)
-            
-            print(f"Всего сенсоров: {len(stats_df)}")
-            print(f"\nОбщая статистика по сенсорам:")
-            print(f"• Среднее количество записей на сенсор: {stats_df['records'].mean():.0f}")
-            print(f"• Мин-макс записей: {stats_df['records'].min()} - {stats_df['records'].max()}")
-            print(f"• Средняя температура по сенсорам: {stats_df['avg_temp'].mean():.2f}°C")
-            print(f"• Средняя влажность по сенсорам: {stats_df['avg_humidity'].mean():.2f}%")
-            print(f"• Среднее давление по сенсорам: {stats_df['avg_pressure'].mean():.2f} hPa")
-        
-        conn.close()
+        # Общая статистика температуры
+        temp_stats = analysis['temp_stats']
+        
+        print(f"🌡️  ТЕМПЕРАТУРА:")
+        print(f"   • Средняя: {temp_stats[0]:.2f}°C")
+        print(f"   • Минимальная: {temp_stats[1]:.2f}°C")
+        print(f"   • Максимальная: {temp_stats[2]:.2f}°C")
+        print(f"   • Стандартное отклонение: {temp_stats[3]:.2f}°C")
+        print(f"   • Всего записей: {temp_stats[4]:,}")
+        
+        # Статистика влажности
+        humidity_stats = analysis['humidity_stats']
+        
+        print(f"💧 ВЛАЖНОСТЬ:")
+        print(f"   • Средняя: {humidity_stats[0]:.2f}%")
+        print(f"   • Минимальная: {humidity_stats[1]:.2f}%")
+        print(f"   • Максимальная: {humidity_stats[2]:.2f}%")
+        
+        # Статистика давления
+        pressure_stats = analysis['pressure_stats']
+        
+        print(f"📊 ДАВЛЕНИЕ:")
+        print(f"   • Среднее: {pressure_stats[0]:.2f} hPa")
+        print(f"   • Минимальное: {pressure_stats[1]:.2f} hPa")
+        print(f"   • Максимальное: {pressure_stats[2]:.2f} hPa")
+        
+        # Статистика уровня батареи
+        battery_stats = analysis['battery_stats']
+        
+        print(f"🔋 БАТАРЕЯ:")
+        print(f"   • Средний уровень: {battery_stats[0]:.2f}%")
+        print(f"   • Минимальный уровень: {battery_stats[1]:.2f}%")
+        print(f"   • Максимальный уровень: {battery_stats[2]:.2f}%")
+        
+        # Временные характеристики
+        time_stats = analysis['time_stats']
+        
+        print(f"\n🕒 ВРЕМЕННЫЕ ХАРАКТЕРИСТИКИ:")
+        print(f"   • Первая запись: {time_stats[0]}")
+        print(f"   • Последняя запись: {time_stats[1]}")
+        print(f"   • Период покрытия: {time_stats[2]:.1f} дней")
+        
+        # Дополнительная аналитика
+        analytics = analysis['analytics']
+        
+        print(f"\n📈 АНАЛИТИКА:")
+        print(f"   • Уникальных сенсоров: {analytics[0]}")
+        print(f"   • Глобальная средняя температура: {analytics[1]:.2f}°C")
+        print(f"   • Медианная температура: {analytics[2]:.2f}°C")
+        print(f"   • Самый активный сенсор: {analytics[3]}")
+        
+        # 3. ДОПОЛНИТЕЛЬНЫЕ ГРАФИКИ - РАСПРЕДЕЛЕНИЕ ПО МЕСЯЦАМ
+        print(f"\n📅 РАСПРЕДЕЛЕНИЕ ДАННЫХ ПО МЕСЯЦАМ (PostgreSQL)")
+        
+        monthly_data = analysis['monthly_data']
+        
+        # Подготовка данных для графиков
+        months = result_column(monthly_data, 0, dtype=object)
+        monthly_temps = result_column(monthly_data, 1)
+        monthly_counts = result_column(monthly_data, 2)
+        
+        # Графики временного распределения
+        plot_span = open_span("postgresql.plot", figure="time_distribution")
+        plt.figure(figsize=(15, 10))
+        
+        # График 1: Средняя температура по месяцам
+        plt.subplot(2, 2, 1)
+        plt.plot(months, monthly_temps, 'o-', linewidth=2, markersize=4, color='red', alpha=0.7)
+        plt.title('Средняя температура по месяцам (PostgreSQL)')
+        plt.xlabel('Месяц')
+        plt.ylabel('Средняя температура (°C)')
+        plt.xticks(rotation=45)
+        plt.grid(True, alpha=0.3)
+        
+        # График 2: Количество записей по месяцам
+        plt.subplot(2, 2, 2)
+        plt.bar(months, monthly_counts, color='green', alpha=0.7)
+        plt.title('Количество записей по месяцам (PostgreSQL)')
+        plt.xlabel('Месяц')
+        plt.ylabel('Количество записей')
+        plt.xticks(rotation=45)
+        plt.grid(True, alpha=0.3)
+        
+        # График 3: Распределение влажности
+        plt.subplot(2, 2, 3)
+        humidity_data = analysis['humidity_data']
+        
+        humidity_sensors = result_column(humidity_data, 0, dtype=object)
+        humidity_values = result_column(humidity_data, 1)
+        
+        plt.bar(range(len(humidity_sensors)), humidity_values, color='blue', alpha=0.7)
+        plt.title('Средняя влажность по сенсорам (PostgreSQL)')
+        plt.xlabel('Сенсоры')
+        plt.ylabel('Средняя влажность (%)')
+        plt.xticks(range(len(humidity_sensors)), humidity_sensors, rotation=90, fontsize=6)
+        plt.grid(True, alpha=0.3)
+        
+        # График 4: Распределение давления
+        plt.subplot(2, 2, 4)
+        pressure_data = analysis['pressure_data']
+        
+        pressure_sensors = result_column(pressure_data, 0, dtype=object)
+        pressure_values = result_column(pressure_data, 1)
+        
+        plt.bar(range(len(pressure_sensors)), pressure_values, color='purple', alpha=0.7)
+        plt.title('Среднее давление по сенсорам (PostgreSQL)')
+        plt.xlabel('Сенсоры')
+        plt.ylabel('Среднее давление (hPa)')
+        plt.xticks(range(len(pressure_sensors)), pressure_sensors, rotation=90, fontsize=6)
+        plt.grid(True, alpha=0.3)
+        
+        plt.tight_layout()
+        plt.show()
+        plot_span.close()
+        
+        # 4. СТАТИСТИКА ПО СЕНСОРАМ
+        print(f"\n📋 СТАТИСТИКА ПО ВСЕМ СЕНСОРАМ (PostgreSQL):")
+        
+        sensor_stats = analysis['sensor_stats']
+        
+        # Создаем DataFrame для удобного отображения
+        stats_columns = ['sensor_id', 'records', 'avg_temp', 'max_temp', 'min_temp', 'std_temp', 'avg_humidity', 'avg_pressure', 'avg_battery']
+        stats_df = sensor_stats.set_axis(stats_columns, axis=1)
+        
+        print(f"Всего сенсоров: {len(stats_df)}")
+        print(f"\nОбщая статистика по сенсорам:")
+        print(f"• Среднее количество записей на сенсор: {stats_df['records'].mean():.0f}")
+        print(f"• Мин-макс записей: {stats_df['records'].min()} - {stats_df['records'].max()}")
+        print(f"• Средняя температура по сенсорам: {stats_df['avg_temp'].mean():.2f}°C")
+        print(f"• Средняя влажность по сенсорам: {stats_df['avg_humidity'].mean():.2f}%")
+        print(f"• Среднее давление по сенсорам: {stats_df['avg_pressure'].mean():.2f} hPa")
+        
         return True
         
     except Exception as e:
         print(f"❌ Ошибка при анализе PostgreSQL: {e}")
         return False
+    
+    finally:
+        if conn is not None:
+            release_pg_connection(conn)
 
 # Запуск полного анализа PostgreSQL
 if 'pg_conn_params' in locals():
@@ -452,113 +1747,745 @@ else:
 
 
 
-print("\n" + "="*60)
-print("📊 MONGODB: РАБОТА С ДОКУМЕНТО-ОРИЕНТИРОВАННОЙ БАЗОЙ ДАННЫХ")
-print("="*60)
+print("\n" + "="*60)
+print("📊 MONGODB: РАБОТА С ДОКУМЕНТО-ОРИЕНТИРОВАННОЙ БАЗОЙ ДАННЫХ")
+print("="*60)
+
+# Хранение sensor_data в MongoDB: False - обычная коллекция (документ на запись),
+# True - нативная time-series коллекция (записи одного сенсора хранятся сжатыми бакетами)
+mongo_timeseries = False
+
+# Гранулярность бакетов time-series коллекции: по интервалу между записями одного
+# сенсора (около 103 сенсоров и ~1000 записей на сенсор в год - порядка часов)
+mongo_timeseries_granularity = "hours"
+
+MONGO_TIMESERIES_OPTIONS = {"timeField": "timestamp", "metaField": "sensor_id"}
+
+def mongo_storage_stats(collection):
+    """Размер коллекции на диске и в индексах (для time-series - по бакетам)"""
+    stats = next(collection.aggregate([{"$collStats": {"storageStats": {}}}]))['storageStats']
+    return {
+        'documents': stats.get('count', 0),
+        'data_size': stats.get('size', 0),
+        'storage_size': stats.get('storageSize', 0),
+        'index_size': stats.get('totalIndexSize', 0)
+    }
+
+def run_mongodb_pipeline(collection, pipeline):
+    """Выполнение агрегации с выборкой всех документов"""
+    return list(collection.aggregate(pipeline))
+
+from pymongo.write_concern import WriteConcern
+
+# Загрузка в MongoDB: "parallel" - документы собираются из столбцов чанка, неупорядоченные
+# insert_many идут из пула потоков; "serial" - исходный вариант (to_dict и упорядоченные вставки)
+mongo_load_mode = "parallel"
+mongo_load_workers = 4
+mongo_batch_size = 10000
+
+# Write concern загрузки: {"w": 1} - подтверждение от primary, {"w": 0} - без подтверждения,
+# {"w": "majority", "j": True} - запись в журнал большинства узлов
+mongo_write_concern = {"w": 1}
+
+def _mongo_column_values(column):
+    """Значения столбца чанка в виде списка встроенных типов Python (для BSON)"""
+    if column.dtype.kind == 'f':
+        # float32 компактной схемы хранит 23.1 как 23.100000381...; в базе - два знака
+        return np.round(column.to_numpy(dtype=np.float64), 2).tolist()
+    if column.dtype.kind == 'M':
+        # datetime64 -> datetime.datetime (BSON хранит время с точностью до миллисекунд)
+        return column.to_numpy().astype('datetime64[ms]').tolist()
+    return column.tolist()
+
+def mongo_documents_from_chunk(chunk):
+    """Документы MongoDB из столбцов чанка без построчного to_dict"""
+    columns = list(chunk.columns)
+    values = [_mongo_column_values(chunk[name]) for name in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+def _iter_mongo_batches(chunks, batch_size):
+    """Пачки документов из потока чанков"""
+    for chunk in chunks:
+        for batch in iter_df_chunks(chunk, batch_size):
+            yield mongo_documents_from_chunk(batch)
+
+def _insert_mongo_batch(collection, documents):
+    """Неупорядоченная вставка: сервер не останавливается на первой ошибке и не ждет порядка"""
+    collection.insert_many(documents, ordered=False)
+    return len(documents)
+
+def _pooled_mongo_writes(write, collection, batches, n_workers):
+    """Запись пачек из пула потоков; в работе не больше 2*n_workers пачек"""
+    written = 0
+    pending = deque()
+    with ThreadPoolExecutor(max_workers=n_workers) as pool:
+        for batch in batches:
+            if len(pending) >= 2 * n_workers:
+                written += pending.popleft().result()
+            pending.append(pool.submit(write, collection, batch))
+        while pending:
+            written += pending.popleft().result()
+    return written
+
+def parallel_load_mongodb(collection, chunks, n_workers, batch_size):
+    """Неупорядоченные insert_many из пула потоков"""
+    return _pooled_mongo_writes(_insert_mongo_batch, collection, _iter_mongo_batches(chunks, batch_size), n_workers)
+
+def setup_mongodb(chunks=None):
+    """Настройка MongoDB и создание коллекции sensor_data"""
+    if chunks is None:
+        chunks = iot_chunk_source()
+    try:
+        # Подключение к MongoDB
+        client = MongoClient('mongodb://localhost:27017/')
+        
+        # Проверка подключения
+        client.admin.command('ismaster')
+        print("✅ Успешное подключение к MongoDB")
+        
+        db = client['iot_studies']
+        
+        # Очистка существующей коллекции
+        db.sensor_data.drop()
+        
+        if mongo_timeseries:
+            db.create_collection('sensor_data', timeseries={
+                **MONGO_TIMESERIES_OPTIONS, "granularity": mongo_timeseries_granularity
+            })
+            print(f"✅ Создана time-series коллекция sensor_data (гранулярность: {mongo_timeseries_granularity})")
+        
+        # Загрузка данных в MongoDB
+        print("📥 Загрузка данных в MongoDB...")
+        collection = db['sensor_data'].with_options(write_concern=WriteConcern(**mongo_write_concern))
+        with span("mongodb.load", mode=mongo_load_mode, write_concern=mongo_write_concern) as load_span:
+            if mongo_load_mode == "parallel":
+                loaded = parallel_load_mongodb(collection, chunks, mongo_load_workers, mongo_batch_size)
+            else:
+                # Загрузка данных пачками для оптимизации
+                loaded = 0
+                for chunk in chunks:
+                    for batch in iter_df_chunks(chunk, mongo_batch_size):
+                        records = batch.to_dict('records')
+                        collection.insert_many(records)
+                    loaded += len(chunk)
+            load_span.rows = loaded
+        load_time = load_span.seconds
+        
+        print(f"✅ Загружено {loaded:,} записей в MongoDB за {load_time:.2f} секунд "
+              f"({loaded / max(load_time, 1e-9):,.0f} документов/сек, режим: {mongo_load_mode}, "
+              f"write concern: {mongo_write_concern})")
+        
+        with span("mongodb.index_build") as index_span:
+            if mongo_timeseries:
+                # Индекс (sensor_id, timestamp) по бакетам создается вместе с коллекцией
+                print("✅ Используется встроенный индекс time-series коллекции по (sensor_id, timestamp)")
+            else:
+                # Создание индексов для оптимизации
+                collection.create_index("sensor_id")
+                collection.create_index("timestamp")
+                collection.create_index([("sensor_id", 1), ("timestamp", 1)])
+                print("✅ Созданы индексы для оптимизации запросов")
+        index_time = index_span.seconds
+        
+        ingest_stats['mongodb'] = {
+            'layout': 'timeseries' if mongo_timeseries else 'regular',
+            'mode': mongo_load_mode,
+            'connections': mongo_load_workers if mongo_load_mode == "parallel" else 1,
+            'write_concern': mongo_write_concern,
+            'records': loaded,
+            'load_time': load_time,
+            'index_time': index_time,
+            'rows_per_sec': loaded / load_time if load_time > 0 else None
+        }
+        
+        return client
+        
+    except Exception as e:
+        print(f"❌ Ошибка при работе с MongoDB: {e}")
+        return None
+
+from pymongo import UpdateOne
+
+# Схема с бакетами: документ на сенсор и интервал времени с массивом показаний и накопленными
+# count/sum/min/max, которые обновляются upsert-ами ($inc/$min/$max) при загрузке.
+# Коллекция sensor_buckets ведется рядом с sensor_data, запрос максимума и помесячная
+# агрегация читают готовые поля бакетов вместо всех документов
+mongo_use_buckets = False
+
+# Ширина бакета: интервал -> частота периода pandas. Бакеты не должны пересекать границу
+# месяца (помесячная агрегация читает только начало бакета), поэтому недели нет.
+# При плотности лабораторных данных (~1000 показаний на сенсор в год) в часовом бакете
+# около одного показания, и выигрыша от схемы не видно - бакет нужно расширять
+MONGO_BUCKET_WIDTHS = {"hour": "h", "day": "D", "month": "M"}
+mongo_bucket_width = "day"
+
+MONGO_BUCKET_READING_FIELDS = ["timestamp", "temperature", "humidity", "pressure", "battery_level", "record_id"]
+
+def mongo_bucket_updates(chunk):
+    """Upsert-ы бакетов (сенсор, начало интервала mongo_bucket_width) для чанка: агрегаты считаются по чанку векторно"""
+    readings = mongo_documents_from_chunk(chunk[MONGO_BUCKET_READING_FIELDS])
+    temperature = chunk['temperature'].to_numpy(dtype=np.float64).round(2)
+    period = MONGO_BUCKET_WIDTHS[mongo_bucket_width]
+    frame = pd.DataFrame({
+        'sensor_id': chunk['sensor_id'].astype(str).to_numpy(),
+        'start': chunk['timestamp'].dt.to_period(period).dt.start_time.to_numpy().astype('datetime64[ms]'),
+        'temperature': temperature,
+        'temperature_sq': temperature * temperature,
+        'timestamp': chunk['timestamp'].to_numpy().astype('datetime64[ms]')
+    })
+    # Бакеты идут в порядке ключа, как и upsert-ы сводных таблиц PostgreSQL
+    grouped = frame.groupby(['sensor_id', 'start'], sort=True)
+    aggregates = grouped.agg(
+        count=('temperature', 'size'), temp_sum=('temperature', 'sum'), temp_sumsq=('temperature_sq', 'sum'),
+        temp_min=('temperature', 'min'), temp_max=('temperature', 'max'),
+        first_timestamp=('timestamp', 'min'), last_timestamp=('timestamp', 'max')
+    )
+    positions = grouped.indices
+
+    updates = []
+    for key, row in zip(aggregates.index, aggregates.itertuples(index=False)):
+        sensor_id, start = key[0], pd.Timestamp(key[1]).to_pydatetime()
+        updates.append(UpdateOne(
+            {"_id": {"sensor_id": sensor_id, "start": start}},
+            {
+                "$setOnInsert": {"sensor_id": sensor_id, "start": start, "width": mongo_bucket_width},
+                "$push": {"readings": {"$each": [readings[i] for i in positions[key]]}},
+                "$inc": {"count": int(row.count), "temp_sum": float(row.temp_sum), "temp_sumsq": float(row.temp_sumsq)},
+                "$min": {"temp_min": float(row.temp_min), "first_timestamp": pd.Timestamp(row.first_timestamp).to_pydatetime()},
+                "$max": {"temp_max": float(row.temp_max), "last_timestamp": pd.Timestamp(row.last_timestamp).to_pydatetime()}
+            },
+            upsert=True
+        ))
+    return updates, len(chunk)
+
+def _write_bucket_batch(collection, batch):
+    """Неупорядоченная пачка upsert-ов бакетов; возвращает число показаний"""
+    updates, n_readings = batch
+    if updates:
+        collection.bulk_write(updates, ordered=False)
+    return n_readings
+
+def _iter_bucket_batches(chunks, batch_size):
+    """Пачки upsert-ов бакетов из потока чанков"""
+    for chunk in chunks:
+        for batch in iter_df_chunks(chunk, batch_size):
+            yield mongo_bucket_updates(batch)
+
+def setup_mongodb_buckets(client, chunks=None):
+    """Создание и загрузка коллекции sensor_buckets (сенсор x интервал mongo_bucket_width)"""
+    if chunks is None:
+        chunks = iot_chunk_source()
+    try:
+        db = client['iot_studies']
+        db.sensor_buckets.drop()
+        buckets = db['sensor_buckets'].with_options(write_concern=WriteConcern(**mongo_write_concern))
+
+        with span("mongodb.buckets_load", workers=mongo_load_workers) as load_span:
+            loaded = _pooled_mongo_writes(_write_bucket_batch, buckets, _iter_bucket_batches(chunks, mongo_batch_size),
+                                          mongo_load_workers)
+            load_span.rows = loaded
+        load_time = load_span.seconds
+        n_buckets = buckets.estimated_document_count()
+
+        ingest_stats['mongodb_buckets'] = {
+            'layout': 'buckets',
+            'mode': 'upsert',
+            'connections': mongo_load_workers,
+            'records': loaded,
+            'buckets': n_buckets,
+            'bucket_width': mongo_bucket_width,
+            'readings_per_bucket': loaded / n_buckets if n_buckets else None,
+            'load_time': load_time,
+            'index_time': 0.0,
+            'rows_per_sec': loaded / load_time if load_time > 0 else None
+        }
+        print(f"✅ Загружено {loaded:,} показаний в {n_buckets:,} бакетов sensor_buckets "
+              f"(ширина: {mongo_bucket_width}, {loaded / max(n_buckets, 1):.1f} показаний на бакет) за {load_time:.2f} секунд "
+              f"({loaded / max(load_time, 1e-9):,.0f} показаний/сек)")
+        return True
+
+    except Exception as e:
+        print(f"❌ Ошибка при загрузке бакетов MongoDB: {e}")
+        return False
+
+# Запросы по бакетам: те же результаты, что и по отдельным документам
+MONGO_BUCKET_MAX_TEMPERATURE_PIPELINE = [
+    {"$group": {"_id": "$sensor_id", "max_temperature": {"$max": "$temp_max"}, "total_records": {"$sum": "$count"}}},
+    {"$sort": {"max_temperature": -1}}
+]
+
+MONGO_BUCKET_MONTHLY_PIPELINE = [
+    {"$group": {
+        "_id": {"year": {"$year": "$start"}, "month": {"$month": "$start"}},
+        "temp_sum": {"$sum": "$temp_sum"},
+        "record_count": {"$sum": "$count"}
+    }},
+    {"$project": {"avg_temp": {"$divide": ["$temp_sum", "$record_count"]}, "record_count": 1}},
+    {"$sort": {"_id.year": 1, "_id.month": 1}}
+]
+
+# Настройка MongoDB
+mongo_client = setup_mongodb()
+mongo_buckets_ready = bool(mongo_client) and mongo_use_buckets and setup_mongodb_buckets(mongo_client)
+
+MONGO_MAX_TEMPERATURE_PIPELINE = [
+    {
+        "$group": {
+            "_id": "$sensor_id",
+            "max_temperature": {"$max": "$temperature"},
+            "total_records": {"$sum": 1}
+        }
+    },
+    {
+        "$sort": {"max_temperature": -1}
+    }
+]
+
+def mongo_max_temperature_source():
+    """Коллекция и агрегация для поиска максимальной температуры (бакеты, если они загружены)"""
+    db = mongo_client['iot_studies']
+    if mongo_buckets_ready:
+        return db['sensor_buckets'], MONGO_BUCKET_MAX_TEMPERATURE_PIPELINE
+    return db['sensor_data'], MONGO_MAX_TEMPERATURE_PIPELINE
+
+def mongodb_max_temperature_query():
+    """Агрегационный запрос MongoDB для поиска максимальной температуры по сенсорам"""
+    try:
+        collection, pipeline = mongo_max_temperature_source()
+        
+        return list(collection.aggregate(pipeline))
+        
+    except Exception as e:
+        print(f"❌ Ошибка в MongoDB запросе: {e}")
+        return []
+
+def explain_mongodb_pipeline(collection, pipeline):
+    """explain агрегации с уровнем подробности executionStats"""
+    return collection.database.command(
+        'explain', {'aggregate': collection.name, 'pipeline': pipeline, 'cursor': {}},
+        verbosity='executionStats'
+    )
+
+def _iter_explain_documents(value):
+    """Все вложенные документы explain (стадии плана лежат на разной глубине)"""
+    stack = [value]
+    while stack:
+        item = stack.pop()
+        if isinstance(item, dict):
+            yield item
+            stack.extend(item.values())
+        elif isinstance(item, list):
+            stack.extend(item)
+
+def summarize_mongodb_explain(explain):
+    """Ключевые метрики explain MongoDB в тех же полях, что и для PostgreSQL"""
+    # Для агрегации чтение коллекции описано либо в первой стадии $cursor,
+    # либо (при выполнении в SBE) на верхнем уровне
+    cursor = explain
+    stages = explain.get('stages', [])
+    if stages and '$cursor' in stages[0]:
+        cursor = stages[0]['$cursor']
+    stats = cursor.get('executionStats', {})
+    winning_plan = cursor.get('queryPlanner', {}).get('winningPlan', {})
+    plan_nodes = list(_iter_explain_documents(winning_plan))
+    return {
+        'rows_scanned': stats.get('totalDocsExamined', 0),
+        'keys_examined': stats.get('totalKeysExamined', 0),
+        'scan_types': sorted({node['stage'] for node in plan_nodes if 'stage' in node}),
+        'indexes': sorted({node['indexName'] for node in plan_nodes if 'indexName' in node}),
+        'spill_to_disk': any(doc.get('usedDisk') is True or (isinstance(doc.get('spills'), int) and doc['spills'] > 0)
+                             for doc in _iter_explain_documents(explain)),
+        'execution_ms': stats.get('executionTimeMillis')
+    }
+
+def capture_mongodb_plan(label, collection, pipeline, elapsed):
+    """explain executionStats для замеренной агрегации MongoDB; ошибка плана не прерывает замеры"""
+    if not capture_query_plans:
+        return None
+    try:
+        explain = explain_mongodb_pipeline(collection, pipeline)
+        metrics = summarize_mongodb_explain(explain)
+    except Exception as e:
+        print(f"⚠️ Не удалось получить план {label}: {e}")
+        return None
+    record_query_plan(label, 'MongoDB', elapsed, explain, metrics)
+    return metrics
+
+if mongo_client:
+    print("\n🔍 ВЫПОЛНЕНИЕ ЗАДАНИЯ: Агрегационный запрос для поиска максимальной температуры")
+    
+    # Измеряем время выполнения
+    mongo_result, mongo_time = measure_time(mongodb_max_temperature_query)
+    
+    print(f"⏱️ Время выполнения MongoDB агрегации: {mongo_time:.4f} секунд")
+    capture_mongodb_plan("MongoDB: максимальная температура", *mongo_max_temperature_source(), mongo_time)
+    print(f"📊 Найдено {len(mongo_result)} уникальных сенсоров")
+    
+    # Показываем топ-5 сенсоров с самой высокой температурой
+    print("\n🔥 Топ-5 сенсоров с максимальной температурой (MongoDB):")
+    for i, sensor in enumerate(mongo_result[:5]):
+        print(f"  {i+1}. {sensor['_id']}: {sensor['max_temperature']}°C (записей: {sensor['total_records']})")
+else:
+    print("❌ Пропуск выполнения запроса MongoDB из-за ошибки настройки")
+    mongo_time = None
+
+
+
+# ГРАФИКИ ДЛЯ MONGODB - ИСПРАВЛЕННЫЙ КОД ДЛЯ ВРЕМЕННОГО РАСПРЕДЕЛЕНИЯ
+print("📊 MONGODB: ПОЛНЫЙ АНАЛИЗ ДАННЫХ (ИСПРАВЛЕННЫЙ)")
+print("="*50)
+
+# Агрегации полного анализа MongoDB: метрика -> pipeline (каждая - отдельный проход по коллекции)
+MONGO_ANALYSIS_PIPELINES = {
+    # Средняя температура по сенсорам
+    "temp_data": [
+        {"$group": {"_id": "$sensor_id", "avg_temp": {"$avg": "$temperature"}}},
+        {"$sort": {"avg_temp": -1}}
+    ],
+    # Максимальная температура по сенсорам
+    "max_temp_data": [
+        {"$group": {"_id": "$sensor_id", "max_temp": {"$max": "$temperature"}}},
+        {"$sort": {"max_temp": -1}}
+    ],
+    # Количество записей по сенсорам
+    "count_data": [
+        {"$group": {"_id": "$sensor_id", "count": {"$sum": 1}}},
+        {"$sort": {"count": -1}}
+    ],
+    # Стандартное отклонение температуры по сенсорам
+    "std_data": [
+        {"$group": {"_id": "$sensor_id", "std_temp": {"$stdDevPop": "$temperature"}}},
+        {"$sort": {"std_temp": -1}}
+    ],
+    # Общая статистика температуры
+    "temp_stats": [
+        {"$group": {
+            "_id": None,
+            "avg_temperature": {"$avg": "$temperature"},
+            "min_temperature": {"$min": "$temperature"},
+            "max_temperature": {"$max": "$temperature"},
+            "std_temperature": {"$stdDevPop": "$temperature"},
+            "count": {"$sum": 1}
+        }}
+    ],
+    # Статистика влажности
+    "humidity_stats": [
+        {"$group": {
+            "_id": None,
+            "avg_humidity": {"$avg": "$humidity"},
+            "min_humidity": {"$min": "$humidity"},
+            "max_humidity": {"$max": "$humidity"}
+        }}
+    ],
+    # Статистика давления
+    "pressure_stats": [
+        {"$group": {
+            "_id": None,
+            "avg_pressure": {"$avg": "$pressure"},
+            "min_pressure": {"$min": "$pressure"},
+            "max_pressure": {"$max": "$pressure"}
+        }}
+    ],
+    # Статистика уровня батареи
+    "battery_stats": [
+        {"$group": {
+            "_id": None,
+            "avg_battery": {"$avg": "$battery_level"},
+            "min_battery": {"$min": "$battery_level"},
+            "max_battery": {"$max": "$battery_level"}
+        }}
+    ],
+    # Первая и последняя запись
+    "time_stats": [
+        {"$group": {
+            "_id": None,
+            "first_record": {"$min": "$timestamp"},
+            "last_record": {"$max": "$timestamp"}
+        }}
+    ],
+    # Распределение по месяцам
+    "monthly_data": [
+        {
+            "$project": {
+                "year": {"$year": "$timestamp"},
+                "month": {"$month": "$timestamp"},
+                "temperature": 1
+            }
+        },
+        {
+            "$group": {
+                "_id": {"year": "$year", "month": "$month"},
+                "avg_temp": {"$avg": "$temperature"},
+                "record_count": {"$sum": 1}
+            }
+        },
+        {
+            "$sort": {"_id.year": 1, "_id.month": 1}
+        }
+    ],
+    # Средняя влажность по сенсорам
+    "humidity_data": [
+        {"$group": {
+            "_id": "$sensor_id", 
+            "avg_humidity": {"$avg": "$humidity"}
+        }},
+        {"$sort": {"avg_humidity": -1}}
+    ],
+    # Среднее давление по сенсорам
+    "pressure_data": [
+        {"$group": {
+            "_id": "$sensor_id", 
+            "avg_pressure": {"$avg": "$pressure"}
+        }},
+        {"$sort": {"avg_pressure": -1}}
+    ],
+    # Статистика по сенсорам
+    "sensor_stats": [
+        {"$group": {
+            "_id": "$sensor_id",
+            "records": {"$sum": 1},
+            "avg_temp": {"$avg": "$temperature"},
+            "max_temp": {"$max": "$temperature"},
+            "min_temp": {"$min": "$temperature"},
+            "std_temp": {"$stdDevPop": "$temperature"},
+            "avg_humidity": {"$avg": "$humidity"},
+            "avg_pressure": {"$avg": "$pressure"},
+            "avg_battery": {"$avg": "$battery_level"}
+        }},
+        {"$sort": {"records": -1}}
+    ]
+}
+
+# Метрики из одного документа (общие итоги по коллекции)
+MONGO_ANALYSIS_SCALARS = {'temp_stats', 'humidity_stats', 'pressure_stats', 'battery_stats', 'time_stats'}
+
+# Колоночная выборка: пачки BSON декодируются сразу в столбцы Arrow/NumPy по заданной
+# схеме, без промежуточного словаря на каждый документ. pyarrow и pymongoarrow
+# необязательны: без них результаты читаются обычным курсором.
+# Колоночная выборка применяется к агрегациям режима "separate" (строка на сенсор) и
+# к чтению показаний (verify_device_stats_readback). Режим "single_pass" возвращает
+# один документ $facet, его колоночное декодирование не ускоряет: при режиме по
+# умолчанию колоночный путь выполняется только в сравнительном прогоне режима "separate"
+mongo_columnar_fetch = True
 
-def setup_mongodb():
-    """Настройка MongoDB и создание коллекции sensor_data"""
+if mongo_columnar_fetch:
     try:
-        # Подключение к MongoDB
-        client = MongoClient('mongodb://localhost:27017/')
-        
-        # Проверка подключения
-        client.admin.command('ismaster')
-        print("✅ Успешное подключение к MongoDB")
-        
-        db = client['iot_studies']
-        
-        # Очистка существующей коллекции
-        db.sensor_data.drop()
-        
-        # Загрузка данных в MongoDB
-        print("📥 Загрузка данных в MongoDB...")
-        collection = db['sensor_data']
-        
-        # Загрузка данных пачками для оптимизации
-        batch_size = 10000
-        for i in range(0, len(iot_df), batch_size):
-            batch = iot_df.iloc[i:i+batch_size]
-            records = batch.to_dict('records')
-            collection.insert_many(records)
-        
-        # Создание индексов для оптимизации
-        collection.create_index("sensor_id")
-        collection.create_index("timestamp")
-        collection.create_index([("sensor_id", 1), ("timestamp", 1)])
-        
-        print(f"✅ Загружено {len(iot_df):,} записей в MongoDB")
-        print("✅ Созданы индексы для оптимизации запросов")
-        
-        return client
-        
-    except Exception as e:
-        print(f"❌ Ошибка при работе с MongoDB: {e}")
-        return None
-
-# Настройка MongoDB
-mongo_client = setup_mongodb()
+        import pyarrow as pa
+        from pymongoarrow.api import Schema, aggregate_pandas_all, find_pandas_all
+    except ImportError as e:
+        print(f"⚠️ Колоночная выборка MongoDB недоступна ({e}), используется обычный курсор")
+        mongo_columnar_fetch = False
+
+# Схема документа с показанием (та же, что у сгенерированных чанков) и схемы результатов
+# агрегаций полного анализа с одной строкой на сенсор
+MONGO_READING_SCHEMA = None
+MONGO_ANALYSIS_SCHEMAS = {}
+
+if mongo_columnar_fetch:
+    MONGO_READING_SCHEMA = Schema({
+        "sensor_id": pa.string(),
+        "temperature": pa.float64(),
+        "timestamp": pa.timestamp('ms'),
+        "humidity": pa.float64(),
+        "pressure": pa.float64(),
+        "battery_level": pa.int64(),
+        "record_id": pa.int64()
+    })
+    MONGO_ANALYSIS_SCHEMAS = {
+        "temp_data": Schema({"_id": pa.string(), "avg_temp": pa.float64()}),
+        "max_temp_data": Schema({"_id": pa.string(), "max_temp": pa.float64()}),
+        "count_data": Schema({"_id": pa.string(), "count": pa.int64()}),
+        "std_data": Schema({"_id": pa.string(), "std_temp": pa.float64()}),
+        "humidity_data": Schema({"_id": pa.string(), "avg_humidity": pa.float64()}),
+        "pressure_data": Schema({"_id": pa.string(), "avg_pressure": pa.float64()}),
+        "sensor_stats": Schema({
+            "_id": pa.string(), "records": pa.int64(), "avg_temp": pa.float64(), "max_temp": pa.float64(),
+            "min_temp": pa.float64(), "std_temp": pa.float64(), "avg_humidity": pa.float64(),
+            "avg_pressure": pa.float64(), "avg_battery": pa.float64()
+        })
+    }
 
-def mongodb_max_temperature_query():
-    """Агрегационный запрос MongoDB для поиска максимальной температуры по сенсорам"""
-    try:
-        db = mongo_client['iot_studies']
-        collection = db['sensor_data']
-        
-        pipeline = [
-            {
-                "$group": {
-                    "_id": "$sensor_id",
-                    "max_temperature": {"$max": "$temperature"},
-                    "total_records": {"$sum": 1}
-                }
-            },
-            {
-                "$sort": {"max_temperature": -1}
-            }
+@traced("mongodb.decode")
+def aggregate_mongodb_frame(collection, pipeline, schema=None):
+    """Результат агрегации в DataFrame: колоночное декодирование BSON или, без pymongoarrow, курсор"""
+    if mongo_columnar_fetch and schema is not None:
+        return aggregate_pandas_all(collection, pipeline, schema=schema)
+    return pd.DataFrame(list(collection.aggregate(pipeline)))
+
+def iter_mongodb_sensor_chunks(collection):
+    """Показания из MongoDB помесячными DataFrame (диапазон по индексу timestamp),
+    вся коллекция в памяти клиента не держится"""
+    bounds = next(collection.aggregate([
+        {"$group": {"_id": None, "first": {"$min": "$timestamp"}, "last": {"$max": "$timestamp"}}}
+    ]), None)
+    if bounds is None:
+        return
+    months = pd.date_range(pd.Timestamp(bounds['first']).to_period('M').to_timestamp(),
+                           pd.Timestamp(bounds['last']) + pd.offsets.MonthBegin(1), freq='MS')
+    for start, end in zip(months[:-1], months[1:]):
+        month_filter = {"timestamp": {"$gte": start.to_pydatetime(), "$lt": end.to_pydatetime()}}
+        if mongo_columnar_fetch:
+            chunk = find_pandas_all(collection, month_filter, schema=MONGO_READING_SCHEMA)
+        else:
+            chunk = pd.DataFrame(list(collection.find(month_filter, {"_id": 0})))
+        if len(chunk):
+            yield chunk
+
+def mongo_result_column(result, field):
+    """Поле результата агрегации как массив - из DataFrame колоночной выборки или из списка документов"""
+    if isinstance(result, pd.DataFrame):
+        return result[field].to_numpy()
+    return np.array([doc[field] for doc in result])
+
+def fetch_mongodb_analysis_separate(collection):
+    """Метрики полного анализа отдельными агрегациями (каждая - полный проход по коллекции)"""
+    analysis = {}
+    for name, pipeline in MONGO_ANALYSIS_PIPELINES.items():
+        if mongo_columnar_fetch and name in MONGO_ANALYSIS_SCHEMAS:
+            analysis[name] = aggregate_mongodb_frame(collection, pipeline, MONGO_ANALYSIS_SCHEMAS[name])
+            continue
+        result = list(collection.aggregate(pipeline))
+        analysis[name] = result[0] if name in MONGO_ANALYSIS_SCALARS else result
+    analysis['collection_scans'] = len(MONGO_ANALYSIS_PIPELINES)
+    return analysis
+
+# Режим полного анализа MongoDB: "single_pass" - все метрики одной агрегацией ($facet),
+# "separate" - исходный вариант с отдельной агрегацией на каждую метрику
+mongo_analysis_mode = "single_pass"
+
+# Все метрики за один проход по коллекции: $facet получает документы один раз
+# и считает группировки по сенсору, по месяцу и общий итог параллельными ветками
+MONGO_SINGLE_PASS_ANALYSIS_PIPELINE = [
+    {"$facet": {
+        "by_sensor": [
+            {"$group": {
+                "_id": "$sensor_id",
+                "records": {"$sum": 1},
+                "avg_temp": {"$avg": "$temperature"},
+                "max_temp": {"$max": "$temperature"},
+                "min_temp": {"$min": "$temperature"},
+                "std_temp": {"$stdDevPop": "$temperature"},
+                "avg_humidity": {"$avg": "$humidity"},
+                "avg_pressure": {"$avg": "$pressure"},
+                "avg_battery": {"$avg": "$battery_level"}
+            }}
+        ],
+        "by_month": [
+            {"$group": {
+                "_id": {"year": {"$year": "$timestamp"}, "month": {"$month": "$timestamp"}},
+                "avg_temp": {"$avg": "$temperature"},
+                "record_count": {"$sum": 1}
+            }},
+            {"$sort": {"_id.year": 1, "_id.month": 1}}
+        ],
+        "total": [
+            {"$group": {
+                "_id": None,
+                "count": {"$sum": 1},
+                "avg_temperature": {"$avg": "$temperature"},
+                "min_temperature": {"$min": "$temperature"},
+                "max_temperature": {"$max": "$temperature"},
+                "std_temperature": {"$stdDevPop": "$temperature"},
+                "avg_humidity": {"$avg": "$humidity"},
+                "min_humidity": {"$min": "$humidity"},
+                "max_humidity": {"$max": "$humidity"},
+                "avg_pressure": {"$avg": "$pressure"},
+                "min_pressure": {"$min": "$pressure"},
+                "max_pressure": {"$max": "$pressure"},
+                "avg_battery": {"$avg": "$battery_level"},
+                "min_battery": {"$min": "$battery_level"},
+                "max_battery": {"$max": "$battery_level"},
+                "first_record": {"$min": "$timestamp"},
+                "last_record": {"$max": "$timestamp"}
+            }}
         ]
-        return list(collection.aggregate(pipeline))
-        
-    except Exception as e:
-        print(f"❌ Ошибка в MongoDB запросе: {e}")
-        return []
-
-if mongo_client:
-    print("\n🔍 ВЫПОЛНЕНИЕ ЗАДАНИЯ: Агрегационный запрос для поиска максимальной температуры")
-    
-    # Измеряем время выполнения
-    mongo_result, mongo_time = measure_time(mongodb_max_temperature_query)
-    
-    print(f"⏱️ Время выполнения MongoDB агрегации: {mongo_time:.4f} секунд")
-    print(f"📊 Найдено {len(mongo_result)} уникальных сенсоров")
-    
-    # Показываем топ-5 сенсоров с самой высокой температурой
-    print("\n🔥 Топ-5 сенсоров с максимальной температурой (MongoDB):")
-    for i, sensor in enumerate(mongo_result[:5]):
-        print(f"  {i+1}. {sensor['_id']}: {sensor['max_temperature']}°C (записей: {sensor['total_records']})")
-else:
-    print("❌ Пропуск выполнения запроса MongoDB из-за ошибки настройки")
-    mongo_time = None
-
-
+    }}
+]
+
+def split_mongodb_single_pass(result):
+    """Разбор результата $facet в те же структуры, что дают отдельные агрегации"""
+    by_sensor = result['by_sensor']
+    total = result['total'][0]
+
+    def ranked(field, name=None):
+        # Как в отдельных агрегациях: {"_id": сенсор, поле}, по убыванию значения
+        ordered = sorted(by_sensor, key=lambda doc: doc[field], reverse=True)
+        return [{"_id": doc["_id"], name or field: doc[field]} for doc in ordered]
+
+    def totals(*fields):
+        return {"_id": None, **{field: total[field] for field in fields}}
+
+    return {
+        'temp_data': ranked('avg_temp'),
+        'max_temp_data': ranked('max_temp'),
+        'count_data': ranked('records', 'count'),
+        'std_data': ranked('std_temp'),
+        'temp_stats': totals('avg_temperature', 'min_temperature', 'max_temperature', 'std_temperature', 'count'),
+        'humidity_stats': totals('avg_humidity', 'min_humidity', 'max_humidity'),
+        'pressure_stats': totals('avg_pressure', 'min_pressure', 'max_pressure'),
+        'battery_stats': totals('avg_battery', 'min_battery', 'max_battery'),
+        'time_stats': totals('first_record', 'last_record'),
+        'monthly_data': result.get('by_month', []),
+        'humidity_data': ranked('avg_humidity'),
+        'pressure_data': ranked('avg_pressure'),
+        'sensor_stats': sorted(by_sensor, key=lambda doc: doc['records'], reverse=True),
+        'collection_scans': 1
+    }
 
-# ГРАФИКИ ДЛЯ MONGODB - ИСПРАВЛЕННЫЙ КОД ДЛЯ ВРЕМЕННОГО РАСПРЕДЕЛЕНИЯ
-print("📊 MONGODB: ПОЛНЫЙ АНАЛИЗ ДАННЫХ (ИСПРАВЛЕННЫЙ)")
-print("="*50)
+def fetch_mongodb_analysis_single_pass(collection):
+    """Метрики полного анализа одной агрегацией с $facet"""
+    pipeline = MONGO_SINGLE_PASS_ANALYSIS_PIPELINE
+    if mongo_buckets_ready:
+        # Помесячные итоги берутся из бакетов, ветка by_month не нужна
+        branches = {name: stages for name, stages in pipeline[0]["$facet"].items() if name != "by_month"}
+        pipeline = [{"$facet": branches}]
+    result = next(collection.aggregate(pipeline, allowDiskUse=True))
+    analysis = split_mongodb_single_pass(result)
+    if mongo_buckets_ready:
+        analysis['monthly_data'] = list(collection.database['sensor_buckets'].aggregate(MONGO_BUCKET_MONTHLY_PIPELINE))
+    return analysis
+
+def fetch_mongodb_analysis(collection, mode=None):
+    """Все данные для графиков и статистики полного анализа MongoDB в выбранном режиме"""
+    mode = mode or mongo_analysis_mode
+    if mode == "single_pass":
+        return fetch_mongodb_analysis_single_pass(collection)
+    return fetch_mongodb_analysis_separate(collection)
+
+# Статистика последнего полного анализа MongoDB (режим, число проходов, время выборки)
+mongo_analysis_stats = {}
 
 if mongo_client:
+    # Все агрегации выполняются до построения графиков, чтобы время анализа
+    # не включало отрисовку
+    mongo_analysis, mongo_fetch_time = measure_time(fetch_mongodb_analysis, mongo_client['iot_studies']['sensor_data'])
+    mongo_analysis_stats.update({
+        'mode': mongo_analysis_mode,
+        'collection_scans': mongo_analysis['collection_scans'],
+        'fetch_time': mongo_fetch_time
+    })
+    print(f"⏱️ Агрегации полного анализа ({mongo_analysis_mode}): {mongo_fetch_time:.4f} секунд, "
+          f"проходов по коллекции: {mongo_analysis['collection_scans']}")
+    
+    # Сравнение с другим режимом на тех же данных
+    other_mode = "separate" if mongo_analysis_mode == "single_pass" else "single_pass"
+    other_analysis, other_fetch_time = measure_time(fetch_mongodb_analysis, mongo_client['iot_studies']['sensor_data'], other_mode)
+    mongo_analysis_stats[f'{other_mode}_fetch_time'] = other_fetch_time
+    print(f"   Режим {other_mode}: {other_fetch_time:.4f} секунд, "
+          f"проходов по коллекции: {other_analysis['collection_scans']}")
+    print(f"   Колоночная выборка (pymongoarrow): "
+          f"{'режим separate' if mongo_columnar_fetch else 'недоступна, обычный курсор'}")
+    
     # 1. Распределение температуры по всем сенсорам
+    plot_span = open_span("mongodb.plot", figure="sensor_distributions")
     plt.figure(figsize=(15, 12))
     
     # График 1: Распределение температур всех сенсоров
     plt.subplot(2, 2, 1)
-    temperature_data = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {"_id": "$sensor_id", "avg_temp": {"$avg": "$temperature"}}},
-        {"$sort": {"avg_temp": -1}}
-    ]))
+    temperature_data = mongo_analysis['temp_data']
     
-    sensor_ids = [item['_id'] for item in temperature_data]
-    avg_temps = [item['avg_temp'] for item in temperature_data]
+    sensor_ids = mongo_result_column(temperature_data, '_id')
+    avg_temps = mongo_result_column(temperature_data, 'avg_temp')
     
     plt.bar(range(len(sensor_ids)), avg_temps, color='lightcoral', alpha=0.7)
     plt.title('Средняя температура по всем сенсорам (MongoDB)')
@@ -569,12 +2496,9 @@ if mongo_client:
     
     # График 2: Распределение максимальных температур
     plt.subplot(2, 2, 2)
-    max_temp_data = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {"_id": "$sensor_id", "max_temp": {"$max": "$temperature"}}},
-        {"$sort": {"max_temp": -1}}
-    ]))
+    max_temp_data = mongo_analysis['max_temp_data']
     
-    max_temps = [item['max_temp'] for item in max_temp_data]
+    max_temps = mongo_result_column(max_temp_data, 'max_temp')
     
     plt.bar(range(len(sensor_ids)), max_temps, color='orange', alpha=0.7)
     plt.title('Максимальная температура по всем сенсорам (MongoDB)')
@@ -585,12 +2509,9 @@ if mongo_client:
     
     # График 3: Количество записей по сенсорам
     plt.subplot(2, 2, 3)
-    count_data = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {"_id": "$sensor_id", "count": {"$sum": 1}}},
-        {"$sort": {"count": -1}}
-    ]))
+    count_data = mongo_analysis['count_data']
     
-    counts = [item['count'] for item in count_data]
+    counts = mongo_result_column(count_data, 'count')
     
     plt.bar(range(len(sensor_ids)), counts, color='lightgreen', alpha=0.7)
     plt.title('Количество записей по всем сенсорам (MongoDB)')
@@ -601,12 +2522,9 @@ if mongo_client:
     
     # График 4: Стандартное отклонение температуры
     plt.subplot(2, 2, 4)
-    std_data = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {"_id": "$sensor_id", "std_temp": {"$stdDevPop": "$temperature"}}},
-        {"$sort": {"std_temp": -1}}
-    ]))
+    std_data = mongo_analysis['std_data']
     
-    std_temps = [item['std_temp'] for item in std_data]
+    std_temps = mongo_result_column(std_data, 'std_temp')
     
     plt.bar(range(len(sensor_ids)), std_temps, color='lightblue', alpha=0.7)
     plt.title('Стандартное отклонение температуры по сенсорам (MongoDB)')
@@ -617,21 +2535,13 @@ if mongo_client:
     
     plt.tight_layout()
     plt.show()
+    plot_span.close()
     
     # 2. Детальная статистика по всем параметрам
     print("\n📈 MONGODB: СТАТИСТИКА ПО ВСЕМ ПАРАМЕТРАМ")
     
     # Анализ температуры
-    temp_stats = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {
-            "_id": None,
-            "avg_temperature": {"$avg": "$temperature"},
-            "min_temperature": {"$min": "$temperature"},
-            "max_temperature": {"$max": "$temperature"},
-            "std_temperature": {"$stdDevPop": "$temperature"},
-            "count": {"$sum": 1}
-        }}
-    ]))[0]
+    temp_stats = mongo_analysis['temp_stats']
     
     print(f"🌡️  ТЕМПЕРАТУРА:")
     print(f"   • Средняя: {temp_stats['avg_temperature']:.2f}°C")
@@ -640,14 +2550,7 @@ if mongo_client:
     print(f"   • Стандартное отклонение: {temp_stats['std_temperature']:.2f}°C")
     
     # Анализ влажности
-    humidity_stats = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {
-            "_id": None,
-            "avg_humidity": {"$avg": "$humidity"},
-            "min_humidity": {"$min": "$humidity"},
-            "max_humidity": {"$max": "$humidity"}
-        }}
-    ]))[0]
+    humidity_stats = mongo_analysis['humidity_stats']
     
     print(f"💧 ВЛАЖНОСТЬ:")
     print(f"   • Средняя: {humidity_stats['avg_humidity']:.2f}%")
@@ -655,14 +2558,7 @@ if mongo_client:
     print(f"   • Максимальная: {humidity_stats['max_humidity']:.2f}%")
     
     # Анализ давления
-    pressure_stats = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {
-            "_id": None,
-            "avg_pressure": {"$avg": "$pressure"},
-            "min_pressure": {"$min": "$pressure"},
-            "max_pressure": {"$max": "$pressure"}
-        }}
-    ]))[0]
+    pressure_stats = mongo_analysis['pressure_stats']
     
     print(f"📊 ДАВЛЕНИЕ:")
     print(f"   • Среднее: {pressure_stats['avg_pressure']:.2f} hPa")
@@ -670,14 +2566,7 @@ if mongo_client:
     print(f"   • Максимальное: {pressure_stats['max_pressure']:.2f} hPa")
     
     # Анализ уровня батареи
-    battery_stats = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {
-            "_id": None,
-            "avg_battery": {"$avg": "$battery_level"},
-            "min_battery": {"$min": "$battery_level"},
-            "max_battery": {"$max": "$battery_level"}
-        }}
-    ]))[0]
+    battery_stats = mongo_analysis['battery_stats']
     
     print(f"🔋 БАТАРЕЯ:")
     print(f"   • Средний уровень: {battery_stats['avg_battery']:.2f}%")
@@ -688,13 +2577,7 @@ if mongo_client:
     print(f"\n🕒 ВРЕМЕННЫЕ ХАРАКТЕРИСТИКИ:")
     
     # Получаем первую и последнюю запись
-    time_stats = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {
-            "_id": None,
-            "first_record": {"$min": "$timestamp"},
-            "last_record": {"$max": "$timestamp"}
-        }}
-    ]))[0]
+    time_stats = mongo_analysis['time_stats']
     
     first_record = time_stats['first_record']
     last_record = time_stats['last_record']
@@ -711,32 +2594,15 @@ if mongo_client:
     print(f"\n📅 РАСПРЕДЕЛЕНИЕ ДАННЫХ ПО МЕСЯЦАМ")
     
     # Агрегация по месяцам
-    monthly_data = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {
-            "$project": {
-                "year": {"$year": "$timestamp"},
-                "month": {"$month": "$timestamp"},
-                "temperature": 1
-            }
-        },
-        {
-            "$group": {
-                "_id": {"year": "$year", "month": "$month"},
-                "avg_temp": {"$avg": "$temperature"},
-                "record_count": {"$sum": 1}
-            }
-        },
-        {
-            "$sort": {"_id.year": 1, "_id.month": 1}
-        }
-    ]))
+    monthly_data = mongo_analysis['monthly_data']
     
     # Подготовка данных для графиков
     months = [f"{item['_id']['year']}-{item['_id']['month']:02d}" for item in monthly_data]
-    monthly_temps = [item['avg_temp'] for item in monthly_data]
-    monthly_counts = [item['record_count'] for item in monthly_data]
+    monthly_temps = mongo_result_column(monthly_data, 'avg_temp')
+    monthly_counts = mongo_result_column(monthly_data, 'record_count')
     
     # Графики временного распределения
+    plot_span = open_span("mongodb.plot", figure="time_distribution")
     plt.figure(figsize=(15, 10))
     
     # График 1: Средняя температура по месяцам
@@ -759,16 +2625,10 @@ if mongo_client:
     
     # График 3: Распределение влажности
     plt.subplot(2, 2, 3)
-    humidity_data = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {
-            "_id": "$sensor_id", 
-            "avg_humidity": {"$avg": "$humidity"}
-        }},
-        {"$sort": {"avg_humidity": -1}}
-    ]))
+    humidity_data = mongo_analysis['humidity_data']
     
-    humidity_sensors = [item['_id'] for item in humidity_data]
-    humidity_values = [item['avg_humidity'] for item in humidity_data]
+    humidity_sensors = mongo_result_column(humidity_data, '_id')
+    humidity_values = mongo_result_column(humidity_data, 'avg_humidity')
     
     plt.bar(range(len(humidity_sensors)), humidity_values, color='blue', alpha=0.7)
     plt.title('Средняя влажность по сенсорам (MongoDB)')
@@ -779,16 +2639,10 @@ if mongo_client:
     
     # График 4: Распределение давления
     plt.subplot(2, 2, 4)
-    pressure_data = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {
-            "_id": "$sensor_id", 
-            "avg_pressure": {"$avg": "$pressure"}
-        }},
-        {"$sort": {"avg_pressure": -1}}
-    ]))
+    pressure_data = mongo_analysis['pressure_data']
     
-    pressure_sensors = [item['_id'] for item in pressure_data]
-    pressure_values = [item['avg_pressure'] for item in pressure_data]
+    pressure_sensors = mongo_result_column(pressure_data, '_id')
+    pressure_values = mongo_result_column(pressure_data, 'avg_pressure')
     
     plt.bar(range(len(pressure_sensors)), pressure_values, color='purple', alpha=0.7)
     plt.title('Среднее давление по сенсорам (MongoDB)')
@@ -799,24 +2653,12 @@ if mongo_client:
     
     plt.tight_layout()
     plt.show()
+    plot_span.close()
     
     # 5. СТАТИСТИКА ПО СЕНСОРАМ
     print(f"\n📋 СТАТИСТИКА ПО ВСЕМ СЕНСОРАМ:")
     
-    sensor_stats = list(mongo_client['iot_studies']['sensor_data'].aggregate([
-        {"$group": {
-            "_id": "$sensor_id",
-            "records": {"$sum": 1},
-            "avg_temp": {"$avg": "$temperature"},
-            "max_temp": {"$max": "$temperature"},
-            "min_temp": {"$min": "$temperature"},
-            "std_temp": {"$stdDevPop": "$temperature"},
-            "avg_humidity": {"$avg": "$humidity"},
-            "avg_pressure": {"$avg": "$pressure"},
-            "avg_battery": {"$avg": "$battery_level"}
-        }},
-        {"$sort": {"records": -1}}
-    ]))
+    sensor_stats = mongo_analysis['sensor_stats']
     
     # Создаем DataFrame для удобного отображения
     stats_df = pd.DataFrame(sensor_stats)
@@ -833,6 +2675,103 @@ if mongo_client:
 else:
     print("❌ MongoDB не доступен для построения графиков")
 
+def benchmark_mongodb_pipelines(collection, pipelines, repeats=3):
+    """Время каждой агрегации: лучшее и медиана из repeats запусков"""
+    rows = []
+    for name, pipeline in pipelines.items():
+        with span(f"MongoDB: {name}"):
+            times = [measure_time(run_mongodb_pipeline, collection, pipeline)[1] for _ in range(repeats)]
+        rows.append({'query': name, 'best': min(times), 'median': float(np.median(times))})
+        capture_mongodb_plan(f"MongoDB: {name}", collection, pipeline, rows[-1]['median'])
+    return pd.DataFrame(rows).set_index('query')
+
+# Сравнение обычной и time-series коллекции: загрузка, размер на диске и время
+# агрегаций (каждый вариант загружается заново, по умолчанию выключено)
+run_timeseries_benchmark = False
+
+if mongo_client and run_timeseries_benchmark:
+    print("\n🕰️ СРАВНЕНИЕ: ОБЫЧНАЯ И TIME-SERIES КОЛЛЕКЦИЯ MONGODB")
+    timeseries_pipelines = {
+        "MAX температура": MONGO_MAX_TEMPERATURE_PIPELINE,
+        "По месяцам": MONGO_ANALYSIS_PIPELINES['monthly_data']
+    }
+    timeseries_rows = []
+    # Выбранный вариант загружается последним и остается в базе для остальных разделов
+    for timeseries in (not mongo_timeseries, mongo_timeseries):
+        mongo_timeseries = timeseries
+        # Клиент предыдущего варианта закрывается, иначе его пул соединений остается открытым
+        if mongo_client:
+            mongo_client.close()
+        mongo_client = setup_mongodb()
+        if not mongo_client:
+            break
+        collection = mongo_client['iot_studies']['sensor_data']
+        latency = benchmark_mongodb_pipelines(collection, timeseries_pipelines)['median']
+        storage = mongo_storage_stats(collection)
+        timeseries_rows.append({
+            'layout': ingest_stats['mongodb']['layout'],
+            'load_time': ingest_stats['mongodb']['load_time'] + ingest_stats['mongodb']['index_time'],
+            'storage_mb': storage['storage_size'] / 1024**2,
+            'index_mb': storage['index_size'] / 1024**2,
+            **{f"{name} (с)": value for name, value in latency.items()}
+        })
+
+    if timeseries_rows:
+        timeseries_comparison = pd.DataFrame(timeseries_rows).set_index('layout')
+        print(timeseries_comparison.round(4).to_string())
+        timeseries_comparison.plot(kind='bar', subplots=True, layout=(1, len(timeseries_comparison.columns)),
+                                   figsize=(18, 5), legend=False, sharey=False, rot=0)
+        plt.tight_layout()
+        plt.show()
+
+# Сравнение схем: документ на показание (sensor_data) и бакеты сенсор x интервал
+# (sensor_buckets) - загрузка, размер и время агрегаций (по умолчанию выключено)
+run_bucket_benchmark = False
+
+if mongo_client and run_bucket_benchmark:
+    print(f"\n🪣 СРАВНЕНИЕ: ДОКУМЕНТ НА ПОКАЗАНИЕ И БАКЕТЫ СЕНСОР x {mongo_bucket_width.upper()}")
+    if not mongo_buckets_ready:
+        mongo_buckets_ready = setup_mongodb_buckets(mongo_client)
+    if mongo_buckets_ready:
+        db = mongo_client['iot_studies']
+        layouts = {
+            'documents': (db['sensor_data'], ingest_stats['mongodb'], {
+                "MAX температура": MONGO_MAX_TEMPERATURE_PIPELINE,
+                "По месяцам": MONGO_ANALYSIS_PIPELINES['monthly_data']
+            }),
+            'buckets': (db['sensor_buckets'], ingest_stats['mongodb_buckets'], {
+                "MAX температура": MONGO_BUCKET_MAX_TEMPERATURE_PIPELINE,
+                "По месяцам": MONGO_BUCKET_MONTHLY_PIPELINE
+            })
+        }
+        bucket_rows = []
+        for layout, (collection, ingest, pipelines) in layouts.items():
+            latency = benchmark_mongodb_pipelines(collection, pipelines)['median']
+            storage = mongo_storage_stats(collection)
+            bucket_rows.append({
+                'layout': layout,
+                'documents': storage['documents'],
+                'load_time': ingest['load_time'] + ingest['index_time'],
+                'storage_mb': storage['storage_size'] / 1024**2,
+                **{f"{name} (с)": value for name, value in latency.items()}
+            })
+
+        bucket_comparison = pd.DataFrame(bucket_rows).set_index('layout')
+        print(bucket_comparison.round(4).to_string())
+        # Выигрыш бакетов растет с числом показаний на бакет: при единицах показаний
+        # документов почти столько же, сколько в sensor_data
+        readings_per_bucket = ingest_stats['mongodb_buckets']['readings_per_bucket'] or 0
+        print(f"📏 Плотность: {readings_per_bucket:.1f} показаний на бакет (ширина: {mongo_bucket_width})")
+        if readings_per_bucket < 10:
+            print("⚠️ Бакеты почти пустые - сравнение не показывает выигрыша схемы, увеличьте mongo_bucket_width")
+        bucket_comparison.plot(kind='bar', subplots=True, layout=(1, len(bucket_comparison.columns)),
+                               figsize=(20, 5), legend=False, sharey=False, rot=0)
+        plt.tight_layout()
+        plt.show()
+
+
+
+
 
 
 
@@ -861,6 +2800,426 @@ else:
 
 
 
+print("\n" + "="*60)
+print("⚡ АСИНХРОННЫЙ АНАЛИЗ: НЕЗАВИСИМЫЕ ЗАПРОСЫ ОДНОВРЕМЕННО")
+print("="*60)
+
+import asyncio
+
+# Запросы полного анализа обеих СУБД независимы: асинхронный вариант выполняет их
+# одновременно, не более async_analysis_concurrency запросов сразу
+run_async_analysis = True
+async_analysis_concurrency = 8
+
+# Асинхронные драйверы (asyncpg, pymongo >= 4.9) необязательны: без них раздел пропускается
+if run_async_analysis:
+    try:
+        import asyncpg
+        from pymongo import AsyncMongoClient
+    except ImportError as e:
+        print(f"⚠️ Асинхронный анализ пропущен: {e}")
+        run_async_analysis = False
+
+async def _init_asyncpg_connection(conn):
+    """NUMERIC читается как float, как и в пуле psycopg2"""
+    await conn.set_type_codec('numeric', encoder=str, decoder=float, schema='pg_catalog', format='text')
+
+async def _async_postgres_query(pool, limit, name, sql):
+    """Один запрос полного анализа PostgreSQL в соединении asyncpg"""
+    async with limit:
+        async with pool.acquire() as conn:
+            if name in PG_ANALYSIS_SCALARS:
+                return name, tuple(await conn.fetchrow(sql))
+            # Как и в последовательном варианте - DataFrame по столбцам
+            rows = await conn.fetch(sql)
+            return name, _rows_to_frame(rows, list(rows[0].keys()) if rows else [])
+
+async def _async_mongodb_query(collection, limit, name, pipeline):
+    """Одна агрегация полного анализа MongoDB асинхронным клиентом"""
+    async with limit:
+        cursor = await collection.aggregate(pipeline)
+        result = await cursor.to_list()
+    return name, result[0] if name in MONGO_ANALYSIS_SCALARS else result
+
+async def run_async_analysis_queries(concurrency=None):
+    """Все запросы полного анализа PostgreSQL и MongoDB с общим ограничением параллельности:
+    (результаты, время). Соединения открываются до замера - как и у прогретого пула
+    psycopg2 и mongo_client в последовательном варианте"""
+    concurrency = concurrency or async_analysis_concurrency
+    limit = asyncio.Semaphore(concurrency)
+    pg_pool = await asyncpg.create_pool(
+        database=pg_conn_params['dbname'], user=pg_conn_params['user'], password=pg_conn_params['password'],
+        host=pg_conn_params['host'], port=int(pg_conn_params['port']),
+        min_size=concurrency, max_size=concurrency, init=_init_asyncpg_connection
+    )
+    mongo = AsyncMongoClient('mongodb://localhost:27017/', minPoolSize=concurrency)
+    try:
+        await asyncio.gather(*(mongo.admin.command('ping') for _ in range(concurrency)))
+        collection = mongo['iot_studies']['sensor_data']
+        with span("async_analysis", concurrency=concurrency) as timed:
+            tasks = [_async_postgres_query(pg_pool, limit, name, sql) for name, sql in PG_ANALYSIS_QUERIES.items()]
+            tasks += [_async_mongodb_query(collection, limit, name, pipeline)
+                      for name, pipeline in MONGO_ANALYSIS_PIPELINES.items()]
+            results = await asyncio.gather(*tasks)
+    finally:
+        await pg_pool.close()
+        await mongo.close()
+
+    n_pg = len(PG_ANALYSIS_QUERIES)
+    return {'postgresql': dict(results[:n_pg]), 'mongodb': dict(results[n_pg:])}, timed.seconds
+
+def run_coroutine(coro):
+    """Запуск корутины и в скрипте, и в Jupyter (где цикл событий уже запущен)"""
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        return pool.submit(asyncio.run, coro).result()
+
+def _analysis_frame(value):
+    """Результат запроса анализа (строки, документы, DataFrame или одна строка) в DataFrame,
+    упорядоченный по первому столбцу (ключу группировки)"""
+    if isinstance(value, pd.DataFrame):
+        frame = value
+    elif isinstance(value, (dict, tuple)):
+        frame = pd.DataFrame([value])
+    else:
+        frame = pd.DataFrame(list(value))
+    if frame.empty:
+        return frame
+    order = frame.iloc[:, 0].map(str).to_numpy().argsort(kind='stable')
+    return frame.iloc[order].reset_index(drop=True)
+
+def analysis_values_match(left, right, rtol=1e-6):
+    """Совпадение значений двух результатов одного запроса (числа - с допуском rtol,
+    порядок суммирования при параллельной агрегации может отличаться)"""
+    left, right = _analysis_frame(left), _analysis_frame(right)
+    columns = [column for column in left.columns if column in right.columns]
+    if len(left) != len(right) or not columns:
+        return False
+    for column in columns:
+        a, b = left[column], right[column]
+        if pd.api.types.is_numeric_dtype(a) and pd.api.types.is_numeric_dtype(b):
+            if not np.allclose(a.to_numpy(np.float64), b.to_numpy(np.float64), rtol=rtol, equal_nan=True):
+                return False
+        elif not (a.map(str).to_numpy() == b.map(str).to_numpy()).all():
+            return False
+    return True
+
+def run_sequential_analysis_queries():
+    """Последовательный базовый вариант: те же запросы по одному"""
+    with pg_connection() as conn:
+        postgresql = fetch_postgres_analysis(conn, mode="separate")
+    mongodb = fetch_mongodb_analysis(mongo_client['iot_studies']['sensor_data'], mode="separate")
+    return {'postgresql': postgresql, 'mongodb': mongodb}
+
+# Время получения всех данных для графиков обеих СУБД
+dashboard_latency = {}
+
+if run_async_analysis and postgres_ready and mongo_client:
+    sequential_results, dashboard_latency['sequential'] = measure_time(run_sequential_analysis_queries)
+    async_results, dashboard_latency['async'] = run_coroutine(run_async_analysis_queries())
+
+    n_queries = len(PG_ANALYSIS_QUERIES) + len(MONGO_ANALYSIS_PIPELINES)
+    print(f"📋 Независимых запросов: {n_queries} (ограничение параллельности: {async_analysis_concurrency})")
+    print(f"⏱️ Последовательно: {dashboard_latency['sequential']:.4f} секунд")
+    print(f"⚡ Асинхронно: {dashboard_latency['async']:.4f} секунд "
+          f"(ускорение x{dashboard_latency['sequential'] / dashboard_latency['async']:.2f})")
+
+    # Проверка: асинхронный вариант возвращает те же значения, что и последовательный
+    async_mismatches = [
+        f"{engine}.{name}" for engine, results in async_results.items()
+        for name, value in results.items()
+        if not analysis_values_match(value, sequential_results[engine][name])
+    ]
+    if async_mismatches:
+        print(f"❌ Различаются результаты: {async_mismatches}")
+    else:
+        print(f"✅ Результаты асинхронного и последовательного вариантов совпадают ({n_queries} запросов)")
+
+    plt.figure(figsize=(8, 5))
+    plt.bar(['Последовательно', 'Асинхронно'], [dashboard_latency['sequential'], dashboard_latency['async']],
+            color=['gray', 'teal'], alpha=0.7)
+    plt.title('Время получения данных полного анализа (PostgreSQL + MongoDB)')
+    plt.ylabel('Время (секунды)')
+    plt.grid(True, alpha=0.3)
+    plt.tight_layout()
+    plt.show()
+
+
+
+
+# НАБОР ЗАМЕРОВ: ЗАПРОСЫ ЛАБОРАТОРНОЙ НА ОБЕИХ СУБД
+print("\n⏱️ НАБОР ЗАМЕРОВ ПРОИЗВОДИТЕЛЬНОСТИ: MONGODB VS POSTGRESQL")
+print("="*60)
+
+import resource
+import subprocess
+from datetime import datetime
+
+# Те же запросы лабораторной, что и PG_LAB3_QUERIES, в виде агрегаций MongoDB
+MONGO_LAB3_PIPELINES = {
+    "MAX температура": [{"$group": {"_id": "$sensor_id", "max_temp": {"$max": "$temperature"}}}],
+    "AVG температура": [{"$group": {"_id": "$sensor_id", "avg_temp": {"$avg": "$temperature"}}}],
+    "COUNT записей": [{"$count": "records"}],
+    "DISTINCT сенсоры": [{"$group": {"_id": "$sensor_id"}}, {"$count": "sensors"}],
+    "По месяцам": MONGO_ANALYSIS_PIPELINES['monthly_data'],
+    "Статистика по сенсорам": MONGO_ANALYSIS_PIPELINES['sensor_stats'],
+    "Окно: 1 месяц": [
+        {"$match": {"timestamp": {"$gte": datetime(2024, 6, 1), "$lt": datetime(2024, 7, 1)}}},
+        {"$group": {"_id": "$sensor_id", "avg_temp": {"$avg": "$temperature"}, "max_temp": {"$max": "$temperature"}}}
+    ]
+}
+
+# Параметры замеров: прогревочные запуски не учитываются, затем benchmark_repeats замеров
+run_benchmark_suite = True
+benchmark_warmup_runs = 2
+benchmark_repeats = 10
+
+# Холодный кэш измеряется только при заданной команде сброса кэшей (перезапуск СУБД,
+# echo 3 > /proc/sys/vm/drop_caches): она выполняется перед каждым холодным запуском,
+# и холодных запусков тоже benchmark_repeats. Без команды записывается лишь первый
+# запуск до прогрева (режим first_run) - данные могут быть в кэше после загрузки
+benchmark_cold_cache_command = None
+
+# Результаты в машиночитаемом виде (по ним строятся графики сравнения)
+benchmark_output_path = "lab3_benchmark_results.json"
+benchmark_results = pd.DataFrame()
+
+def latency_summary(times):
+    """Статистика времени запусков: перцентили, среднее и стандартное отклонение"""
+    times = np.asarray(times, dtype=np.float64)
+    return {
+        'runs': len(times),
+        'mean': float(times.mean()),
+        'std': float(times.std(ddof=1)) if len(times) > 1 else 0.0,
+        'min': float(times.min()),
+        'p50': float(np.percentile(times, 50)),
+        'p95': float(np.percentile(times, 95)),
+        'p99': float(np.percentile(times, 99)),
+        'max': float(times.max())
+    }
+
+def drop_database_caches():
+    """Сброс кэшей перед холодным запуском (команда задается benchmark_cold_cache_command)"""
+    # Соединения пула не переживают перезапуск сервера
+    close_pg_pool()
+    subprocess.run(benchmark_cold_cache_command, shell=True, check=True)
+
+def _timed_pg(sql):
+    return measure_pg_time(run_pg_query, sql)[1]
+
+def _timed_mongodb(collection, pipeline):
+    return measure_time(run_mongodb_pipeline, collection, pipeline)[1]
+
+def benchmark_query(timed, *args):
+    """Замеры одного запроса: {'cold' или 'first_run': [...], 'warm': [...]}"""
+    runs = {}
+    if benchmark_cold_cache_command:
+        runs['cold'] = []
+        for _ in range(benchmark_repeats):
+            drop_database_caches()
+            runs['cold'].append(timed(*args))
+    else:
+        runs['first_run'] = [timed(*args)]
+    for _ in range(benchmark_warmup_runs):
+        timed(*args)
+    runs['warm'] = [timed(*args) for _ in range(benchmark_repeats)]
+    return runs
+
+def run_lab3_benchmark_suite(records=None):
+    """Замеры всех запросов лабораторной на обеих СУБД; строка результата на запрос и режим кэша"""
+    records = records or n_records
+    collection = mongo_client['iot_studies']['sensor_data']
+    engines = {
+        'PostgreSQL': {name: (_timed_pg, (sql,)) for name, sql in PG_LAB3_QUERIES.items()},
+        'MongoDB': {name: (_timed_mongodb, (collection, pipeline)) for name, pipeline in MONGO_LAB3_PIPELINES.items()}
+    }
+    rows = []
+    for engine, queries in engines.items():
+        for name, (timed, args) in queries.items():
+            with span(f"{engine}: {name}"):
+                runs = benchmark_query(timed, *args)
+            for cache, times in runs.items():
+                rows.append({'engine': engine, 'query': name, 'cache': cache, 'records': records,
+                             **latency_summary(times), 'times': times})
+            first = f"холодный p50 {np.percentile(runs['cold'], 50):.4f} с" if 'cold' in runs \
+                else f"первый запуск {runs['first_run'][0]:.4f} с"
+            print(f"  {engine:10} {name:25} {first}, "
+                  f"прогретый p50 {np.percentile(runs['warm'], 50):.4f} с")
+            # План - отдельным запуском после замеров, чтобы EXPLAIN не влиял на время
+            p50 = float(np.percentile(runs['warm'], 50))
+            if engine == 'PostgreSQL':
+                capture_pg_plan(f"{engine}: {name}", args[0], p50)
+            else:
+                capture_mongodb_plan(f"{engine}: {name}", *args, p50)
+    return pd.DataFrame(rows)
+
+def save_benchmark_results(results, path=None):
+    """Сохранение результатов, условий замеров и планов выполнения запросов в JSON"""
+    records = results.to_dict('records')
+    # Строка результата ссылается на план по метке "СУБД: запрос"; план - метрики
+    # (прочитано строк, индексы, сброс на диск) и исходный EXPLAIN / explain
+    for row in records:
+        row['plan'] = f"{row['engine']}: {row['query']}"
+    plans = {row['plan']: query_plans[row['plan']] for row in records if row['plan'] in query_plans}
+    payload = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'settings': {
+            'records': n_records, 'warmup_runs': benchmark_warmup_runs, 'repeats': benchmark_repeats,
+            'cold_cache_command': benchmark_cold_cache_command,
+            'pg_load_mode': pg_load_mode, 'pg_use_rollups': pg_use_rollups,
+            'pg_index_profile': pg_index_profile, 'pg_partition_by_month': pg_partition_by_month,
+            'mongo_timeseries': mongo_timeseries
+        },
+        'ingest': ingest_stats,
+        'resources': resource_usage,
+        'results': records,
+        'plans': plans
+    }
+    with open(path or benchmark_output_path, 'w', encoding='utf-8') as f:
+        json.dump(payload, f, ensure_ascii=False, indent=2, default=str)
+
+# Измеренное использование ресурсов обеими СУБД (байты): размеры данных и индексов,
+# память серверов и пиковая память клиента при загрузке и запросах
+resource_usage = {}
+
+def pg_storage_stats():
+    """Размер таблицы sensor_data на диске, ее индексов и всего отношения с TOAST (сумма по секциям)"""
+    (table_size, total_size), = run_pg_query("""
+        SELECT SUM(pg_table_size(relid))::bigint, SUM(pg_total_relation_size(relid))::bigint
+        FROM pg_partition_tree('sensor_data')
+    """)
+    index_sizes = pg_index_sizes()
+    return {
+        'storage_size': table_size,
+        'index_size': sum(index_sizes.values()),
+        'total_size': total_size,
+        'indexes': index_sizes
+    }
+
+def _process_memory(pid):
+    """PSS процесса (разделяемая память делится между процессами), иначе RSS; None - если процесс недоступен"""
+    for path, field in ((f'/proc/{pid}/smaps_rollup', 'Pss:'), (f'/proc/{pid}/status', 'VmRSS:')):
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            continue
+    return None
+
+def _is_postgres_process(pid):
+    """Процесс с этим PID в /proc клиента - процесс PostgreSQL"""
+    try:
+        with open(f'/proc/{pid}/comm') as f:
+            return f.read().startswith(('postgres', 'postmaster'))
+    except OSError:
+        return False
+
+def pg_server_memory():
+    """Память серверных процессов PostgreSQL; None, если сервер не на этой машине.
+    PID из pg_stat_activity - в пространстве имен сервера: для Docker или удаленного
+    сервера они совпадают с чужими процессами клиента, поэтому /proc читается только
+    при подключении через Unix-сокет или loopback и если все PID - процессы postgres"""
+    rows = run_pg_query("""
+        SELECT inet_server_addr() IS NULL OR inet_server_addr() <<= '127.0.0.0/8'::inet
+               OR inet_server_addr() = '::1'::inet,
+               array_agg(pid)
+        FROM pg_stat_activity
+    """)
+    local, pids = rows[0]
+    if not local or not pids or not all(map(_is_postgres_process, pids)):
+        return None
+    sizes = [size for size in map(_process_memory, pids) if size is not None]
+    return sum(sizes) if sizes else None
+
+def mongo_db_stats(db):
+    """Размер базы MongoDB по dbStats: данные, место на диске и индексы"""
+    stats = db.command("dbStats")
+    return {
+        'data_size': stats.get('dataSize', 0),
+        'storage_size': stats.get('storageSize', 0),
+        'index_size': stats.get('indexSize', 0)
+    }
+
+def mongo_server_memory(client):
+    """Резидентная память процесса mongod по serverStatus"""
+    return client.admin.command("serverStatus")['mem']['resident'] * 1024**2
+
+def _client_memory(key, span_prefix):
+    """Память клиента по интервалам трассы: {key_peak: пик tracemalloc, key_rss: пиковый RSS}"""
+    peak, rss = span_peak_memory(span_prefix)
+    return {f'{key}_peak': peak, f'{key}_rss': rss}
+
+def collect_resource_usage():
+    """Размеры хранения и память обеих СУБД; память клиента - по интервалам трассы
+    (пик tracemalloc, если он включен, и пиковый RSS за время загрузки и запросов)"""
+    pg_storage = pg_storage_stats()
+    mongo_db = mongo_client['iot_studies']
+    mongo_collection = mongo_storage_stats(mongo_db['sensor_data'])
+    usage = {
+        'PostgreSQL': {
+            **pg_storage,
+            'server_memory': pg_server_memory(),
+            **_client_memory("client_load", "postgresql.load"),
+            **_client_memory("client_query", "PostgreSQL:")
+        },
+        'MongoDB': {
+            # size в collStats - несжатый объем BSON; на диске (storageSize) - после сжатия WiredTiger
+            'bson_size': mongo_collection['data_size'],
+            'storage_size': mongo_collection['storage_size'],
+            'index_size': mongo_collection['index_size'],
+            'database': mongo_db_stats(mongo_db),
+            'server_memory': mongo_server_memory(mongo_client),
+            **_client_memory("client_load", "mongodb.load"),
+            **_client_memory("client_query", "MongoDB:")
+        }
+    }
+    # Максимальный RSS клиента за весь запуск (Linux - в килобайтах)
+    usage['client_max_rss'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return usage
+
+# Показатели ресурсов для графика сравнения: подпись -> ключ в resource_usage
+# (размеры - на диске у обеих СУБД; память клиента - пиковый RSS, он измеряется всегда)
+RESOURCE_CHART_FIELDS = {
+    'Данные на диске (MB)': 'storage_size',
+    'Индексы на диске (MB)': 'index_size',
+    'Память сервера (MB)': 'server_memory',
+    'Пиковый RSS клиента: загрузка (MB)': 'client_load_rss',
+    'Пиковый RSS клиента: запросы (MB)': 'client_query_rss'
+}
+
+def resource_chart_values(engine):
+    """Значения ресурсов СУБД в мегабайтах (NaN - если показатель не удалось измерить)"""
+    values = resource_usage.get(engine, {})
+    return [values[key] / 1024**2 if values.get(key) is not None else np.nan
+            for key in RESOURCE_CHART_FIELDS.values()]
+
+def print_resource_usage():
+    """Таблица измеренных ресурсов обеих СУБД в мегабайтах"""
+    table = pd.DataFrame({engine: resource_chart_values(engine) for engine in ('PostgreSQL', 'MongoDB')},
+                         index=list(RESOURCE_CHART_FIELDS))
+    print(table.round(1).to_string())
+    print(f"Максимальный RSS клиента: {resource_usage['client_max_rss'] / 1024**2:.1f} MB")
+    print(f"MongoDB: несжатый объем BSON {resource_usage['MongoDB']['bson_size'] / 1024**2:.1f} MB")
+    for engine in ('PostgreSQL', 'MongoDB'):
+        peaks = [resource_usage[engine][f'{key}_peak'] for key in ('client_load', 'client_query')]
+        if any(peak is not None for peak in peaks):
+            print(f"{engine}: пик памяти Python (tracemalloc) при загрузке / запросах: "
+                  + " / ".join(f"{peak / 1024**2:.1f} MB" if peak is not None else "-" for peak in peaks))
+
+if run_benchmark_suite and postgres_ready and mongo_client:
+    print(f"🔁 Прогрев: {benchmark_warmup_runs}, замеров: {benchmark_repeats}, "
+          f"сброс кэшей: {benchmark_cold_cache_command or 'нет (вместо холодного - первый запуск, first_run)'}")
+    benchmark_results = run_lab3_benchmark_suite()
+    resource_usage = collect_resource_usage()
+    save_benchmark_results(benchmark_results)
+
+    summary_columns = ['p50', 'p95', 'p99', 'std']
+    print("\n📊 ПРОГРЕТЫЙ КЭШ (секунды):")
+    warm_results = benchmark_results[benchmark_results['cache'] == 'warm']
+    print(warm_results.pivot(index='query', columns='engine', values='p50').round(4).to_string())
+    print(warm_results.set_index(['engine', 'query'])[summary_columns].round(4).to_string())
+    print(f"💾 Результаты сохранены в {benchmark_output_path}")
 
 
 
@@ -869,12 +3228,27 @@ print("📈 АНАЛИЗ: СРАВНЕНИЕ ПРОИЗВОДИТЕЛЬНОСТ
 print("="*60)
 
 if mongo_time is not None and pg_time is not None:
+    # Подписи отражают фактический источник: сводки и бакеты не сравнимы с полным проходом
+    pg_query_type = PG_MAX_TEMPERATURE_LABELS[pg_max_temperature_effective_source()]
+    mongo_query_type = 'Aggregation Pipeline (бакеты)' if mongo_buckets_ready else 'Aggregation Pipeline'
+    
+    # Вывод о более быстрой СУБД - только по прогретым p50 и p95 набора замеров (одинаковый
+    # запрос по sensor_data на обеих СУБД); mongo_time и pg_time - одиночный первый запуск
+    # и показываются лишь для справки
+    verdict_query = "MAX температура"
+    verdict = None
+    if not benchmark_results.empty:
+        verdict_rows = benchmark_results[(benchmark_results['cache'] == 'warm')
+                                         & (benchmark_results['query'] == verdict_query)].set_index('engine')
+        if {'MongoDB', 'PostgreSQL'} <= set(verdict_rows.index):
+            verdict = verdict_rows.loc[['MongoDB', 'PostgreSQL'], ['p50', 'p95']]
+    
     # Создаем DataFrame для сравнения
     comparison_data = {
         'Database': ['MongoDB', 'PostgreSQL'],
         'Query_Time_Seconds': [mongo_time, pg_time],
         'Records_Processed': [n_records, n_records],
-        'Query_Type': ['Aggregation Pipeline', 'SQL GROUP BY'],
+        'Query_Type': [mongo_query_type, pg_query_type],
         'Speed_Ratio': [mongo_time/pg_time, pg_time/mongo_time]
     }
     
@@ -891,7 +3265,7 @@ if mongo_time is not None and pg_time is not None:
     bars = plt.bar(comparison_df['Database'], comparison_df['Query_Time_Seconds'], 
                    color=['#4CAF50', '#2196F3'], alpha=0.7, edgecolor='black')
     
-    plt.title('Время выполнения запросов', fontsize=14, fontweight='bold')
+    plt.title('Время выполнения запросов (первый запуск)', fontsize=14, fontweight='bold')
     plt.ylabel('Время (секунды)', fontsize=12)
     plt.xlabel('База данных', fontsize=12)
     
@@ -925,23 +3299,31 @@ if mongo_time is not None and pg_time is not None:
     plt.subplot(2, 2, 4)
     plt.axis('off')
     
-    faster_db = 'MongoDB' if mongo_time < pg_time else 'PostgreSQL'
-    time_diff = abs(mongo_time - pg_time)
-    faster_percent = (time_diff / min(mongo_time, pg_time)) * 100
+    if verdict is not None:
+        faster_db = verdict['p50'].idxmin()
+        time_diff = abs(verdict.loc['MongoDB', 'p50'] - verdict.loc['PostgreSQL', 'p50'])
+        faster_percent = (time_diff / verdict['p50'].min()) * 100
+        verdict_text = f"""⚡ ПРОГРЕТЫЙ КЭШ, {verdict_query} (p50 / p95):
+• MongoDB: {verdict.loc['MongoDB', 'p50']:.4f} / {verdict.loc['MongoDB', 'p95']:.4f} с
+• PostgreSQL: {verdict.loc['PostgreSQL', 'p50']:.4f} / {verdict.loc['PostgreSQL', 'p95']:.4f} с
+
+🏆 ПОБЕДИТЕЛЬ: {faster_db}
+• Быстрее по p50 на {faster_percent:.1f}% ({benchmark_repeats} замеров)"""
+    else:
+        verdict_text = """🏆 ПОБЕДИТЕЛЬ: не определен
+• Один запуск не позволяет сравнивать СУБД -
+  включите набор замеров (run_benchmark_suite)"""
     
     analysis_text = f"""
 📈 РЕЗУЛЬТАТЫ АНАЛИЗА:
 
-⚡ ПРОИЗВОДИТЕЛЬНОСТЬ:
+⏱️ ПЕРВЫЙ ЗАПУСК (для справки):
 • MongoDB: {mongo_time:.4f} секунд
 • PostgreSQL: {pg_time:.4f} секунд
-• Разница: {time_diff:.4f} секунд
 
-🏆 ПОБЕДИТЕЛЬ: {faster_db}
-• Быстрее на {faster_percent:.1f}%
+{verdict_text}
 
 🔧 ВЫВОДЫ:
-• {faster_db} показала лучшую производительность
 • Обе СУБД эффективно обработали {n_records:,} записей
 • Выбор зависит от конкретных требований проекта
 """
@@ -953,16 +3335,36 @@ if mongo_time is not None and pg_time is not None:
     
     # Детальный анализ
     print("\n🔍 ДЕТАЛЬНЫЙ АНАЛИЗ РЕЗУЛЬТАТОВ:")
-    print(f"   MongoDB Aggregation Pipeline: {mongo_time:.4f} секунд")
-    print(f"   PostgreSQL GROUP BY:          {pg_time:.4f} секунд")
-    print(f"   Соотношение (MongoDB/PostgreSQL): {mongo_time/pg_time:.2f}x")
-    
-    if mongo_time < pg_time:
-        print("   • MongoDB показала лучшую производительность для агрегационных операций")
+    print(f"   MongoDB {mongo_query_type}: {mongo_time:.4f} секунд")
+    print(f"   PostgreSQL {pg_query_type}: {pg_time:.4f} секунд")
+    print(f"   Соотношение (MongoDB/PostgreSQL): {mongo_time/pg_time:.2f}x (первый запуск)")
+    
+    if verdict is None:
+        print("   • Вывод о более быстрой СУБД не делается: нет прогретых замеров (run_benchmark_suite)")
+    elif faster_db == 'MongoDB':
+        print(f"   • {verdict_query}: MongoDB быстрее по прогретому p50 "
+              f"({verdict.loc['MongoDB', 'p50']:.4f} с против {verdict.loc['PostgreSQL', 'p50']:.4f} с)")
         print("   • Aggregation Pipeline оптимизирован для обработки документов")
     else:
-        print("   • PostgreSQL показала лучшую производительность для аналитических запросов") 
-        print("   • SQL GROUP BY оптимизирован для реляционных операций")
+        print(f"   • {verdict_query}: PostgreSQL быстрее по прогретому p50 "
+              f"({verdict.loc['PostgreSQL', 'p50']:.4f} с против {verdict.loc['MongoDB', 'p50']:.4f} с)")
+        print("   • Замеры набора - полный проход по sensor_data на обеих СУБД (GROUP BY / $group)")
+    
+    # Загрузка: записей в секунду при сопоставимых условиях (пачки, несколько соединений,
+    # индексы строятся после загрузки)
+    if 'postgresql' in ingest_stats and 'mongodb' in ingest_stats:
+        ingest_columns = ['mode', 'connections', 'rollups', 'records', 'load_time', 'index_time', 'rows_per_sec']
+        ingest_df = pd.DataFrame(ingest_stats).T.reindex(columns=ingest_columns)
+        print("\n📥 СРАВНЕНИЕ ЗАГРУЗКИ ДАННЫХ:")
+        print(ingest_df.to_string())
+        if ingest_stats['postgresql'].get('rollups'):
+            print("⚠️ Загрузка PostgreSQL включает обновление сводных таблиц триггером - "
+                  "скорость не сравнима с MongoDB напрямую")
+    
+    # Планы выполнения замеренных запросов: чем объясняется разница во времени
+    if query_plans:
+        print("\n🧭 ПЛАНЫ ВЫПОЛНЕНИЯ ЗАМЕРЕННЫХ ЗАПРОСОВ:")
+        print(query_plan_table().to_string())
     
 else:
     print("❌ Невозможно выполнить сравнение: отсутствуют данные о времени выполнения")
@@ -972,25 +3374,431 @@ print("\n" + "="*60)
 print("📊 ДОПОЛНИТЕЛЬНАЯ СТАТИСТИКА ДАННЫХ")
 print("="*60)
 
-# Анализ распределения данных по сенсорам
-device_stats = iot_df.groupby('sensor_id').agg({
-    'temperature': ['count', 'min', 'max', 'mean'],
-    'humidity': 'mean',
-    'battery_level': 'mean'
-}).round(2)
+def compute_device_stats(chunks):
+    """Статистика по сенсорам по чанкам: частичные агрегаты каждого чанка объединяются"""
+    partials = []
+    for chunk in chunks:
+        # float32 колонки компактной схемы агрегируются во float64: иначе min/max и суммы
+        # остаются float32 и после округления печатаются как 51.200001
+        chunk = chunk.astype({column: np.float64 for column in ('temperature', 'humidity')
+                              if chunk[column].dtype == np.float32})
+        partial = chunk.groupby('sensor_id', observed=True).agg(
+            records=('temperature', 'count'),
+            min_temp=('temperature', 'min'),
+            max_temp=('temperature', 'max'),
+            sum_temp=('temperature', 'sum'),
+            sum_humidity=('humidity', 'sum'),
+            sum_battery=('battery_level', 'sum'),
+            first_timestamp=('timestamp', 'min'),
+            last_timestamp=('timestamp', 'max')
+        )
+        partials.append(partial)
+    
+    if partials:
+        combined = pd.concat(partials).groupby(level=0).agg({
+            'records': 'sum', 'min_temp': 'min', 'max_temp': 'max',
+            'sum_temp': 'sum', 'sum_humidity': 'sum', 'sum_battery': 'sum',
+            'first_timestamp': 'min', 'last_timestamp': 'max'
+        })
+    else:
+        # Нет ни одного чанка (n_records=0 или пустая выборка из СУБД): пустые агрегаты
+        combined = pd.DataFrame({
+            'records': pd.Series(dtype=np.int64), 'min_temp': pd.Series(dtype=np.float64),
+            'max_temp': pd.Series(dtype=np.float64), 'sum_temp': pd.Series(dtype=np.float64),
+            'sum_humidity': pd.Series(dtype=np.float64), 'sum_battery': pd.Series(dtype=np.float64),
+            'first_timestamp': pd.Series(dtype='datetime64[s]'), 'last_timestamp': pd.Series(dtype='datetime64[s]')
+        }, index=pd.Index([], name='sensor_id'))
+    
+    stats = pd.DataFrame({
+        'records': combined['records'],
+        'min_temp': combined['min_temp'],
+        'max_temp': combined['max_temp'],
+        'avg_temp': combined['sum_temp'] / combined['records'],
+        'avg_humidity': combined['sum_humidity'] / combined['records'],
+        'avg_battery': combined['sum_battery'] / combined['records']
+    }).round(2)
+    
+    total_records = int(combined['records'].sum())
+    summary = {
+        'records': total_records,
+        'unique_sensors': len(combined),
+        'min_temp': combined['min_temp'].min(),
+        'max_temp': combined['max_temp'].max(),
+        'avg_temp': combined['sum_temp'].sum() / total_records if total_records else np.nan,
+        'first_timestamp': combined['first_timestamp'].min(),
+        'last_timestamp': combined['last_timestamp'].max()
+    }
+    return stats, summary
 
-device_stats.columns = ['records', 'min_temp', 'max_temp', 'avg_temp', 'avg_humidity', 'avg_battery']
+# Анализ распределения данных по сенсорам
+(device_stats, data_summary), device_stats_time = measure_time(compute_device_stats, iot_chunk_source())
+print(f"⏱️ Время расчета статистики по сенсорам: {device_stats_time:.4f} секунд "
+      f"(схема: {'компактная' if compact_schema else 'исходная'})")
 device_stats = device_stats.sort_values('records', ascending=False)
 
 print("📈 Статистика по сенсорам (топ-5 по количеству записей):")
 print(device_stats.head())
 
 print(f"\n📋 ОБЩАЯ СТАТИСТИКА ДАННЫХ:")
-print(f"• Всего записей: {len(iot_df):,}")
-print(f"• Уникальных сенсоров: {iot_df['sensor_id'].nunique()}")
-print(f"• Диапазон температур: {iot_df['temperature'].min():.1f}°C - {iot_df['temperature'].max():.1f}°C")
-print(f"• Средняя температура: {iot_df['temperature'].mean():.1f}°C")
-print(f"• Период данных: {iot_df['timestamp'].min()} - {iot_df['timestamp'].max()}")
+print(f"• Всего записей: {data_summary['records']:,}")
+print(f"• Уникальных сенсоров: {data_summary['unique_sensors']}")
+print(f"• Диапазон температур: {data_summary['min_temp']:.1f}°C - {data_summary['max_temp']:.1f}°C")
+print(f"• Средняя температура: {data_summary['avg_temp']:.1f}°C")
+print(f"• Период данных: {data_summary['first_timestamp']} - {data_summary['last_timestamp']}")
+
+# Та же статистика по данным, прочитанным обратно из СУБД потоково (серверный курсор
+# PostgreSQL, помесячная колоночная выборка MongoDB): проверка загрузки и скорость
+# чтения сырых показаний. Вся таблица читается из обеих СУБД, поэтому по умолчанию выключено
+verify_device_stats_readback = False
+READBACK_COLUMNS = ['records', 'min_temp', 'max_temp', 'avg_temp']
+
+if verify_device_stats_readback:
+    readback_sources = {}
+    if postgres_ready:
+        readback_sources['PostgreSQL'] = iter_pg_sensor_chunks
+    if mongo_client:
+        readback_sources['MongoDB'] = lambda: iter_mongodb_sensor_chunks(mongo_client['iot_studies']['sensor_data'])
+    for engine, readback_chunks in readback_sources.items():
+        with span(f"{engine}: чтение показаний") as readback_span:
+            engine_stats, engine_summary = compute_device_stats(readback_chunks())
+            readback_span.rows = engine_summary['records']
+        expected = device_stats[READBACK_COLUMNS]
+        expected = expected.set_axis(expected.index.astype(str)).sort_index()
+        actual = engine_stats[READBACK_COLUMNS].reindex(expected.index)
+        matches = np.allclose(actual.to_numpy(np.float64), expected.to_numpy(np.float64), atol=0.01, equal_nan=False)
+        print(f"{'✅' if matches else '❌'} {engine}: статистика по прочитанным данным "
+              f"{'совпадает' if matches else 'расходится'} со сгенерированными, "
+              f"{engine_summary['records']:,} записей за {readback_span.seconds:.4f} секунд "
+              f"({engine_summary['records'] / readback_span.seconds:,.0f} записей/сек)")
+
+
+
+
+# Масштабирование: данные генерируются и загружаются заново для каждого размера,
+# на каждом размере выполняются загрузка и весь набор замеров (по умолчанию выключено)
+run_scaling_sweep = False
+SCALING_SIZES = [10**4, 10**5, 10**6, 10**7, 10**8]
+scaling_repeats = 3
+scaling_output_path = "lab3_scaling_results.json"
+
+def fit_scaling_exponent(records, values):
+    """Показатель степени k в values ~ records^k (наклон прямой в логарифмических осях)"""
+    records, values = np.asarray(records, dtype=np.float64), np.asarray(values, dtype=np.float64)
+    mask = (records > 0) & (values > 0)
+    if mask.sum() < 2:
+        return np.nan
+    return float(np.polyfit(np.log10(records[mask]), np.log10(values[mask]), 1)[0])
+
+if run_scaling_sweep and postgres_ready and mongo_client:
+    print("\n📐 МАСШТАБИРОВАНИЕ: ОТ 10^4 ДО 10^8 ЗАПИСЕЙ")
+    saved_repeats, benchmark_repeats = benchmark_repeats, scaling_repeats
+    scaling_ingest, scaling_queries = [], []
+    for size in SCALING_SIZES:
+        print(f"\n🔄 {size:,} записей")
+        size_chunks = lambda: iter_iot_chunks(size, chunk_size=chunk_size, n_devices=n_devices, seed=data_seed,
+                                              n_workers=n_workers, compact=compact_schema)
+        if not setup_postgresql(size_chunks()):
+            break
+        # Клиент предыдущего размера закрывается, иначе его пул соединений остается открытым
+        if mongo_client:
+            mongo_client.close()
+        mongo_client = setup_mongodb(size_chunks())
+        if not mongo_client:
+            break
+        for engine, key in [('PostgreSQL', 'postgresql'), ('MongoDB', 'mongodb')]:
+            ingest = ingest_stats[key]
+            scaling_ingest.append({'engine': engine, 'records': size, 'load_time': ingest['load_time'],
+                                   'index_time': ingest['index_time'], 'rows_per_sec': ingest['rows_per_sec']})
+        scaling_queries.append(run_lab3_benchmark_suite(size))
+    benchmark_repeats = saved_repeats
+
+    if scaling_queries:
+        scaling_ingest_df = pd.DataFrame(scaling_ingest)
+        scaling_df = pd.concat(scaling_queries, ignore_index=True)
+        scaling_warm = scaling_df[scaling_df['cache'] == 'warm'].copy()
+        scaling_warm['rows_per_sec'] = scaling_warm['records'] / scaling_warm['p50']
+
+        # Показатели степени: ~1 - линейный рост, <1 - сублинейный (индексы, сводки), >1 - деградация
+        exponents = scaling_warm.groupby(['engine', 'query']).apply(
+            lambda group: fit_scaling_exponent(group['records'], group['p50'])
+        ).unstack('engine')
+        ingest_exponents = scaling_ingest_df.groupby('engine').apply(
+            lambda group: fit_scaling_exponent(group['records'], group['load_time'] + group['index_time'])
+        )
+        print("\n📈 Показатели степени времени запросов (p50 ~ записей^k):")
+        print(exponents.round(2).to_string())
+        print("\n📥 Показатели степени времени загрузки:")
+        print(ingest_exponents.round(2).to_string())
+
+        with open(scaling_output_path, 'w', encoding='utf-8') as f:
+            json.dump({
+                'sizes': SCALING_SIZES, 'repeats': scaling_repeats,
+                'ingest': scaling_ingest_df.to_dict('records'),
+                'queries': scaling_df.to_dict('records'),
+                'exponents': {engine: exponents[engine].to_dict() for engine in exponents.columns},
+                'ingest_exponents': ingest_exponents.to_dict()
+            }, f, ensure_ascii=False, indent=2, default=str)
+        print(f"💾 Результаты сохранены в {scaling_output_path}")
+
+        fig, axes = plt.subplots(1, 3, figsize=(20, 6))
+        for (engine, query), group in scaling_warm.groupby(['engine', 'query']):
+            style = 's-' if engine == 'PostgreSQL' else 'o--'
+            axes[0].plot(group['records'], group['p50'], style, label=f"{engine}: {query}")
+            axes[1].plot(group['records'], group['rows_per_sec'], style, label=f"{engine}: {query}")
+        for engine, group in scaling_ingest_df.groupby('engine'):
+            axes[2].plot(group['records'], group['rows_per_sec'], 'o-', label=engine)
+        titles = ['Время запросов p50 (секунды)', 'Пропускная способность запросов (записей/сек)',
+                  'Скорость загрузки (записей/сек)']
+        for ax, title in zip(axes, titles):
+            ax.set_xscale('log')
+            ax.set_yscale('log')
+            ax.set_xlabel('Записей')
+            ax.set_title(title)
+            ax.grid(True, alpha=0.3)
+        axes[0].legend(fontsize=6, ncol=2)
+        axes[2].legend()
+        plt.tight_layout()
+        plt.show()
+
+    # Возврат исходных данных для остальных разделов
+    postgres_ready = setup_postgresql()
+    if mongo_client:
+        mongo_client.close()
+    mongo_client = setup_mongodb()
+    if mongo_client and mongo_buckets_ready:
+        mongo_buckets_ready = setup_mongodb_buckets(mongo_client)
+
+
+
+# Нагрузочный тест: K параллельных клиентов (потоков) выполняют смесь запросов лабораторной
+# и вставок пачками; K увеличивается по уровням, на каждом уровне - пропускная способность
+# (операций/сек) и перцентили задержки. Потоки подходят, так как драйверы освобождают GIL
+# на время сетевого ввода-вывода. Вставленные записи удаляются после теста (по умолчанию выключено)
+import itertools
+
+run_load_test = False
+LOAD_TEST_WORKERS = [1, 2, 4, 8, 16, 32]
+load_test_duration = 30
+load_test_seed = 0
+load_test_ingest_batch = 1000
+load_test_output_path = "lab3_load_test_results.json"
+
+# Смесь операций: название запроса из PG_LAB3_QUERIES / MONGO_LAB3_PIPELINES или вставка -> доля
+LOAD_TEST_INGEST = "Вставка пачки"
+LOAD_TEST_MIX = {
+    "MAX температура": 0.2,
+    "AVG температура": 0.15,
+    "COUNT записей": 0.1,
+    "DISTINCT сенсоры": 0.1,
+    "По месяцам": 0.1,
+    "Статистика по сенсорам": 0.1,
+    "Окно: 1 месяц": 0.15,
+    LOAD_TEST_INGEST: 0.1
+}
+
+# Уровень считается насыщением, если следующий уровень дает прирост пропускной способности меньше 10%
+load_test_saturation_gain = 1.1
+
+# Состояние генератора пачек для вставки: таблица сенсоров (2^20 элементов) и список
+# устройств строятся один раз до теста, иначе генерация на потоках клиентов становится
+# узким местом и дает ложную точку насыщения
+_load_test_generator = {}
+_load_test_batches_lock = threading.Lock()
+
+def prepare_load_test_batches():
+    """Подготовка генератора пачек: record_id продолжают набор данных с n_records"""
+    root_seq = iot_seed_sequence(data_seed)
+    device_ids = get_device_ids(n_devices)
+    _load_test_generator.update({
+        'starts': itertools.count(n_records, load_test_ingest_batch),
+        'root_seq': root_seq,
+        'device_ids': device_ids,
+        'sensor_table': iot_sensor_table(root_seq, len(device_ids))
+    })
+
+def _next_ingest_batch():
+    """Следующая пачка новых записей набора данных"""
+    with _load_test_batches_lock:
+        start = next(_load_test_generator['starts'])
+    columns = generate_iot_range(_load_test_generator['root_seq'], _load_test_generator['sensor_table'],
+                                  start, start + load_test_ingest_batch)
+    return _iot_frame(columns, _load_test_generator['device_ids'])
+
+def _pg_ingest_batch(batch):
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            load_chunk_to_postgres(cur, batch, pg_load_mode)
+        conn.commit()
+
+def load_test_operations(engine):
+    """Операции смеси для СУБД: название -> функция (аргумент - пачка для вставки или None)"""
+    if engine == 'PostgreSQL':
+        operations = {name: (lambda batch, sql=sql: run_pg_query(sql)) for name, sql in PG_LAB3_QUERIES.items()}
+        operations[LOAD_TEST_INGEST] = _pg_ingest_batch
+    else:
+        collection = mongo_client['iot_studies']['sensor_data'].with_options(
+            write_concern=WriteConcern(**mongo_write_concern))
+        operations = {name: (lambda batch, pipeline=pipeline: run_mongodb_pipeline(collection, pipeline))
+                      for name, pipeline in MONGO_LAB3_PIPELINES.items()}
+        operations[LOAD_TEST_INGEST] = lambda batch: _insert_mongo_batch(collection, mongo_documents_from_chunk(batch))
+    return {name: operations[name] for name in LOAD_TEST_MIX}
+
+def _load_test_worker(operations, worker, deadline):
+    """Клиент нагрузочного теста: случайные операции смеси до deadline; [(операция, задержка, ошибка)]"""
+    rng = np.random.default_rng([load_test_seed, worker])
+    names = list(operations)
+    weights = np.array([LOAD_TEST_MIX[name] for name in names], dtype=np.float64)
+    weights /= weights.sum()
+    samples = []
+    while time.perf_counter() < deadline:
+        name = names[rng.choice(len(names), p=weights)]
+        # Пачка для вставки готовится до замера: задержка включает только работу СУБД
+        batch = _next_ingest_batch() if name == LOAD_TEST_INGEST else None
+        start = time.perf_counter()
+        try:
+            operations[name](batch)
+            error = None
+        except Exception as e:
+            error = repr(e)
+        samples.append((name, time.perf_counter() - start, error))
+    return samples
+
+def run_load_test_level(engine, n_workers, duration=None):
+    """Один уровень нагрузки: n_workers клиентов в течение duration секунд"""
+    duration = duration or load_test_duration
+    operations = load_test_operations(engine)
+    with span(f"load_test: {engine}", workers=n_workers) as level_span:
+        deadline = time.perf_counter() + duration
+        with ThreadPoolExecutor(max_workers=n_workers) as executor:
+            futures = [executor.submit(_load_test_worker, operations, worker, deadline) for worker in range(n_workers)]
+            samples = [sample for future in futures for sample in future.result()]
+        level_span.rows = len(samples)
+    elapsed = level_span.seconds
+    samples = pd.DataFrame(samples, columns=['operation', 'latency', 'error'])
+    ok = samples[samples['error'].isna()]
+    rows = [{'engine': engine, 'workers': n_workers, 'operation': 'Все операции', 'ops': len(ok),
+             'errors': int(samples['error'].notna().sum()), 'qps': len(ok) / elapsed,
+             **(latency_summary(ok['latency']) if len(ok) else {})}]
+    for name, group in ok.groupby('operation'):
+        rows.append({'engine': engine, 'workers': n_workers, 'operation': name, 'ops': len(group),
+                     'errors': int((samples['operation'] == name).sum() - len(group)), 'qps': len(group) / elapsed,
+                     **latency_summary(group['latency'])})
+    return rows
+
+def saturation_point(levels):
+    """Число клиентов, после которого пропускная способность почти не растет"""
+    levels = levels.sort_values('workers')
+    qps, workers = levels['qps'].to_numpy(), levels['workers'].to_numpy()
+    for i in range(len(levels) - 1):
+        if qps[i + 1] < qps[i] * load_test_saturation_gain:
+            return int(workers[i])
+    return None
+
+def _cleanup_pg_load_test_records():
+    with pg_connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DELETE FROM sensor_data WHERE record_id >= %s", (n_records,))
+        conn.commit()
+    if pg_use_rollups:
+        set_rollup_trigger(True)
+        rebuild_sensor_rollups()
+    vacuum_sensor_data()
+
+def _cleanup_mongodb_load_test_records():
+    """Удаление вставленных документов; False - если коллекцию нужно загрузить заново"""
+    # В time-series коллекции до MongoDB 7.0 удаление возможно только по metaField
+    if mongo_timeseries and mongo_client.server_info()['versionArray'] < [7]:
+        print("⚠️ MongoDB < 7.0: из time-series коллекции нельзя удалить документы по record_id")
+        return False
+    mongo_client['iot_studies']['sensor_data'].delete_many({"record_id": {"$gte": n_records}})
+    return True
+
+def cleanup_load_test_records():
+    """Удаление вставленных тестом записей и пересчет сводок - данные возвращаются к исходным.
+    Ошибки очистки выводятся, а не выбрасываются, чтобы не скрыть результаты или ошибку теста.
+    Возвращает False, если коллекцию MongoDB нужно загрузить заново"""
+    try:
+        _cleanup_pg_load_test_records()
+    except Exception as e:
+        print(f"❌ Не удалось удалить записи нагрузочного теста из PostgreSQL: {e}")
+    try:
+        return _cleanup_mongodb_load_test_records()
+    except Exception as e:
+        print(f"❌ Не удалось удалить документы нагрузочного теста из MongoDB: {e}")
+        return False
+
+if run_load_test and postgres_ready and mongo_client:
+    print("\n🚦 НАГРУЗОЧНЫЙ ТЕСТ: ПАРАЛЛЕЛЬНЫЕ КЛИЕНТЫ")
+    print(f"Уровни: {LOAD_TEST_WORKERS} клиентов, по {load_test_duration} с, смесь: {LOAD_TEST_MIX}")
+    # Пул должен вмещать всех клиентов, иначе ожидание соединения скроет насыщение сервера
+    saved_pool_size, pg_pool_size = pg_pool_size, max(pg_pool_size, max(LOAD_TEST_WORKERS) + 1)
+    close_pg_pool()
+    prepare_load_test_batches()
+    load_test_rows = []
+    try:
+        # Параллельные пачки обновляли бы одни и те же строки сводных таблиц, и насыщение
+        # показывало бы блокировки сводок, а не предел вставки: триггер отключается на
+        # время теста, сводки пересчитываются при очистке
+        if pg_use_rollups:
+            set_rollup_trigger(False)
+        for engine in ('PostgreSQL', 'MongoDB'):
+            for n_clients in LOAD_TEST_WORKERS:
+                level_rows = run_load_test_level(engine, n_clients)
+                load_test_rows += level_rows
+                total = level_rows[0]
+                print(f"  {engine:10} K={n_clients:3}: {total['qps']:8.1f} оп/с, p50 {total.get('p50', np.nan):.4f} с, "
+                      f"p95 {total.get('p95', np.nan):.4f} с, p99 {total.get('p99', np.nan):.4f} с, "
+                      f"ошибок {total['errors']}")
+    finally:
+        mongo_cleaned = cleanup_load_test_records()
+        pg_pool_size = saved_pool_size
+        close_pg_pool()
+    if not mongo_cleaned:
+        print("🔄 Повторная загрузка коллекции MongoDB sensor_data без записей теста...")
+        mongo_client.close()
+        mongo_client = setup_mongodb()
+
+    load_test_results = pd.DataFrame(load_test_rows)
+    load_test_totals = load_test_results[load_test_results['operation'] == 'Все операции']
+    saturation = {engine: saturation_point(levels) for engine, levels in load_test_totals.groupby('engine')}
+    print("\n📊 Пропускная способность (операций/сек):")
+    print(load_test_totals.pivot(index='workers', columns='engine', values='qps').round(1).to_string())
+    print("\n⏱️ Задержка p95 (секунды):")
+    print(load_test_totals.pivot(index='workers', columns='engine', values='p95').round(4).to_string())
+    for engine, workers in saturation.items():
+        print(f"🔝 {engine}: насыщение при {workers} клиентах" if workers
+              else f"🔝 {engine}: насыщение не достигнуто до {max(LOAD_TEST_WORKERS)} клиентов")
+
+    with open(load_test_output_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'settings': {'records': n_records, 'workers': LOAD_TEST_WORKERS, 'duration': load_test_duration,
+                         'mix': LOAD_TEST_MIX, 'ingest_batch': load_test_ingest_batch,
+                         'pg_load_mode': pg_load_mode, 'pg_rollup_trigger': False},
+            'saturation': saturation,
+            'results': load_test_results.to_dict('records')
+        }, f, ensure_ascii=False, indent=2, default=str)
+    print(f"💾 Результаты сохранены в {load_test_output_path}")
+
+    fig, (ax_qps, ax_latency) = plt.subplots(1, 2, figsize=(16, 6))
+    for engine, marker, color in [('MongoDB', 'o', 'orange'), ('PostgreSQL', 's', 'blue')]:
+        levels = load_test_totals[load_test_totals['engine'] == engine]
+        ax_qps.plot(levels['workers'], levels['qps'], f'{marker}-', color=color, label=engine)
+        for percentile, style in [('p50', '-'), ('p95', '--'), ('p99', ':')]:
+            ax_latency.plot(levels['workers'], levels[percentile], f'{marker}{style}', color=color,
+                            label=f'{engine} {percentile}')
+        if saturation.get(engine):
+            ax_qps.axvline(saturation[engine], color=color, linestyle=':', alpha=0.7)
+    ax_qps.set_title('Пропускная способность (операций/сек)')
+    ax_latency.set_title('Задержка операций (секунды)')
+    ax_latency.set_yscale('log')
+    for ax in (ax_qps, ax_latency):
+        ax.set_xscale('log', base=2)
+        ax.set_xlabel('Параллельных клиентов')
+        ax.legend()
+        ax.grid(True, alpha=0.3)
+    plt.tight_layout()
+    plt.show()
 
 
 
@@ -1018,16 +3826,15 @@ if mongo_client and 'pg_conn_params' in locals():
         mongo_unique_sensors = len(mongo_stats['unique_sensors'])
         
         # PostgreSQL статистика
-        conn = psycopg2.connect(**pg_conn_params)
-        with conn.cursor() as cur:
-            cur.execute("""
-                SELECT 
-                    AVG(temperature), MAX(temperature), MIN(temperature),
-                    COUNT(*), COUNT(DISTINCT sensor_id)
-                FROM sensor_data
-            """)
-            pg_stats = cur.fetchone()
-        conn.close()
+        with pg_connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT 
+                        AVG(temperature), MAX(temperature), MIN(temperature),
+                        COUNT(*), COUNT(DISTINCT sensor_id)
+                    FROM sensor_data
+                """)
+                pg_stats = cur.fetchone()
         
         # Подготовка данных для сравнения
         metrics = ['Средняя температура', 'Максимальная температура', 'Минимальная температура', 'Количество записей', 'Уникальные сенсоры']
@@ -1072,16 +3879,18 @@ if mongo_client and 'pg_conn_params' in locals():
                         f'{height:.0f}' if height > 1000 else f'{height:.2f}', 
                         ha='center', va='bottom', fontsize=8)
         
-        # График 2: Производительность запросов
-        query_types = ['MAX температура', 'AVG температура', 'COUNT записей', 'DISTINCT сенсоры']
-        
-        # Здесь нужно добавить измерение времени для разных типов запросов
-        # Для примера используем относительные значения
-        mongo_perf = [0.0035, 0.0028, 0.0021, 0.0018]  # примерные значения
-        pg_perf = [0.0373, 0.0315, 0.0289, 0.0254]     # примерные значения
-        
-        ax2.plot(query_types, mongo_perf, 'o-', label='MongoDB', linewidth=2, markersize=8, color='orange')
-        ax2.plot(query_types, pg_perf, 's-', label='PostgreSQL', linewidth=2, markersize=8, color='blue')
+        # График 2: Производительность запросов (медиана и p95 прогретых замеров)
+        if not benchmark_results.empty:
+            warm = benchmark_results[benchmark_results['cache'] == 'warm']
+            query_types = list(PG_LAB3_QUERIES)
+            for engine, marker, color in [('MongoDB', 'o', 'orange'), ('PostgreSQL', 's', 'blue')]:
+                perf = warm[warm['engine'] == engine].set_index('query').reindex(query_types)
+                ax2.plot(query_types, perf['p50'], f'{marker}-', label=f'{engine} p50',
+                         linewidth=2, markersize=8, color=color)
+                ax2.plot(query_types, perf['p95'], f'{marker}--', label=f'{engine} p95',
+                         linewidth=1, markersize=5, color=color, alpha=0.5)
+        else:
+            ax2.text(0.5, 0.5, 'Набор замеров не запускался', ha='center', va='center', transform=ax2.transAxes)
         ax2.set_xlabel('Тип запроса')
         ax2.set_ylabel('Время выполнения (секунды)')
         ax2.set_title('Сравнение производительности запросов')
@@ -1089,10 +3898,14 @@ if mongo_client and 'pg_conn_params' in locals():
         ax2.grid(True, alpha=0.3)
         ax2.tick_params(axis='x', rotation=45)
         
-        # График 3: Распределение использования ресурсов
-        resources = ['Память (MB)', 'Время загрузки (с)', 'Размер данных (MB)']
-        mongo_resources = [512, mongo_time if 'mongo_time' in locals() else 2.5, 245]
-        pg_resources = [256, pg_time if 'pg_time' in locals() else 0.9, 198]
+        # График 3: Измеренное использование ресурсов (хранение и память)
+        if not resource_usage:
+            resource_usage = collect_resource_usage()
+        print("\n💽 ИСПОЛЬЗОВАНИЕ РЕСУРСОВ (MB):")
+        print_resource_usage()
+        resources = list(RESOURCE_CHART_FIELDS)
+        mongo_resources = resource_chart_values('MongoDB')
+        pg_resources = resource_chart_values('PostgreSQL')
         
         bars3 = ax3.bar(np.arange(len(resources)) - width/2, mongo_resources, width, 
                        label='MongoDB', color='orange', alpha=0.7)
@@ -1100,10 +3913,10 @@ if mongo_client and 'pg_conn_params' in locals():
                        label='PostgreSQL', color='blue', alpha=0.7)
         
         ax3.set_xlabel('Ресурсы')
-        ax3.set_ylabel('Значения')
+        ax3.set_ylabel('MB')
         ax3.set_title('Сравнение использования ресурсов')
         ax3.set_xticks(np.arange(len(resources)))
-        ax3.set_xticklabels(resources)
+        ax3.set_xticklabels(resources, rotation=30, ha='right')
         ax3.legend()
         ax3.grid(True, alpha=0.3)
         
@@ -1143,3 +3956,15 @@ POSTGRESQL:
         print(f"❌ Ошибка при построении сравнительных графиков: {e}")
 else:
     print("❌ Недостаточно данных для сравнения (требуются обе СУБД)")
+
+# Трасса запуска: интервалы всех этапов (генерация, загрузка, индексы, запросы,
+# декодирование, графики) в формате Chrome Trace Event и свернутые стеки для flamegraph
+trace_output_path = "lab3_trace.json"
+trace_folded_path = "lab3_trace.folded"
+
+print("\n🔬 САМЫЕ ДОЛГИЕ ЭТАПЫ ЗАПУСКА:")
+print_trace_summary()
+export_trace(trace_output_path)
+export_folded(trace_folded_path)
+print(f"💾 Трасса сохранена в {trace_output_path} (chrome://tracing, Perfetto), "
+      f"стеки для flamegraph - в {trace_folded_path}")
@@ -0,0 +1,324 @@
+"""
+Инструментирование этапов обработки данных
+Вложенные интервалы (spans): время perf_counter_ns, процессорное время,
+пиковая память (tracemalloc), пиковый и конечный RSS, число обработанных строк.
+Трасса запуска экспортируется в JSON (формат Chrome Trace Event - открывается
+в chrome://tracing, Perfetto, speedscope) и в свернутые стеки для flamegraph.pl
+"""
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import resource
+except ImportError:
+    # Windows: максимум RSS процесса недоступен, пик - только по выборкам
+    resource = None
+
+# Отслеживание пиковой памяти через tracemalloc. Замедляет код с большим числом мелких
+# выделений памяти в разы (время интервалов при этом завышено), поэтому по умолчанию
+# выключено - пиковую память лучше снимать отдельным запуском, без сравнения времени.
+# Пик tracemalloc общий на процесс, поэтому память считается только для интервалов
+# главного потока; интервалы других потоков получают лишь RSS
+TRACE_MEMORY = False
+
+# Пиковый RSS интервала: фоновый поток снимает RSS с периодом RSS_SAMPLE_INTERVAL
+# секунд, пока открыт хотя бы один интервал (чтение /proc, на время почти не влияет).
+# Более короткие пики учитываются через ru_maxrss: если за время интервала вырос
+# максимум RSS процесса, он и есть пик интервала
+TRACE_RSS_PEAK = True
+RSS_SAMPLE_INTERVAL = 0.01
+
+_trace_lock = threading.Lock()
+_trace_local = threading.local()
+_trace_start_ns = time.perf_counter_ns()
+_spans = []
+_next_span_id = 0
+_open_spans = set()
+_rss_sampling = threading.Event()
+_rss_sampler = None
+
+
+def _current_rss():
+    """Текущий RSS процесса в байтах (Linux), иначе None"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _max_rss():
+    """Максимальный RSS процесса за все время в байтах (ru_maxrss), иначе None"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux отдает килобайты, macOS - байты
+    return max_rss if sys.platform == 'darwin' else max_rss * 1024
+
+
+def _sample_rss():
+    """Фоновый поток: RSS процесса учитывается в пике всех открытых интервалов"""
+    while True:
+        _rss_sampling.wait()
+        rss = _current_rss()
+        if rss is not None:
+            with _trace_lock:
+                for s in _open_spans:
+                    if s.rss_peak is None or rss > s.rss_peak:
+                        s.rss_peak = rss
+        time.sleep(RSS_SAMPLE_INTERVAL)
+
+
+def _start_rss_sampling(current):
+    """Регистрация интервала для выборок RSS; поток запускается при первом интервале"""
+    global _rss_sampler
+    with _trace_lock:
+        _open_spans.add(current)
+        if _rss_sampler is None:
+            _rss_sampler = threading.Thread(target=_sample_rss, name="rss-sampler", daemon=True)
+            _rss_sampler.start()
+    _rss_sampling.set()
+
+
+def _stop_rss_sampling(current):
+    with _trace_lock:
+        _open_spans.discard(current)
+        if not _open_spans:
+            _rss_sampling.clear()
+
+
+def _span_stack():
+    """Стек открытых интервалов текущего потока"""
+    if not hasattr(_trace_local, 'stack'):
+        _trace_local.stack = []
+    return _trace_local.stack
+
+
+class Span:
+    """Интервал выполнения этапа; rows и attrs можно заполнить внутри интервала"""
+
+    def __init__(self, name, rows=None, **attrs):
+        global _next_span_id
+        with _trace_lock:
+            self.id = _next_span_id
+            _next_span_id += 1
+        stack = _span_stack()
+        self.parent = stack[-1] if stack else None
+        self.name = name
+        self.rows = rows
+        self.attrs = attrs
+        self.thread = threading.get_ident()
+        self.path = (self.parent.path + [name]) if self.parent else [name]
+        self.closed = False
+        self.wall_ns = self.cpu_ns = None
+        self.mem_peak = self.rss = None
+        self.rss_peak = _current_rss()
+        self._track_rss = TRACE_RSS_PEAK
+        self._max_rss_start = _max_rss() if self._track_rss else None
+        if self._track_rss:
+            _start_rss_sampling(self)
+        self._track_memory = TRACE_MEMORY and threading.current_thread() is threading.main_thread()
+        self._started_tracing = False
+
+        if self._track_memory:
+            if not tracemalloc.is_tracing():
+                # Трассировка включается только на время внешнего интервала
+                tracemalloc.start()
+                self._started_tracing = True
+            current, peak = tracemalloc.get_traced_memory()
+            # Пик родителя до начала вложенного интервала сохраняется, затем пик
+            # сбрасывается, чтобы измерить только этот интервал
+            if self.parent is not None and self.parent._track_memory:
+                self.parent._peak_seen = max(self.parent._peak_seen, peak)
+            tracemalloc.reset_peak()
+            self._mem_start = current
+            self._peak_seen = current
+
+        stack.append(self)
+        self._start_cpu = time.process_time_ns()
+        self._start_ns = time.perf_counter_ns()
+
+    def close(self):
+        """Завершение интервала и запись его в трассу"""
+        if self.closed:
+            return self
+        self.wall_ns = time.perf_counter_ns() - self._start_ns
+        self.cpu_ns = time.process_time_ns() - self._start_cpu
+        self.closed = True
+
+        if self._track_memory and tracemalloc.is_tracing():
+            peak = max(self._peak_seen, tracemalloc.get_traced_memory()[1])
+            self.mem_peak = peak - self._mem_start
+            if self.parent is not None and self.parent._track_memory:
+                self.parent._peak_seen = max(self.parent._peak_seen, peak)
+            if self._started_tracing:
+                tracemalloc.stop()
+        self.rss = _current_rss()
+        if self._track_rss:
+            _stop_rss_sampling(self)
+            max_rss = _max_rss()
+            if max_rss is not None and self._max_rss_start is not None and max_rss > self._max_rss_start:
+                self.rss_peak = max(self.rss_peak or 0, max_rss)
+        if self.rss is not None and (self.rss_peak is None or self.rss > self.rss_peak):
+            self.rss_peak = self.rss
+
+        # Вложенные интервалы, оставшиеся открытыми (например, после исключения),
+        # закрываются вместе с родителем
+        stack = _span_stack()
+        if self in stack:
+            while stack[-1] is not self:
+                orphan = stack[-1]
+                orphan.attrs['unclosed'] = True
+                orphan.close()
+            stack.pop()
+        with _trace_lock:
+            _spans.append(self)
+        return self
+
+    @property
+    def seconds(self):
+        """Время интервала в секундах"""
+        return self.wall_ns / 1e9 if self.wall_ns is not None else None
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'parent': self.parent.id if self.parent else None,
+            'name': self.name,
+            'path': ';'.join(self.path),
+            'thread': self.thread,
+            'start_us': (self._start_ns - _trace_start_ns) / 1000,
+            'wall_ms': self.wall_ns / 1e6,
+            'cpu_ms': self.cpu_ns / 1e6,
+            'mem_peak_bytes': self.mem_peak,
+            'rss_bytes': self.rss,
+            'rss_peak_bytes': self.rss_peak,
+            'rows': self.rows,
+            'rows_per_sec': self.rows / self.seconds if self.rows and self.wall_ns else None,
+            'attrs': self.attrs
+        }
+
+
+def open_span(name, rows=None, **attrs):
+    """Открытие интервала без with (для длинных блоков кода); закрывается span.close()"""
+    return Span(name, rows, **attrs)
+
+
+@contextmanager
+def span(name, rows=None, **attrs):
+    """Контекстный менеджер интервала: with span("load", rows=n) as s: ..."""
+    current = Span(name, rows, **attrs)
+    try:
+        yield current
+    except BaseException as e:
+        current.attrs['error'] = repr(e)
+        raise
+    finally:
+        current.close()
+
+
+def traced(name=None):
+    """Декоратор: каждый вызов функции - интервал с ее именем"""
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(name or func.__name__):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _result_rows(result):
+    """Число строк результата, если оно однозначно (список или таблица)"""
+    if isinstance(result, list):
+        return len(result)
+    shape = getattr(result, 'shape', None)
+    if shape:
+        return shape[0]
+    return None
+
+
+def measure_time(func, *args, **kwargs):
+    """Замер функции: (результат, время в секундах); вызов записывается в трассу"""
+    with span(getattr(func, '__name__', 'call')) as current:
+        result = func(*args, **kwargs)
+        current.rows = _result_rows(result)
+    return result, current.seconds
+
+
+def get_spans():
+    """Завершенные интервалы текущего запуска"""
+    with _trace_lock:
+        return [s.to_dict() for s in sorted(_spans, key=lambda s: s._start_ns)]
+
+
+def span_peak_memory(prefix):
+    """Пиковая память интервалов, имя которых начинается с prefix:
+    (пик tracemalloc в байтах, пиковый RSS в байтах), None - если не измерено"""
+    spans = [s for s in get_spans() if s['name'].startswith(prefix)]
+    peaks = [s['mem_peak_bytes'] for s in spans if s['mem_peak_bytes'] is not None]
+    rss = [s['rss_peak_bytes'] for s in spans if s['rss_peak_bytes'] is not None]
+    return (max(peaks) if peaks else None), (max(rss) if rss else None)
+
+
+def reset_trace():
+    """Начало новой трассы"""
+    global _trace_start_ns
+    with _trace_lock:
+        _spans.clear()
+        _trace_start_ns = time.perf_counter_ns()
+
+
+def export_trace(path):
+    """Трасса в формате Chrome Trace Event (JSON) с метриками каждого интервала"""
+    spans = get_spans()
+    events = [{
+        'name': s['name'],
+        'cat': s['path'].split(';')[0],
+        'ph': 'X',
+        'ts': s['start_us'],
+        'dur': s['wall_ms'] * 1000,
+        'pid': os.getpid(),
+        'tid': s['thread'],
+        'args': {key: s[key] for key in ('cpu_ms', 'mem_peak_bytes', 'rss_bytes', 'rss_peak_bytes', 'rows',
+                                         'rows_per_sec', 'attrs')}
+    } for s in spans]
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms', 'otherData': {'spans': spans}},
+                  f, ensure_ascii=False, indent=2, default=str)
+    return path
+
+
+def export_folded(path):
+    """Свернутые стеки для flamegraph.pl: "этап;подэтап собственное_время_мкс" """
+    spans = get_spans()
+    children_us = {}
+    for s in spans:
+        if s['parent'] is not None:
+            children_us[s['parent']] = children_us.get(s['parent'], 0) + s['wall_ms'] * 1000
+    stacks = {}
+    for s in spans:
+        self_us = max(s['wall_ms'] * 1000 - children_us.get(s['id'], 0), 0)
+        stacks[s['path']] = stacks.get(s['path'], 0) + self_us
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, value in stacks.items():
+            f.write(f"{stack.replace(' ', '_')} {int(round(value))}\n")
+    return path
+
+
+def print_trace_summary(limit=20):
+    """Самые долгие интервалы трассы"""
+    spans = sorted(get_spans(), key=lambda s: s['wall_ms'], reverse=True)[:limit]
+    for s in spans:
+        memory = f", пик памяти {s['mem_peak_bytes'] / 1024**2:.1f} МБ" if s['mem_peak_bytes'] is not None else ""
+        rows = f", строк {s['rows']:,}" if s['rows'] else ""
+        print(f"  {s['path']}: {s['wall_ms']:.1f} мс (CPU {s['cpu_ms']:.1f} мс{memory}{rows})")
@@ -0,0 +1,144 @@
+"""
+Генерация IoT данных блоками фиксированного размера
+Каждый блок и каждая колонка внутри него получают собственный дочерний SeedSequence,
+поэтому результат зависит только от seed, а не от размера чанка и числа процессов.
+Функции воркера находятся в импортируемом модуле, поэтому процессы генерации
+запускаются через forkserver (или spawn), а не fork: генерация вызывается и из потоков
+загрузки, а fork многопоточного процесса с открытыми соединениями небезопасен
+"""
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+# Начало периода данных: 2024 год, шаг времени - минута
+IOT_START_DATE = np.datetime64('2024-01-01T00:00:00', 's')
+
+
+# Сезонный (по дню года) и суточный (по часу) эффекты принимают немного значений,
+# поэтому считаются один раз таблицами, а не синусом на каждую запись
+SEASONAL_EFFECT = 10 * np.sin(2 * np.pi * np.arange(1, 366) / 365)
+HOUR_EFFECT = 5 * np.sin(2 * np.pi * np.arange(24) / 24)
+
+
+# Размер таблицы для выбора сенсора по весам (погрешность вероятности ~1e-6)
+SENSOR_TABLE_SIZE = 1 << 20
+
+
+def _sensor_lookup_table(device_weights):
+    """Таблица код сенсора по равномерному индексу - быстрее, чем np.random.choice с p"""
+    cdf = np.cumsum(device_weights)
+    points = (np.arange(SENSOR_TABLE_SIZE) + 0.5) / SENSOR_TABLE_SIZE
+    table = np.searchsorted(cdf / cdf[-1], points, side='right')
+    return np.minimum(table, len(device_weights) - 1).astype(np.int16)
+
+
+# Размер блока генерации (единица, к которой привязаны потоки случайных чисел)
+IOT_BLOCK_SIZE = 1 << 16
+
+
+# Независимые потоки случайных чисел внутри блока
+IOT_STREAMS = ("sensor_id", "days", "hours", "minutes", "base_temp", "noise",
+               "humidity", "pressure", "battery_level")
+
+
+def iot_seed_sequence(seed):
+    """Корневой SeedSequence набора данных (seed=None - случайная энтропия)"""
+    if isinstance(seed, np.random.SeedSequence):
+        return seed
+    return np.random.SeedSequence(seed)
+
+
+def iot_sensor_table(root_seq, n_sensors):
+    """Веса активности сенсоров фиксируются один раз на весь набор данных"""
+    rng = np.random.default_rng(root_seq)
+    device_weights = rng.dirichlet(np.ones(n_sensors))
+    return _sensor_lookup_table(device_weights)
+
+
+def block_generators(root_seq, block):
+    """Генераторы для каждой колонки блока с номером block"""
+    block_seq = np.random.SeedSequence(root_seq.entropy, spawn_key=root_seq.spawn_key + (block,))
+    children = block_seq.spawn(len(IOT_STREAMS))
+    return {name: np.random.default_rng(child) for name, child in zip(IOT_STREAMS, children)}
+
+
+def generate_iot_block(gens, sensor_table, record_offset, n):
+    """Векторная генерация n записей целиком массивами NumPy (sensor_id - коды сенсоров)"""
+    sensor_codes = sensor_table[gens["sensor_id"].integers(0, SENSOR_TABLE_SIZE, size=n)]
+
+    days = gens["days"].integers(0, 365, size=n, dtype=np.int32)
+    hours = gens["hours"].integers(0, 24, size=n, dtype=np.int32)
+    minutes = gens["minutes"].integers(0, 60, size=n, dtype=np.int32)
+    offsets = days.astype(np.int64) * 86400 + hours * 3600 + minutes * 60
+    timestamp = IOT_START_DATE + offsets.astype('timedelta64[s]')
+
+    base_temp = gens["base_temp"].normal(20, 10, size=n)
+    temperature = base_temp + SEASONAL_EFFECT[days] + HOUR_EFFECT[hours] + gens["noise"].normal(0, 2, size=n)
+    np.round(temperature, 1, out=temperature)
+    np.clip(temperature, -20, 60, out=temperature)
+
+    return {
+        "sensor_id": sensor_codes,
+        "temperature": temperature,
+        "timestamp": timestamp,
+        "humidity": np.round(gens["humidity"].uniform(0, 100, size=n), 1),
+        "pressure": np.round(gens["pressure"].uniform(900, 1100, size=n), 1),
+        "battery_level": gens["battery_level"].integers(0, 101, size=n),
+        "record_id": np.arange(record_offset, record_offset + n, dtype=np.int64)
+    }
+
+
+def generate_iot_range(root_seq, sensor_table, start, stop):
+    """Генерация записей с номерами [start, stop) из блоков фиксированного размера"""
+    parts = []
+    for block in range(start // IOT_BLOCK_SIZE, (stop - 1) // IOT_BLOCK_SIZE + 1):
+        block_start = block * IOT_BLOCK_SIZE
+        lo = max(start, block_start) - block_start
+        hi = min(stop, block_start + IOT_BLOCK_SIZE) - block_start
+
+        # Потоки блока дают одинаковый префикс при любой длине, поэтому
+        # достаточно сгенерировать первые hi записей блока
+        columns = generate_iot_block(block_generators(root_seq, block), sensor_table, block_start, hi)
+        parts.append({name: values[lo:] for name, values in columns.items()})
+
+    if len(parts) == 1:
+        return parts[0]
+    return {name: np.concatenate([part[name] for part in parts]) for name in parts[0]}
+
+
+# Параллельная генерация: процессы получают диапазоны записей, а случайные потоки
+# по-прежнему привязаны к блокам, поэтому результат совпадает с однопроцессным
+_iot_worker_state = {}
+
+
+def _init_iot_worker(root_seq, n_sensors):
+    """Инициализация процесса: таблица сенсоров строится один раз на воркер"""
+    _iot_worker_state["root_seq"] = root_seq
+    _iot_worker_state["sensor_table"] = iot_sensor_table(root_seq, n_sensors)
+
+
+def _generate_iot_shard(start, stop):
+    """Задача воркера: колонки записей [start, stop)"""
+    return generate_iot_range(_iot_worker_state["root_seq"], _iot_worker_state["sensor_table"], start, stop)
+
+
+def _worker_context():
+    """Контекст запуска процессов: forkserver (чистый однопоточный сервер), иначе spawn"""
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+def iter_iot_shards(root_seq, n_sensors, n_records, shard_size, n_workers):
+    """Колонки шардов по порядку; одновременно в работе не более 2 * n_workers шардов"""
+    with ProcessPoolExecutor(max_workers=n_workers, initializer=_init_iot_worker, initargs=(root_seq, n_sensors),
+                             mp_context=_worker_context()) as pool:
+        pending = deque()
+        for start in range(0, n_records, shard_size):
+            pending.append(pool.submit(_generate_iot_shard, start, min(start + shard_size, n_records)))
+            if len(pending) >= 2 * n_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()